@@ -0,0 +1,207 @@
+"""Benchmarks of the API endpoints, at several dataset sizes.
+
+For each size, the database of the configuration (POSTGRES_* environment
+variables) is dropped, re-created and seeded with the synthetic dataset
+generator (phaunos/phaunos/dummy_data.py), then each case is run in
+process, through the Flask test client. Use a throwaway database.
+
+Each case records:
+  - latency percentiles (p50, p90, p99, in ms) over --repeat runs,
+  - the number of SQL statements of one run,
+  - the peak memory allocated by one run (tracemalloc, in KiB).
+
+Results are printed and can be saved with --save. Given a --baseline
+(saved by a previous run), cases that are slower (p50 or p90) or use
+more memory by more than --tolerance, or that execute more SQL
+statements, are reported as regressions and the exit status is 1.
+
+Usage: python benchmarks/bench_api.py [--size small] [--baseline baseline.json] [--save results.json]
+"""
+
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+import click
+from flask_jwt_extended import create_access_token
+from phaunos import create_app
+
+
+SIZES = {
+    # 50k annotations (2500 per project)
+    'small': dict(n_audios=100, n_audios_per_project=20),
+    # 500k annotations (25k per project)
+    'medium': dict(n_audios=1000, n_audios_per_project=200),
+    # 2.5M annotations (125k per project)
+    'large': dict(n_audios=5000, n_audios_per_project=1000),
+}
+
+SEED = 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def seed_database(app, size):
+    from phaunos.shared import db
+    from phaunos.phaunos.dummy_data import put_dummy_data
+    from phaunos.phaunos.models import create_extensions
+
+    db.session.remove()
+    with db.engine.begin() as connection:
+        create_extensions(connection)
+    db.drop_all()
+    db.create_all()
+    put_dummy_data(
+        db.session.connection(),
+        app.config['FILE_FOLDER'],
+        app.config['DUMMY_DATA_FOLDER'],
+        seed=SEED,
+        **SIZES[size])
+    db.session.commit()
+
+
+def make_cases(app):
+    """Return a dict mapping case names to functions running one request."""
+
+    from phaunos.shared import db
+    from phaunos.phaunos.models import Project, UserProjectRel, Role, Annotation, audio_project_rel
+    from phaunos.user.models import User
+
+    project = Project.query.order_by(Project.id).first()
+    project_id = project.id
+    audio_id = db.session.query(audio_project_rel.c.audio_id) \
+        .filter(audio_project_rel.c.project_id==project_id).first()[0]
+    admin = User.query.join(UserProjectRel) \
+        .filter(UserProjectRel.project_id==project_id) \
+        .filter(UserProjectRel.user_role==Role.PROJECTADMIN).first()
+    member = User.query.join(UserProjectRel) \
+        .filter(UserProjectRel.project_id==project_id) \
+        .filter(UserProjectRel.user_role==Role.PROJECTMEMBER).first()
+    tag_id = db.session.query(Annotation.tag_id) \
+        .filter(Annotation.project_id==project_id).first()[0]
+    headers = {'Authorization': 'Bearer ' + create_access_token(identity=admin.username)}
+    member_headers = {'Authorization': 'Bearer ' + create_access_token(identity=member.username)}
+    client = app.test_client()
+
+    def get(url, headers=headers):
+        def run():
+            resp = client.get(url, headers=headers)
+            # consume streamed responses
+            resp.get_data()
+            assert resp.status_code == 200, (url, resp.status_code)
+        return run
+
+    def percentage_of_completion():
+        db.session.expire_all()
+        Project.query.get(project_id).percentage_of_completion
+
+    return {
+        'projects': get('/api/phaunos/projects?per_page=100'),
+        'tagsets': get(f'/api/phaunos/tagsets?project_id={project_id}&per_page=100'),
+        'audios': get(f'/api/phaunos/audios?project_id={project_id}&per_page=1000'),
+        'annotations': get(f'/api/phaunos/annotations?project_id={project_id}&per_page=1000'),
+        'annotations_by_audio': get(f'/api/phaunos/annotations?project_id={project_id}&audio_id={audio_id}&per_page=1000'),
+        'annotations_by_tag': get(f'/api/phaunos/annotations?project_id={project_id}&tag_id={tag_id}&per_page=1000'),
+        'annotations_as_member': get(f'/api/phaunos/annotations?project_id={project_id}&per_page=1000',
+            headers=member_headers),
+        'annotations_by_time_range': get(f'/api/phaunos/annotations?project_id={project_id}&start=1&end=1.5&per_page=1000'),
+        'annotations_by_audio_time_range': get(f'/api/phaunos/annotations?project_id={project_id}&audio_id={audio_id}&start=1&end=1.5&per_page=1000'),
+        'annotations_export': get(f'/api/phaunos/annotations?project_id={project_id}&web=1&format=json'),
+        'statistics': get(f'/api/phaunos/projects/{project_id}/statistics'),
+        'percentage_of_completion': percentage_of_completion,
+    }
+
+
+def run_case(run, repeat, warmup):
+    from phaunos.shared import db
+    from phaunos.query_budget import count_queries
+
+    for _ in range(warmup):
+        run()
+        db.session.remove()
+
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - t0) * 1000)
+        db.session.remove()
+
+    with count_queries() as counter:
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    db.session.remove()
+
+    return {
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'queries': counter.count,
+        'peak_kib': peak / 1024,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for size, cases in results.items():
+        for name, result in cases.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            for key in ('p50', 'p90', 'peak_kib'):
+                if result[key] > base[key] * (1 + tolerance):
+                    regressions.append(f'{size}/{name}: {key} {base[key]:.1f} -> {result[key]:.1f}')
+            if result['queries'] > base['queries']:
+                regressions.append(f'{size}/{name}: queries {base["queries"]} -> {result["queries"]}')
+    return regressions
+
+
+@click.command()
+@click.option('--size', 'sizes', type=click.Choice(list(SIZES)), multiple=True,
+    help='Dataset size (repeatable, default: all).')
+@click.option('--case', 'case_names', multiple=True, help='Case to run (repeatable, default: all).')
+@click.option('--repeat', type=int, default=20, help='Number of timed runs per case.')
+@click.option('--warmup', type=int, default=2, help='Number of untimed runs per case.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Results to compare with.')
+@click.option('--tolerance', type=float, default=0.2, help='Allowed relative slowdown.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Save the results to this file.')
+def main(sizes, case_names, repeat, warmup, baseline, tolerance, save):
+    app = create_app(testing=True)
+    app.config['QUERY_BUDGET_STRICT'] = False
+    app.config['FILE_FOLDER'] = tempfile.mkdtemp(prefix='phaunos-bench-')
+
+    results = {}
+    with app.app_context():
+        for size in sizes or SIZES:
+            click.echo(f'seeding {size} dataset...')
+            seed_database(app, size)
+            cases = make_cases(app)
+            results[size] = {}
+            for name in case_names or cases:
+                result = run_case(cases[name], repeat, warmup)
+                results[size][name] = result
+                click.echo('{:<8} {:<28} p50 {p50:8.1f}ms  p90 {p90:8.1f}ms  p99 {p99:8.1f}ms  '
+                    '{queries:3d} queries  peak {peak_kib:9.0f}KiB'.format(size, name, **result))
+
+    if save:
+        with open(save, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as infile:
+            regressions = find_regressions(results, json.load(infile), tolerance)
+        for regression in regressions:
+            click.echo('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
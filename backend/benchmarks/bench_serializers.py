@@ -0,0 +1,71 @@
+"""Compare marshmallow serialization of hydrated instances with the
+row-tuple encoders of phaunos.phaunos.serializers.
+
+Runs without a database: annotations are built in memory, both as ORM
+instances and as the row tuples the encoder would select. The time spent
+hydrating instances, saved as well by the encoders, is not measured.
+
+Usage: python benchmarks/bench_serializers.py [N_ROWS]
+"""
+
+import sys
+import time
+import random
+from phaunos import create_app
+
+
+def timeit(f, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = f()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best, result
+
+
+def main(n_rows):
+    from phaunos.phaunos.models import Annotation, Audio, Tag, Project, annotation_schema
+    from phaunos.phaunos.serializers import annotation_encoder
+    from phaunos.user.models import User
+
+    rng = random.Random(0)
+    project = Project(id=1)
+    users = [User(f'user{i}', f'user{i}@phaunos.org', 'password') for i in range(10)]
+    for i, user in enumerate(users):
+        user.id = i + 1
+    audios = [Audio(id=i + 1, path=f'audio{i}.wav') for i in range(100)]
+    tags = [Tag(id=i + 1, name=f'tag{i}') for i in range(20)]
+
+    instances = []
+    for i in range(n_rows):
+        start_time = rng.uniform(0, 60)
+        audio, tag, user = rng.choice(audios), rng.choice(tags), rng.choice(users)
+        # foreign keys are set as if loaded from the database
+        a = Annotation(
+            id=i + 1,
+            start_time=start_time,
+            end_time=start_time + rng.uniform(0, 5),
+            project_id=project.id,
+            audio_id=audio.id,
+            tag_id=tag.id,
+            created_by_id=user.id)
+        a.project, a.audio, a.tag, a.created_by = project, audio, tag, user
+        instances.append(a)
+    rows = [
+        tuple(getattr(a, column.key) for column in annotation_encoder.columns)
+        for a in instances]
+
+    t_schema, expected = timeit(lambda: annotation_schema.dumps(instances, many=True))
+    t_encoder, result = timeit(lambda: annotation_encoder.dumps(rows))
+    assert result == expected, 'encoder output differs from annotation_schema.dumps'
+
+    print(f'{n_rows} annotations, {len(expected)} bytes')
+    print(f'annotation_schema.dumps:   {t_schema:.3f}s')
+    print(f'annotation_encoder.dumps:  {t_encoder:.3f}s ({t_schema / t_encoder:.1f}x)')
+
+
+if __name__ == '__main__':
+    app = create_app(testing=True)
+    with app.app_context():
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,131 @@
+"""Cold start report: time to import phaunos and to create the application,
+for each application profile (see PROFILES in phaunos/__init__.py).
+
+Each run is made in a fresh interpreter. Module execution is timed with an
+import hook (like python -X importtime, which Python 3.6 lacks): for each
+module, the cumulative time includes the modules it imports, the self time
+does not. The slowest modules of the last run of each profile are listed.
+
+Given a --budget (in ms), the exit status is 1 if the median cold start
+(import + create_app) of a profile exceeds it.
+
+Usage: python benchmarks/bench_startup.py [--profile api] [--repeat 5] [--budget 500]
+"""
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+import click
+
+
+# run in the child interpreter
+_CHILD = '''
+import sys
+import json
+import time
+import importlib.abc
+
+timings = []
+stack = []
+
+
+class TimingLoader(object):
+
+    def __init__(self, loader, name):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        stack.append(0.0)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            timings.append((self._name, elapsed * 1000, (elapsed - children) * 1000))
+
+
+class TimingFinder(importlib.abc.MetaPathFinder):
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimingLoader(spec.loader, name)
+                return spec
+        return None
+
+
+sys.meta_path.insert(0, TimingFinder())
+t0 = time.perf_counter()
+import phaunos
+t1 = time.perf_counter()
+phaunos.create_app(profile=sys.argv[1])
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'modules': timings,
+}))
+'''
+
+
+def run_child(profile):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=backend)
+    out = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', _CHILD, profile], env=env, cwd=backend)
+    return json.loads(out.decode().splitlines()[-1])
+
+
+@click.command()
+@click.option('--profile', 'profiles', multiple=True, help='Application profile (repeatable, default: all).')
+@click.option('--repeat', type=int, default=5, help='Number of runs per profile.')
+@click.option('--top', type=int, default=15, help='Number of slowest modules listed.')
+@click.option('--budget', type=float, default=None, help='Maximum median cold start (ms).')
+def main(profiles, repeat, top, budget):
+    from phaunos import PROFILES
+
+    over_budget = []
+    for profile in profiles or PROFILES:
+        runs = [run_child(profile) for _ in range(repeat)]
+        import_ms = statistics.median(run['import_ms'] for run in runs)
+        create_app_ms = statistics.median(run['create_app_ms'] for run in runs)
+        total_ms = statistics.median(run['import_ms'] + run['create_app_ms'] for run in runs)
+        modules = runs[-1]['modules']
+        click.echo(f'{profile:<8} import {import_ms:7.1f}ms  create_app {create_app_ms:7.1f}ms  '
+            f'total {total_ms:7.1f}ms  {len(modules)} modules')
+        # top-level packages, then modules, by cumulative time
+        packages = {}
+        for name, cumulative, self_time in modules:
+            packages[name.split('.')[0]] = packages.get(name.split('.')[0], 0) + self_time
+        click.echo('  packages (self time): ' + ', '.join(f'{name} {ms:.0f}ms'
+            for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]))
+        for name, cumulative, self_time in sorted(modules, key=lambda m: -m[1])[:top]:
+            click.echo(f'  {cumulative:8.1f}ms {self_time:8.1f}ms  {name}')
+        if budget is not None and total_ms > budget:
+            over_budget.append(f'{profile}: {total_ms:.1f}ms > {budget:.1f}ms')
+
+    for line in over_budget:
+        click.echo('OVER BUDGET ' + line)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
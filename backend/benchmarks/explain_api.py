@@ -0,0 +1,131 @@
+"""Query plan checks of the API endpoints.
+
+The database of the configuration (POSTGRES_* environment variables) is
+dropped, re-created, seeded with the synthetic dataset generator and
+analyzed, as in bench_api.py (use a throwaway database). Each case of
+bench_api.py is run once, recording its SQL statements, and every SELECT
+statement is explained with its parameters.
+
+A case fails when:
+  - a plan made with enable_seqscan=off still has a sequential scan, i.e.
+    no index can serve the statement (sequential scans of the relations
+    given with --allow-seq-scan are tolerated),
+  - the estimated total cost of a plan (made with the default settings)
+    exceeds the cost budget of the case (--max-cost, see COST_BUDGETS).
+
+The exit status is 1 if any case fails. --verbose prints the plans.
+
+Usage: python benchmarks/explain_api.py [--size small] [--case annotations] [--max-cost 5000]
+"""
+
+import sys
+import json
+import tempfile
+import click
+from phaunos import create_app
+from bench_api import SIZES, seed_database, make_cases
+
+
+# Cost budgets overriding --max-cost (None: no budget). The export reads
+# all the annotations of a project, its cost grows with the project.
+COST_BUDGETS = {
+    'annotations_export': None,
+}
+
+
+def explain(cursor, statement, parameters, seqscan=True):
+    cursor.execute('SET enable_seqscan = {}'.format('on' if seqscan else 'off'))
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+def is_select(statement):
+    return statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH')
+
+
+def check_case(db, run, max_cost, allowed_seq_scans, verbose):
+    """Run a case and return the problems found in the plans of its statements."""
+
+    from phaunos.query_budget import count_queries
+
+    with count_queries() as counter:
+        run()
+    db.session.remove()
+
+    problems = []
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in counter.statements:
+            # skip DML and executemany
+            if not is_select(statement) or isinstance(parameters, (list, tuple)):
+                continue
+            without_seqscan = explain(cursor, statement, parameters, seqscan=False)
+            plan = explain(cursor, statement, parameters)
+            summary = ' '.join(statement.split())[:120]
+            if verbose:
+                click.echo(f'    {summary}')
+                click.echo('    ' + json.dumps(plan, indent=2).replace('\n', '\n    '))
+            seq_scans = sorted({node.get('Relation Name')
+                for node in plan_nodes(without_seqscan)
+                if node['Node Type'] == 'Seq Scan'} - set(allowed_seq_scans))
+            if seq_scans:
+                problems.append(f'sequential scan of {", ".join(seq_scans)}: {summary}')
+            if max_cost is not None and plan['Total Cost'] > max_cost:
+                problems.append(f'cost {plan["Total Cost"]:.0f} > {max_cost:.0f}: {summary}')
+        connection.rollback()
+    finally:
+        connection.close()
+    return len(counter.statements), problems
+
+
+@click.command()
+@click.option('--size', 'sizes', type=click.Choice(list(SIZES)), multiple=True,
+    help='Dataset size (repeatable, default: small).')
+@click.option('--case', 'case_names', multiple=True, help='Case to check (repeatable, default: all).')
+@click.option('--max-cost', type=float, default=5000, help='Default cost budget of a statement.')
+@click.option('--allow-seq-scan', 'allowed_seq_scans', multiple=True,
+    help='Relation whose sequential scans are tolerated (repeatable).')
+@click.option('--verbose', is_flag=True, help='Print the plans.')
+def main(sizes, case_names, max_cost, allowed_seq_scans, verbose):
+    from phaunos.shared import db
+
+    app = create_app(testing=True)
+    app.config['QUERY_BUDGET_STRICT'] = False
+    app.config['FILE_FOLDER'] = tempfile.mkdtemp(prefix='phaunos-explain-')
+
+    failures = []
+    with app.app_context():
+        for size in sizes or ('small',):
+            click.echo(f'seeding {size} dataset...')
+            seed_database(app, size)
+            db.session.execute('ANALYZE')
+            db.session.commit()
+            cases = make_cases(app)
+            # cache versions restart with the database: responses cached
+            # with a previous dataset would skip the queries
+            app.extensions['response_cache'].clear()
+            for name in case_names or cases:
+                n_statements, problems = check_case(db, cases[name],
+                    COST_BUDGETS.get(name, max_cost), allowed_seq_scans, verbose)
+                click.echo('{:<8} {:<28} {:3d} statements  {}'.format(
+                    size, name, n_statements, 'FAIL' if problems else 'ok'))
+                for problem in problems:
+                    click.echo(f'  {problem}')
+                    failures.append(f'{size}/{name}: {problem}')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
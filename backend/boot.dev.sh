@@ -1,3 +1,5 @@
 #!/bin/sh
+#flask create-extensions
 #flask db upgrade
+#flask partition-annotations
 exec flask run --host=0.0.0.0 --port 5000
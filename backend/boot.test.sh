@@ -1,6 +1,8 @@
 #!/bin/sh
 flask db init
+flask create-extensions
 flask db migrate
 flask db upgrade
+flask partition-annotations
 exec pytest
 
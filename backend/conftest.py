@@ -0,0 +1,111 @@
+import datetime
+import pytest
+from flask_jwt_extended import create_access_token
+from phaunos import create_app
+from phaunos.shared import db
+
+
+# Fixtures shared by the test modules. A module changes the configuration
+# of its application by overriding app_config, e.g.
+#
+#     @pytest.fixture(scope='module')
+#     def app_config():
+#         return {'PURGE_BATCH_SIZE': 2}
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Configuration values of the application of a test module."""
+    return {}
+
+
+@pytest.fixture(scope='module')
+def test_app(app_config, tmpdir_factory):
+    app = create_app(testing=True)
+    app.config['FILE_FOLDER'] = str(tmpdir_factory.mktemp('files'))
+    app.config.update(app_config)
+    with app.app_context():
+        yield app
+
+
+def _database():
+    from phaunos.phaunos.models import create_extensions
+    with db.engine.begin() as connection:
+        create_extensions(connection)
+    db.drop_all()
+    db.create_all()
+    yield db
+    db.session.remove()
+    db.drop_all()
+
+
+@pytest.fixture(scope='module')
+def test_db(test_app):
+    """Database created for a test module."""
+    yield from _database()
+
+
+@pytest.fixture
+def empty_db(test_app):
+    """Database created for each test."""
+    yield from _database()
+
+
+@pytest.fixture(scope='session')
+def new_project():
+    """Factory adding a project, without list files, to the session."""
+
+    from phaunos.phaunos.models import Project
+
+    def new_project(name='project'):
+        project = Project()
+        project.name = name
+        project.allow_regions = True
+        project.audiolist_filename = 'audiolist.csv'
+        project.taglist_filename = 'taglist.csv'
+        db.session.add(project)
+        return project
+
+    return new_project
+
+
+@pytest.fixture(scope='module')
+def project(test_app, test_db, new_project):
+    """Project of 30 audios and 10 tagsets of 3 tags, ingested, with the
+    user 'admin' as project admin."""
+
+    from phaunos.phaunos.jobs import run_next_job
+    from phaunos.phaunos.models import Project, UserProjectRel, Role
+    from phaunos.user.models import User
+
+    folder = test_app.config['FILE_FOLDER']
+    with open(f'{folder}/audiolist.csv', 'w') as audiolist_file:
+        for i in range(30):
+            audiolist_file.write(f'audio{i}.wav\n')
+    with open(f'{folder}/taglist.csv', 'w') as taglist_file:
+        for i in range(10):
+            for j in range(3):
+                taglist_file.write(f'tagset{i},tag{j}\n')
+
+    user = User('admin', 'admin@phaunos.org', 'password')
+    user.confirmed_on = datetime.datetime.now()
+    db.session.add(user)
+    p = new_project()
+    db.session.flush()
+    upr = UserProjectRel()
+    upr.user_id = user.id
+    upr.project_id = p.id
+    upr.user_role = Role.PROJECTADMIN
+    db.session.add(upr)
+    db.session.commit()
+    project_id = p.id
+
+    # ingestion (and audio indexing) are run by the job queue
+    while run_next_job():
+        pass
+    return Project.query.get(project_id)
+
+
+@pytest.fixture(scope='module')
+def headers(project):
+    return {'Authorization': 'Bearer ' + create_access_token(identity='admin')}
@@ -1,35 +1,12 @@
+import os
 import click
-import datetime
-from flask.cli import with_appcontext
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_jwt_extended import JWTManager
-from flask_mail import Mail
-import numpy as np
-import wavio
-import shutil
-import uuid
-import os
-import random
-from flask import jsonify
-from phaunos.shared import db, ma, jwt, bp_api, bp_admin_auth
-from phaunos.email_utils import mail
-from phaunos.admin import admin
-#from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
-from phaunos.phaunos.models import Tagset, Tag, Project, Annotation
-from phaunos.user.models import User
-from phaunos.admin.views import (
-    TagAdminView,
-    TagsetAdminView,
-    ProjectAdminView,
-    UserAdminView,
-    SignupView,
-)
-from phaunos.user import api
-from phaunos.phaunos import api
 from flask_cors import CORS
+from phaunos.shared import db, ma, jwt, bp_api
+from phaunos.email_utils import mail
+from phaunos.user.models import init_auth_cache
+from phaunos.metrics import init_metrics
+from phaunos.phaunos.response_cache import init_response_cache
 
 
 ######################################
@@ -37,38 +14,70 @@ from flask_cors import CORS
 ######################################
 
 
-cors = CORS(resources={r"/api/*": {"origins": "*"}}, expose_headers=['Access-Control-Allow-Origin'], supports_credentials=True)
+cors = CORS(resources={r"/api/*": {"origins": "*"}}, expose_headers=['Access-Control-Allow-Origin', 'X-Next-Cursor'], supports_credentials=True)
 
 
-def create_app(testing=False):
+# Components loaded by each application profile (APP_PROFILE, or the
+# profile argument of create_app). The modules of a component are only
+# imported when it is loaded, and CLI commands import what they need when
+# they run (see benchmarks/bench_startup.py for import times).
+#   api: the API views
+#   admin: the admin interface (Flask-Admin), which links to the API views
+#   migrations: the database migrations (Flask-Migrate, flask db)
+PROFILES = {
+    'full': ('api', 'admin', 'migrations'),
+    'api': ('api',),
+    # job and mail workers, CLI
+    'worker': (),
+}
+
+
+def create_app(testing=False, profile=None):
     app = Flask(__name__)
     app.config.from_pyfile('config.py')
     
     if testing:
         app.config['TESTING'] = True
+        app.config['QUERY_BUDGET_STRICT'] = True
 
-    initialize_extensions(app)
-    app.register_blueprint(bp_api)
-    app.register_blueprint(bp_admin_auth)
+    profile = profile or app.config['APP_PROFILE']
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown application profile: {profile}')
+    components = PROFILES[profile]
+
+    initialize_extensions(app, components)
+    if 'api' in components:
+        register_api(app)
     register_cli(app)
     return app
 
 
-def initialize_extensions(app):
+def initialize_extensions(app, components=PROFILES['full']):
     db.init_app(app)
-    migrate = Migrate(app, db)
     ma.init_app(app)
     mail.init_app(app)
     jwt.init_app(app)
     cors.init_app(app)
-
-    admin.init_app(app)
-    with app.app_context():
-        admin.add_view(TagAdminView(Tag, db.session, endpoint='admin_tag'))
-        admin.add_view(TagsetAdminView(Tagset, db.session, endpoint='admin_tagset'))
-        admin.add_view(ProjectAdminView(Project, db.session, endpoint='admin_project'))
-        admin.add_view(UserAdminView(User, db.session, endpoint='admin_user'))
-        admin.add_view(SignupView(name='Signup', endpoint='admin_signup', url='signup'))
+    init_auth_cache(app)
+    init_metrics(app)
+    init_response_cache(app)
+
+    if 'api' in components:
+        from phaunos.phaunos.uploads import init_uploads
+        init_uploads(app)
+    if 'migrations' in components:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if 'admin' in components:
+        from phaunos.admin import init_admin
+        init_admin(app)
+
+
+def register_api(app):
+    # importing the API modules registers their views on bp_api
+    import phaunos.user.api
+    import phaunos.phaunos.api
+    app.register_blueprint(bp_api)
 
 
 ################
@@ -76,201 +85,184 @@ def initialize_extensions(app):
 ################
 
 def register_cli(app):
-    
+
     @app.cli.command()
-    def delete_dummy_data():
-        
+    def create_extensions():
+        """Create the Postgres extensions of the schema (run before flask db
+        upgrade)."""
+
         from phaunos.shared import db
-        from phaunos.phaunos.models import (
-            Project,
-            UserProjectRel,
-            Tag,
-            Tagset,
-            Audio,
-            Annotation)
-        from phaunos.user.models import User
-        
-        
-        # delete dummy Annotation
-        for item in UserProjectRel.query.join(UserProjectRel.project).filter(Project.name.startswith('dummy')).all():
-            db.session.delete(item)
-        
-        # delete dummy UserProjectRel
-        for item in UserProjectRel.query.join(UserProjectRel.project).filter(Project.name.startswith('dummy')).all():
-            db.session.delete(item)
-        
-        # delete dummy User
-        for item in User.query.filter(User.username.startswith("dummy")).all():
-            db.session.delete(item)
-
-        # delete dummy Tag
-        for item in Tag.query.filter(Tag.name.startswith("dummy")).all():
-            db.session.delete(item)
-        
-        # delete dummy Tagset
-        for item in Tagset.query.filter(Tagset.name.startswith("dummy")).all():
-            db.session.delete(item)
-        
-        # delete dummy Audio
-        for item in Audio.query.filter(Audio.path.startswith("dummy")).all():
-            db.session.delete(item)
-        
-        # delete dummy Project
-        for item in Project.query.filter(Project.name.startswith("dummy")).all():
-            db.session.delete(item)
-
-        
+        from phaunos.phaunos.models import create_extensions as _create_extensions
+
+        _create_extensions(db.session.connection())
         db.session.commit()
 
-        # delete dummy data folder
-        shutil.rmtree(app.config['DUMMY_DATA_FOLDER'], ignore_errors=True)
+    @app.cli.command()
+    def partition_annotations():
+        """Partition the annotation table by project (run after flask db
+        upgrade), and move the annotations of the default partition."""
+
+        from phaunos.shared import db
+        from phaunos.phaunos.models import is_partitioned, convert_annotations
+        from phaunos.phaunos.models import partition_annotations as _partition_annotations
 
+        connection = db.session.connection()
+        if not is_partitioned(connection):
+            click.echo(f'{convert_annotations(connection)} annotations copied')
+        click.echo(f'{_partition_annotations(connection)} annotations moved')
+        db.session.commit()
 
     @app.cli.command()
-    def put_dummy_data():
-        
+    def refresh_completion():
+
         from phaunos.shared import db
-        from phaunos.phaunos.models import (
-            Project,
-            UserProjectRel,
-            Role,
-            Tag,
-            Tagset,
-            Audio,
-            Annotation)
-        from phaunos.user.models import User
-
-
-        n_tagsets = 20
-        n_tags = 80
-        n_users = 100
-        n_projects = 20
-        n_audios = 100
-        n_audios_per_project = 20
-        n_users_per_project = 5
-        n_tags_per_tagset = 4
-        n_tagsets_per_project = 5
-        n_annotators_per_audio = 3
-        n_annotations_per_annotator_per_audio = 5
-        audio_duration = 5
-        min_annotation_size=0.2
-
-        # create users
-        for i in range(n_users):
-            user = User(f'dummy_user{i}', f'user{i}@gmail.com', f'user{i}')
-            user.confirmed_on = datetime.datetime.now()
-            db.session.add(user)
-            db.session.flush()
-        users = User.query.all()
-
-        # create tags
-        for i in range(n_tags):
-            tag = Tag()
-            tag.name = f'dummy_tag{i}'
-            tag.created_by = random.choice(users)
-            db.session.add(tag)
-            db.session.flush()
-        tags = Tag.query.all()
-
-        # create tagsets
-        for i in range(n_tagsets):
-            tagset = Tagset()
-            tagset.name = f'dummy_tagset{i}'
-            tagset.tags.extend(random.sample(tags, n_tags_per_tagset))
-            tagset.created_by = random.choice(users)
-            db.session.add(tagset)
-            db.session.flush()
-        tagsets = Tagset.query.all()
-
-        # create audios
-        audio_path = os.path.join(app.config['DUMMY_DATA_FOLDER'], 'audio_files')
-        os.makedirs(audio_path, exist_ok=True)
-        for i in range(n_audios):
-            path = os.path.join(audio_path, str(uuid.uuid4()) + '.wav')
-            create_random_wav(path, duration=5)
-            audio = Audio()
-            audio.path = path
-            audio.created_by = random.choice(users)
-            db.session.add(audio)
-            db.session.flush()
-        audios = Audio.query.all()
-        
-        # create audio list files
-        audiolist_filenames = []
-        audiolist_path = os.path.join(app.config['FILE_FOLDER'], app.config['DUMMY_DATA_FOLDER'], 'audiolist_files')
-        os.makedirs(audiolist_path, exist_ok=True)
-        for i in range(n_projects):
-            audiolist_filename = os.path.join(audiolist_path,  str(uuid.uuid4()) + '.csv')
-            with open(audiolist_filename, 'w') as audiolist_file:
-                for a in random.sample(audios, n_audios_per_project):
-                    audiolist_file.write(a.path + '\n')
-            audiolist_filenames.append(os.path.relpath(audiolist_filename, app.config['FILE_FOLDER']))
-        
-        
-        # create tag list files
-        taglist_filenames = []
-        taglist_path = os.path.join(app.config['FILE_FOLDER'], app.config['DUMMY_DATA_FOLDER'], 'taglist_files')
-        os.makedirs(taglist_path, exist_ok=True)
-        for i in range(n_projects):
-            taglist_filename = os.path.join(taglist_path,  str(uuid.uuid4()) + '.csv')
-            with open(taglist_filename, 'w') as taglist_file:
-                for tagset in random.sample(tagsets, n_tagsets_per_project):
-                    for tag in tagset.tags:
-                        taglist_file.write(tagset.name + ',' + tag.name + '\n')
-            taglist_filenames.append(os.path.relpath(taglist_filename, app.config['FILE_FOLDER']))
-
-        # create projects
-        for i in range(n_projects):
-            p = Project()
-            p.name = f'dummy_project{i}'
-            p.audio_root_url = "http://127.0.0.1:5000"
-            p.allow_regions = random.choice([True, False])
-            p.audiolist_filename = random.choice(audiolist_filenames)
-            p.taglist_filename = random.choice(taglist_filenames)
-#            p.created_by = random.choice(users)
-            db.session.add(p)
-            db.session.flush()
-            # add users
-            p_users = random.sample(users, n_users_per_project)
-            has_admin = False
-            for u in p_users:
-                upr = UserProjectRel()
-                upr.project_id = p.id
-                upr.user_id =u.id
-                if has_admin:
-                    upr.user_role = Role.PROJECTMEMBER
-                else:
-                    upr.user_role = Role.PROJECTADMIN
-                    has_admin = True
-                db.session.add(upr)
-                db.session.flush()
-
-
-        projects = Project.query.all()
-
-        # create annotations
-        for p in projects:
-            audios = Audio.query.filter(Audio.projects.any(Project.id==p.id)).all()
-            user_ids = [upr.user_id for upr in p.user_project_rel]
-            for audio in audios:
-                annotators = User.query.filter(User.id.in_(user_ids)).all()
-                for annotator in annotators:
-                    for i in range(n_annotations_per_annotator_per_audio):
-                        for tagset in p.tagsets:
-                            annotation = Annotation()
-                            annotation.start_time = random.uniform(0, audio_duration - min_annotation_size)
-                            annotation.end_time = random.uniform(annotation.start_time + min_annotation_size, audio_duration)
-                            annotation.tag_id = random.choice(tagset.tags).id
-                            annotation.project_id = p.id
-                            annotation.audio_id = audio.id
-                            annotation.created_by_id = annotator.id
-                            db.session.add(annotation)
+        from phaunos.phaunos.models import Project
+        from phaunos.phaunos.models import refresh_completion as _refresh_completion
 
+        for project_id, in db.session.query(Project.id).all():
+            _refresh_completion(db.session.connection(), project_id)
         db.session.commit()
 
+    @app.cli.command()
+    def refresh_statistics():
 
-def create_random_wav(filename, sr=11025, duration=2):
-    x = np.random.rand(duration * sr) * 2 - 1
-    wavio.write(filename, x, sr, sampwidth=2)
-    
+        from phaunos.shared import db
+        from phaunos.phaunos.models import Project
+        from phaunos.phaunos.models import refresh_statistics as _refresh_statistics
+
+        for project_id, in db.session.query(Project.id).all():
+            _refresh_statistics(db.session.connection(), project_id)
+        db.session.commit()
+
+    @app.cli.command()
+    @click.argument('project_id', type=int)
+    @click.option('--workers', type=int, default=None, help='Number of processes (default: number of CPUs).')
+    def precompute_spectrograms(project_id, workers):
+
+        from phaunos.phaunos.models import Project, Audio
+        from phaunos.phaunos.spectrogram import params_from_config, precompute_tiles
+
+        paths = [audio.file_path for audio in
+            Audio.query.filter(Audio.projects.any(Project.id==project_id)).all()]
+        cache_folder = os.path.join(app.config['FILE_FOLDER'], app.config['SPECTROGRAM_CACHE_FOLDER'])
+        for i, (path, error) in enumerate(precompute_tiles(
+                paths, params_from_config(app.config), cache_folder, workers)):
+            click.echo('[{}/{}] {}{}'.format(i + 1, len(paths), path,
+                ' failed: {!r}'.format(error) if error else ''))
+
+    @app.cli.command()
+    @click.option('--project-id', type=int, default=None, help='Only index the audios of this project.')
+    @click.option('--force', is_flag=True, help='Re-scan files even if their size and mtime did not change.')
+    @click.option('--workers', type=int, default=None, help='Number of processes (default: number of CPUs).')
+    def index_audios(project_id, force, workers):
+
+        from phaunos.shared import db
+        from phaunos.phaunos.models import audio_project_rel
+        from phaunos.phaunos.audio_index import index_audios as _index_audios
+
+        audio_ids = None
+        if project_id is not None:
+            audio_ids = [audio_id for audio_id, in db.session.query(audio_project_rel.c.audio_id)
+                .filter(audio_project_rel.c.project_id==project_id)]
+        n_scanned = n_errors = 0
+        for audio_id, error in _index_audios(
+                db.session.connection(),
+                app.config['FILE_FOLDER'],
+                audio_ids=audio_ids,
+                force=force,
+                workers=workers,
+                batch_size=app.config['AUDIO_INDEX_BATCH_SIZE']):
+            n_scanned += 1
+            if error:
+                n_errors += 1
+                click.echo(f'audio {audio_id}: {error}')
+        db.session.commit()
+        click.echo(f'{n_scanned} files scanned, {n_errors} errors')
+
+    @app.cli.command()
+    @click.argument('model', type=click.Choice(['user', 'tag', 'audio']))
+    @click.argument('object_id', type=int)
+    def purge(model, object_id):
+        """Queue the deletion of a user, tag or audio with its annotations,
+        in batches (run by the workers)."""
+
+        from phaunos.shared import db
+        from phaunos.phaunos.jobs import enqueue_purge
+
+        job_id = enqueue_purge(db.session.connection(), model, object_id)
+        db.session.commit()
+        click.echo(f'job {job_id}')
+
+    @app.cli.command()
+    @click.option('--once', is_flag=True, help='Exit when there is no job left.')
+    def worker(once):
+        """Run queued jobs."""
+
+        from phaunos.phaunos.jobs import work
+
+        work(app.config['JOB_POLL_INTERVAL'], once=once)
+
+    @app.cli.command()
+    @click.option('--threads', type=int, default=None, help='Number of delivery threads (default: MAIL_WORKER_THREADS).')
+    @click.option('--once', is_flag=True, help='Exit when there is no due message left.')
+    def mail_worker(threads, once):
+        """Deliver queued emails."""
+
+        from phaunos.email_utils import mail_worker as _mail_worker
+
+        _mail_worker(
+            app,
+            threads or app.config['MAIL_WORKER_THREADS'],
+            app.config['MAIL_OUTBOX_POLL_INTERVAL'],
+            once=once)
+
+    @app.cli.command()
+    def delete_dummy_data():
+
+        import shutil
+        from phaunos.shared import db
+        from phaunos.phaunos.dummy_data import delete_dummy_data as _delete_dummy_data
+
+        _delete_dummy_data(db.session.connection(), app.config['DUMMY_DATA_FOLDER'])
+        db.session.commit()
+
+        # delete dummy data folder
+        shutil.rmtree(
+            os.path.join(app.config['FILE_FOLDER'], app.config['DUMMY_DATA_FOLDER']),
+            ignore_errors=True)
+
+
+    @app.cli.command()
+    @click.option('--seed', type=int, default=0, help='Random seed.')
+    @click.option('--workers', type=int, default=None, help='Number of processes writing audio files (default: number of CPUs).')
+    @click.option('--batch-size', type=int, default=10000, help='Number of rows per insert.')
+    @click.option('--n-users', type=int, default=100)
+    @click.option('--n-tags', type=int, default=80)
+    @click.option('--n-tagsets', type=int, default=20)
+    @click.option('--n-projects', type=int, default=20)
+    @click.option('--n-audios', type=int, default=100)
+    @click.option('--n-audios-per-project', type=int, default=20)
+    @click.option('--n-users-per-project', type=int, default=5)
+    @click.option('--n-tags-per-tagset', type=int, default=4)
+    @click.option('--n-tagsets-per-project', type=int, default=5)
+    @click.option('--n-annotations-per-annotator-per-audio', type=int, default=5)
+    def put_dummy_data(seed, workers, batch_size, **sizes):
+        """Generate a synthetic dataset. Each project gets
+        n_audios_per_project * n_users_per_project * n_tagsets_per_project
+        * n_annotations_per_annotator_per_audio annotations. Dummy users
+        have the password "dummy"."""
+
+        from phaunos.shared import db
+        from phaunos.phaunos.dummy_data import put_dummy_data as _put_dummy_data
+
+        _put_dummy_data(
+            db.session.connection(),
+            app.config['FILE_FOLDER'],
+            app.config['DUMMY_DATA_FOLDER'],
+            seed=seed,
+            workers=workers,
+            batch_size=batch_size,
+            echo=click.echo,
+            **sizes)
+        db.session.commit()
 
@@ -1,20 +1,33 @@
 from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
-from phaunos.phaunos.models import Tagset, Tag, Project, Annotation
+from phaunos.shared import db, bp_admin_auth
+from phaunos.phaunos.models import Tagset, Tag, Project
 from phaunos.user.models import User
-from phaunos.shared import db
 from .views import (
     PhaunosAdminIndexView,
     TagAdminView,
     TagsetAdminView,
     ProjectAdminView,
     UserAdminView,
+    SignupView,
 )
 
 
-admin = Admin(
-    index_view=PhaunosAdminIndexView(),
-    name='phaunos',
-    template_mode='bootstrap3',
-    base_template='admin/phaunos_base.html'
-)
+def init_admin(app):
+    """Create the admin interface of an application."""
+
+    # views are bound to their Admin, so each application gets its own
+    admin = Admin(
+        app,
+        index_view=PhaunosAdminIndexView(),
+        name='phaunos',
+        template_mode='bootstrap3',
+        base_template='admin/phaunos_base.html'
+    )
+    with app.app_context():
+        admin.add_view(TagAdminView(Tag, db.session, endpoint='admin_tag'))
+        admin.add_view(TagsetAdminView(Tagset, db.session, endpoint='admin_tagset'))
+        admin.add_view(ProjectAdminView(Project, db.session, endpoint='admin_project'))
+        admin.add_view(UserAdminView(User, db.session, endpoint='admin_user'))
+        admin.add_view(SignupView(name='Signup', endpoint='admin_signup', url='signup'))
+    app.register_blueprint(bp_admin_auth)
+    return admin
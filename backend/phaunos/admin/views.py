@@ -1,6 +1,6 @@
 import os
 import re
-from flask import current_app, make_response, url_for, request
+from flask import current_app, make_response, url_for, request, flash, g
 from markupsafe import Markup
 from flask_admin.contrib.sqla import ModelView
 import uuid
@@ -12,10 +12,11 @@ from flask_admin import AdminIndexView, expose
 from flask_admin.base import BaseView
 from flask_admin.contrib import sqla
 from flask_admin.form import Select2Widget, FileUploadField, rules
-from flask_admin.actions import ActionsMixin
+from flask_admin.actions import ActionsMixin, action
 
-from phaunos.phaunos.models import Tagset, Tag, Project, UserProjectRel, Audio, Role
+from phaunos.phaunos.models import Tagset, Tag, Project, UserProjectRel, Audio, Role, Job, JobState, ProjectCompletion
 from phaunos.phaunos.models import validate_audiolist, validate_taglist
+from phaunos.phaunos.jobs import enqueue_purge
 from phaunos.user.models import User
 
 from phaunos.shared import db
@@ -74,6 +75,23 @@ class PhaunosModelView(PhaunosBaseView, ModelView):
             return False
         return True
 
+class PurgeActionMixin(object):
+    """Action deleting the selected rows with their annotations in
+    background (purge jobs), for rows with too many annotations to be
+    deleted in a request."""
+
+    # key of CASCADING_MODELS
+    purge_model = None
+
+    @action('purge', 'Delete in background',
+        'Delete the selected rows and their annotations in background?')
+    def action_purge(self, ids):
+        for object_id in ids:
+            enqueue_purge(db.session.connection(), self.purge_model, int(object_id))
+        db.session.commit()
+        flash(f'{len(ids)} deletions queued.')
+
+
 class PhaunosAdminIndexView(PhaunosBaseView, AdminIndexView):
     def is_visible(self):
         return False
@@ -91,7 +109,8 @@ class SignupView(PhaunosBaseView):
 
 
 
-class UserAdminView(PhaunosModelView):
+class UserAdminView(PurgeActionMixin, PhaunosModelView):
+    purge_model = 'user'
     can_create = False
     column_exclude_list = ['password',]
     form_excluded_columns = ['annotations', 'user_project_rel']
@@ -121,7 +140,8 @@ class UserAdminView(PhaunosModelView):
         return form
     
     
-class TagAdminView(PhaunosModelView):
+class TagAdminView(PurgeActionMixin, PhaunosModelView):
+    purge_model = 'tag'
     column_exclude_list = ['annotations',]
     form_excluded_columns = ['annotations',]
     form_widget_args = {
@@ -167,16 +187,40 @@ class ProjectAdminView(PhaunosModelView):
                        'allow_regions', 'tagsets', 'users',
                        'audiolist_filename', 'taglist_filename')
 
-    def _get_annotations(view, context, project, name):
+    def get_list(self, *args, **kwargs):
+        count, projects = super(ProjectAdminView, self).get_list(*args, **kwargs)
+        # loaded for the whole page, read by the column formatters
+        project_ids = [project.id for project in projects]
+        g.ingest_jobs = latest_ingest_jobs(project_ids)
+        g.completions = dict.fromkeys(project_ids)
+        if project_ids:
+            g.completions.update((completion.project_id, completion) for completion in
+                ProjectCompletion.query.filter(ProjectCompletion.project_id.in_(project_ids)))
+        return count, projects
 
+    def _get_annotations(view, context, project, name):
 
+        completions = g.get('completions', {})
+        if project.id in completions:
+            perc = project.completion_percentage(completions[project.id])
+        else:
+            perc = project.percentage_of_completion
 
         _html = '''<form action="{url}" method="get">
                 <input id="project_id" name="project_id"  type="hidden" value="{project_id}">
                 <input id="web" name="web"  type="hidden" value=1>
                 <button type='submit'>Download annotations</button>
             </form> ({perc}% completed)
-        '''.format(url=url_for('bp_api.annotations'), project_id=project.id, perc=project.percentage_of_completion)
+        '''.format(url=url_for('bp_api.annotations'), project_id=project.id, perc=perc)
+
+        # state of the ingestion of the audio list and tag list files
+        ingest_jobs = g.get('ingest_jobs', {})
+        if project.id not in ingest_jobs:
+            ingest_jobs = latest_ingest_jobs([project.id])
+        job = ingest_jobs.get(project.id)
+        if job and job.state != JobState.SUCCEEDED:
+            _html += '<span class="job-status" data-url="{}"></span>'.format(
+                url_for('bp_api.job_detail', job_id=job.id))
 
         return Markup(_html)
 
@@ -203,10 +247,7 @@ class ProjectAdminView(PhaunosModelView):
         
     
     def create_form(self, obj=None):
-        current_app.logger.info("In create_form")
         form = super(ProjectAdminView, self).create_form(obj)
-        current_app.logger.info(id(request))
-        current_app.logger.info(request.headers)
         verify_jwt_in_request()
         return form
 
@@ -226,12 +267,23 @@ class ProjectAdminView(PhaunosModelView):
         return form
 
     def on_model_change(self, form, model, is_created):
-        current_app.logger.info("In on_model_change")
-        current_app.logger.info(id(request))
-        current_app.logger.info(request.headers)
         verify_jwt_in_request()
 
 
+def latest_ingest_jobs(project_ids):
+    """Map the ids of projects to their last ingestion job (id, state), in
+    a single query. Projects without ingestion job are mapped to None."""
+    jobs = dict.fromkeys(project_ids)
+    if project_ids:
+        rows = db.session.query(Job.project_id, Job.id, Job.state) \
+            .filter(Job.project_id.in_(project_ids)) \
+            .filter(Job.kind=='ingest_project') \
+            .distinct(Job.project_id) \
+            .order_by(Job.project_id, Job.id.desc())
+        jobs.update((row.project_id, row) for row in rows)
+    return jobs
+
+
 def random_name(obj, file_data):
     return str(uuid.uuid4()) + ".csv"
 
@@ -0,0 +1,112 @@
+import time
+import threading
+import collections
+from sqlalchemy import event
+from phaunos.shared import db
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache whose entries expire ttl seconds after insertion.
+
+    At most maxsize entries are kept, the least recently used ones being
+    evicted first.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires <= self._timer():
+                self._discard(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._discard(key)
+            self._insert(key, value)
+            while self._full():
+                self._discard(next(iter(self._data)))
+
+    def pop(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _insert(self, key, value):
+        self._data[key] = (self._timer() + self.ttl, value)
+
+    def _discard(self, key):
+        return self._data.pop(key, None)
+
+    def _full(self):
+        return len(self._data) > self.maxsize
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SizedTTLCache(TTLCache):
+    """TTLCache also bounded by the total size of its values, as given by
+    sizeof. Values larger than maxbytes are not cached.
+    """
+
+    def __init__(self, maxsize, ttl, maxbytes, sizeof=len, timer=time.monotonic):
+        super(SizedTTLCache, self).__init__(maxsize, ttl, timer)
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._sizeof = sizeof
+
+    def set(self, key, value):
+        if self._sizeof(value) > self.maxbytes:
+            self.pop(key)
+        else:
+            super(SizedTTLCache, self).set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _insert(self, key, value):
+        super(SizedTTLCache, self)._insert(key, value)
+        self.nbytes += self._sizeof(value)
+
+    def _discard(self, key):
+        item = super(SizedTTLCache, self)._discard(key)
+        if item is not None:
+            self.nbytes -= self._sizeof(item[1])
+        return item
+
+    def _full(self):
+        return super(SizedTTLCache, self)._full() or self.nbytes > self.maxbytes
+
+
+def invalidate(session, cache, keys):
+    """Remove keys from cache now and again when the session transaction ends,
+    in case another request cached the old value in between."""
+    keys = list(keys)
+    for key in keys:
+        cache.pop(key)
+    session.info.setdefault('cache_invalidations', []).append((cache, keys))
+
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_rollback')
+def invalidate_on_transaction_end(session):
+    for cache, keys in session.info.pop('cache_invalidations', []):
+        for key in keys:
+            cache.pop(key)
@@ -13,8 +13,30 @@ POSTGRES_SERVER = os.environ['POSTGRES_SERVER']
 SQLALCHEMY_DATABASE_URI = f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}/{POSTGRES_DB}'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Read replicas (see phaunos/routing.py): comma-separated host[:port] list,
+# with the database, user and password of the primary
+POSTGRES_REPLICA_SERVERS = [server for server in os.environ.get('POSTGRES_REPLICA_SERVERS', '').split(',') if server]
+SQLALCHEMY_REPLICA_URIS = [f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{server}/{POSTGRES_DB}'
+    for server in POSTGRES_REPLICA_SERVERS]
+
+# Connection pools, per engine (the primary and each replica)
+SQLALCHEMY_POOL_SIZE = int(os.environ.get('SQLALCHEMY_POOL_SIZE', 10))
+SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', 10))
+SQLALCHEMY_REPLICA_POOL_SIZE = int(os.environ.get('SQLALCHEMY_REPLICA_POOL_SIZE', 10))
+SQLALCHEMY_REPLICA_MAX_OVERFLOW = int(os.environ.get('SQLALCHEMY_REPLICA_MAX_OVERFLOW', 10))
+
+# Statement timeouts (milliseconds, 0 for none). The primary one also
+# applies to the job and mail workers.
+SQLALCHEMY_STATEMENT_TIMEOUT = int(os.environ.get('SQLALCHEMY_STATEMENT_TIMEOUT', 0))
+SQLALCHEMY_REPLICA_STATEMENT_TIMEOUT = int(os.environ.get('SQLALCHEMY_REPLICA_STATEMENT_TIMEOUT', 30000))
+
+# Components of the application: 'full', 'api' or 'worker' (see create_app)
+APP_PROFILE = os.environ.get('APP_PROFILE', 'full')
+
 FILE_FOLDER = '/app/files'
 UPLOAD_FOLDER = 'uploads'
+# Uploaded audio files, by content (see phaunos/phaunos/uploads.py)
+AUDIO_STORE_FOLDER = 'audio_store'
 DUMMY_DATA_FOLDER = 'dummy_data'
 
 CONFIRMATION_TOKEN_EXPIRATION = int(os.environ['CONFIRMATION_TOKEN_EXPIRATION'])
@@ -28,6 +50,15 @@ MAIL_DEFAULT_SENDER = os.environ['MAIL_DEFAULT_SENDER']
 MAIL_USERNAME = os.environ['MAIL_USERNAME']
 MAIL_PASSWORD = os.environ['MAIL_PASSWORD']
 
+# Mail outbox (see phaunos/email_utils.py)
+MAIL_OUTBOX_BATCH_SIZE = 50
+MAIL_OUTBOX_MAX_ATTEMPTS = 8
+# Delay before the first retry (seconds), doubled at each attempt
+MAIL_OUTBOX_RETRY_DELAY = 30
+MAIL_OUTBOX_MAX_RETRY_DELAY = 3600
+MAIL_OUTBOX_POLL_INTERVAL = 1
+MAIL_WORKER_THREADS = 4
+
 SECURITY_PASSWORD_SALT = os.environ['SECURITY_PASSWORD_SALT']
 
 JWT_TOKEN_LOCATION = ('headers', 'cookies')
@@ -36,3 +67,82 @@ JWT_ACCESS_TOKEN_EXPIRES = int(os.environ['JWT_ACCESS_TOKEN_EXPIRES'])
 JWT_REFRESH_TOKEN_EXPIRES = int(os.environ['JWT_REFRESH_TOKEN_EXPIRES'])
 JWT_COOKIE_CSRF_PROTECT = int(os.environ['JWT_COOKIE_CSRF_PROTECT']) == 1
 JWT_COOKIE_SECURE = int(os.environ['JWT_COOKIE_SECURE']) == 1
+
+# Number of audio list / tag list lines ingested per batch
+INGEST_CHUNK_SIZE = 10000
+
+# Number of Audio rows updated per statement by the audio indexer
+AUDIO_INDEX_BATCH_SIZE = 1000
+
+# Number of rows fetched per server-side cursor round trip on exports
+EXPORT_BATCH_SIZE = 1000
+
+# Page sizes of the list endpoints
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 1000
+
+# In-process cache of authenticated users and of their project roles
+# (users deleted or renamed, or whose admin flag changed, in other processes
+# are picked up within AUTH_CACHE_CHECK_INTERVAL seconds, role changes
+# within AUTH_CACHE_TTL seconds)
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL = 60
+AUTH_CACHE_CHECK_INTERVAL = 5
+
+# In-process cache of the projects and tagsets responses
+RESPONSE_CACHE_SIZE = 10000
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Keep the annotations of deleted projects, in detached partitions
+# (annotation_archive_p<project id>), instead of dropping them
+KEEP_DELETED_PROJECT_ANNOTATIONS = False
+
+# Number of annotations deleted per transaction by purge jobs
+PURGE_BATCH_SIZE = 10000
+
+# Audio uploads: maximum file size, bytes read and written at a time,
+# in-process cache of the hash states of the uploads in progress, and
+# maximum number of uploads added to a project per request
+MAX_UPLOAD_SIZE = 4 * 1024 * 1024 * 1024
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+UPLOAD_HASH_CACHE_SIZE = 1000
+UPLOAD_HASH_CACHE_TTL = 3600
+MAX_BULK_AUDIOS = 10000
+
+# Maximum number of annotations per bulk creation request
+MAX_BULK_ANNOTATIONS = 10000
+
+# Spectrogram tiles (see phaunos/phaunos/spectrogram.py)
+SPECTROGRAM_CACHE_FOLDER = 'spectrograms'
+SPECTROGRAM_N_FFT = 512
+SPECTROGRAM_HOP = 128
+SPECTROGRAM_TILE_WIDTH = 256
+SPECTROGRAM_DB_RANGE = 80
+SPECTROGRAM_MAX_AGE = 86400
+
+# Offloading of /files/ to the front server: None, 'x-sendfile' or 'x-accel-redirect'
+FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD') or None
+FILE_OFFLOAD_PREFIX = os.environ.get('FILE_OFFLOAD_PREFIX', '/protected-files/')
+
+# Raise instead of logging when a view exceeds its SQL statement budget
+QUERY_BUDGET_STRICT = False
+
+# Request latency histogram buckets (seconds) of the metrics endpoint
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# SQL statements slower than this (seconds) are logged to 'phaunos.slow_query'
+SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))
+
+# Job queue (see phaunos/phaunos/jobs.py)
+JOB_MAX_ATTEMPTS = 3
+# Delay before the first retry of a failed job (seconds), doubled at each attempt
+JOB_RETRY_DELAY = 30
+JOB_MAX_RETRY_DELAY = 3600
+# Running jobs are claimed again after JOB_HEARTBEAT_TIMEOUT seconds
+# without heartbeat, written every JOB_HEARTBEAT_INTERVAL seconds
+JOB_HEARTBEAT_TIMEOUT = 600
+JOB_HEARTBEAT_INTERVAL = 60
+JOB_POLL_INTERVAL = 1
+# Number of processes of the process pools of jobs (default: number of CPUs)
+JOB_PROCESSES = None
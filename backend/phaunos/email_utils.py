@@ -1,6 +1,25 @@
+import time
+import smtplib
+import datetime
+import threading
 from flask import current_app, url_for, render_template
 from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import select, bindparam, func
+from phaunos.shared import db
+from phaunos.user.models import OutboxMessage
+
+
+# Outbound email.
+#
+# Emails are not sent by the request path: send_email adds them to the
+# outbox table, in the transaction of the request, and they are delivered
+# by the mail workers (flask mail-worker). Each worker claims batches of
+# due messages with SELECT ... FOR UPDATE SKIP LOCKED and sends a batch
+# over one SMTP connection. Messages failing with a transient error (or
+# whose connection failed) are retried with exponential backoff, up to
+# MAIL_OUTBOX_MAX_ATTEMPTS times. Messages refused with a permanent (5xx)
+# error are given up at once.
 
 
 mail = Mail()
@@ -25,13 +44,12 @@ def confirm_token(token, expiration=3600):
 
 
 def send_email(to, subject, template):
-    msg = Message(
-        subject,
-        recipients=[to],
-        html=template,
-        sender=current_app.config['MAIL_DEFAULT_SENDER']
-    )
-    mail.send(msg)
+    """Queue an email. It is sent once the current transaction commits."""
+    db.session.add(OutboxMessage(
+        sender=current_app.config['MAIL_DEFAULT_SENDER'],
+        recipient=to,
+        subject=subject,
+        html=template))
 
 
 def send_confirmation_email(to, token):
@@ -43,3 +61,117 @@ def send_confirmation_email(to, token):
         'email/activate.html',
         confirm_url=confirm_url)
     send_email(to, "Phaunos account - Please confirm your email.", html)
+
+
+def _is_permanent(err):
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        code = min(code for code, _ in err.recipients.values())
+    else:
+        code = getattr(err, 'smtp_code', None)
+    return code is not None and 500 <= code < 600
+
+
+def _retry_delay(attempts):
+    config = current_app.config
+    return datetime.timedelta(seconds=min(
+        config['MAIL_OUTBOX_RETRY_DELAY'] * 2 ** attempts,
+        config['MAIL_OUTBOX_MAX_RETRY_DELAY']))
+
+
+def deliver_outbox():
+    """Send a batch of due messages over one SMTP connection. Returns the
+    number of messages processed."""
+
+    config = current_app.config
+    outbox = OutboxMessage.__table__
+    with db.engine.begin() as connection:
+        # rows stay locked until the outcome of the batch is stored
+        messages = connection.execute(select([outbox])
+            .where(outbox.c.sent_at==None)
+            .where(outbox.c.failed_at==None)
+            .where(outbox.c.next_attempt_at <= func.now())
+            .order_by(outbox.c.next_attempt_at, outbox.c.id)
+            .limit(config['MAIL_OUTBOX_BATCH_SIZE'])
+            .with_for_update(skip_locked=True)).fetchall()
+        if not messages:
+            return 0
+
+        # message id -> error (None if sent)
+        results = {}
+        try:
+            with mail.connect() as smtp:
+                for message in messages:
+                    try:
+                        smtp.send(Message(
+                            message.subject,
+                            recipients=[message.recipient],
+                            html=message.html,
+                            sender=message.sender))
+                    except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as err:
+                        results[message.id] = err
+                    else:
+                        results[message.id] = None
+        except Exception as err:
+            # connection error: the messages not sent yet are retried
+            current_app.logger.warning('SMTP connection error: %s', err)
+            for message in messages:
+                results.setdefault(message.id, err)
+
+        sent, retried, given_up = [], [], []
+        for message in messages:
+            err = results[message.id]
+            if err is None:
+                sent.append(message.id)
+            elif _is_permanent(err) or message.attempts + 1 >= config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+                current_app.logger.error('Giving up email %s to %s: %s',
+                    message.id, message.recipient, err)
+                given_up.append({'message_id': message.id, 'error': str(err)})
+            else:
+                retried.append({
+                    'message_id': message.id,
+                    'error': str(err),
+                    'delay': _retry_delay(message.attempts)})
+
+        if sent:
+            connection.execute(outbox.update()
+                .where(outbox.c.id.in_(sent))
+                .values(attempts=outbox.c.attempts + 1, sent_at=func.now(), last_error=None))
+        if retried:
+            connection.execute(outbox.update()
+                .where(outbox.c.id==bindparam('message_id'))
+                .values(
+                    attempts=outbox.c.attempts + 1,
+                    last_error=bindparam('error'),
+                    next_attempt_at=func.now() + bindparam('delay', type_=db.Interval)),
+                retried)
+        if given_up:
+            connection.execute(outbox.update()
+                .where(outbox.c.id==bindparam('message_id'))
+                .values(
+                    attempts=outbox.c.attempts + 1,
+                    last_error=bindparam('error'),
+                    failed_at=func.now()),
+                given_up)
+    return len(messages)
+
+
+def mail_worker(app, threads, poll_interval, once=False):
+    """Deliver the outbox with a pool of threads, until interrupted (or
+    until there is no due message left if once)."""
+
+    def run():
+        with app.app_context():
+            try:
+                while True:
+                    if not deliver_outbox():
+                        if once:
+                            return
+                        time.sleep(poll_interval)
+            finally:
+                db.session.remove()
+
+    workers = [threading.Thread(target=run, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
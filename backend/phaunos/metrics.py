@@ -0,0 +1,157 @@
+import time
+import logging
+import threading
+import contextlib
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Request and SQL instrumentation.
+#
+# For each request, the statements executed, the time spent in SQL and the
+# time spent serializing (see serializing()) are accumulated in a
+# thread-local state, then aggregated per endpoint with the request latency
+# when the request ends. Metrics are kept per process and rendered in the
+# Prometheus text format by Metrics.render().
+#
+# Statements slower than SLOW_QUERY_THRESHOLD seconds are logged to the
+# 'phaunos.slow_query' logger.
+
+
+slow_query_logger = logging.getLogger('phaunos.slow_query')
+
+_local = threading.local()
+
+
+class _RequestState(object):
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+
+
+class _EndpointMetrics(object):
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.duration = 0.0
+        self.statements = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self.slow_queries = 0
+
+
+class Metrics(object):
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint):
+        metrics = self._endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self._endpoints[endpoint] = _EndpointMetrics(self.buckets)
+        return metrics
+
+    def observe(self, endpoint, duration, state):
+        with self._lock:
+            metrics = self._get(endpoint)
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    metrics.bucket_counts[i] += 1
+            metrics.count += 1
+            metrics.duration += duration
+            metrics.statements += state.statements
+            metrics.sql_time += state.sql_time
+            metrics.serialization_time += state.serialization_time
+
+    def observe_slow_query(self, endpoint):
+        with self._lock:
+            self._get(endpoint).slow_queries += 1
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = [
+                '# HELP phaunos_request_duration_seconds Request latency.',
+                '# TYPE phaunos_request_duration_seconds histogram']
+            for endpoint, metrics in endpoints:
+                for bound, n in zip(self.buckets, metrics.bucket_counts):
+                    lines.append('phaunos_request_duration_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                        endpoint, bound, n))
+                lines.append('phaunos_request_duration_seconds_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+                    endpoint, metrics.count))
+                lines.append('phaunos_request_duration_seconds_sum{{endpoint="{}"}} {}'.format(
+                    endpoint, metrics.duration))
+                lines.append('phaunos_request_duration_seconds_count{{endpoint="{}"}} {}'.format(
+                    endpoint, metrics.count))
+            for name, attr, help_text in (
+                    ('phaunos_sql_statements_total', 'statements', 'SQL statements executed.'),
+                    ('phaunos_sql_duration_seconds_total', 'sql_time', 'Time spent executing SQL statements.'),
+                    ('phaunos_serialization_duration_seconds_total', 'serialization_time', 'Time spent serializing responses.'),
+                    ('phaunos_slow_queries_total', 'slow_queries', 'SQL statements slower than SLOW_QUERY_THRESHOLD.')):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for endpoint, metrics in endpoints:
+                    lines.append('{}{{endpoint="{}"}} {}'.format(name, endpoint, getattr(metrics, attr)))
+        return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    return request.endpoint or 'none'
+
+
+def _start_request():
+    _local.state = _RequestState()
+
+
+def _end_request(exc):
+    state = getattr(_local, 'state', None)
+    if state is None:
+        return
+    _local.state = None
+    current_app.extensions['metrics'].observe(
+        _endpoint(), time.perf_counter() - state.start, state)
+
+
+@contextlib.contextmanager
+def serializing():
+    """Account the time spent in the block as serialization time."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        state = getattr(_local, 'state', None)
+        if state is not None:
+            state.serialization_time += time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._phaunos_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._phaunos_start
+    state = getattr(_local, 'state', None)
+    if state is not None:
+        state.statements += 1
+        state.sql_time += elapsed
+    if has_app_context() and elapsed >= current_app.config['SLOW_QUERY_THRESHOLD']:
+        endpoint = _endpoint() if has_request_context() else 'none'
+        current_app.extensions['metrics'].observe_slow_query(endpoint)
+        slow_query_logger.warning('%.3fs (%s): %s', elapsed, endpoint, statement)
+
+
+def init_metrics(app):
+    app.extensions['metrics'] = Metrics(app.config['METRICS_LATENCY_BUCKETS'])
+    app.before_request(_start_request)
+    app.teardown_request(_end_request)
@@ -5,8 +5,14 @@ from flask import (
     Response,
     request,
     render_template,
-    jsonify
+    jsonify,
+    stream_with_context,
+    url_for,
 )
+import os
+import wave
+import collections
+from marshmallow import ValidationError
 from phaunos.phaunos.models import (
     Audio,
     Tag,
@@ -16,14 +22,37 @@ from phaunos.phaunos.models import (
     VisualizationType,
     UserProjectRel,
     Annotation,
+    Job,
+    Upload,
+    ProjectCompletion,
+    VALID_AUDIO_EXT,
     project_schema,
-    annotation_schema,
+    annotation_input_schema,
+    audio_project_rel,
+    tagset_project_rel,
+    tag_tagset_rel,
+    project_roles,
+    apply_completion_deltas,
+    apply_statistics_deltas,
+    ProjectStatistics,
+    TagStatistics,
+    AnnotatorStatistics,
+    AudioStatistics,
+    project_cache_key,
     tagset_schema,
+    tagset_load_options,
 #    tag_schema,
-    audio_schema,
     user_schema
 )
 
+from phaunos.phaunos.serializers import annotation_encoder, audio_encoder, project_encoder, job_encoder
+from phaunos.phaunos.jobs import enqueue, retry_job
+from phaunos.phaunos.ingest import add_audios
+from phaunos.phaunos.uploads import UploadError, UploadConflict, create_upload, open_partial, write_chunk, finish_upload
+from phaunos.phaunos.export import EXPORT_FORMATS, export_annotations
+from phaunos.phaunos.files import send_file_conditional
+from phaunos.phaunos.pagination import PaginationError, paginate, paginated_response
+from phaunos.phaunos.response_cache import cached_response
 from phaunos.user.models import User
 
 from flask_jwt_extended import (
@@ -34,6 +63,8 @@ from flask_jwt_extended import (
 )
 
 from phaunos.shared import db, bp_api
+from phaunos.query_budget import query_budget
+from phaunos.metrics import serializing
 
 
 
@@ -41,6 +72,11 @@ from phaunos.shared import db, bp_api
 # all: /projects
 # by id: /projects/<id> (only for project admins)
 
+# get project statistics (only for project admins)
+# /projects/<id>/statistics
+# totals and counts per tag, annotator and audio (number of annotations and
+# annotated seconds), from summary tables (see models.py)
+
 # get tagsets (with tags)
 # /tagsets
 # params:
@@ -50,6 +86,14 @@ from phaunos.shared import db, bp_api
 # /audios
 # params:
 #   project_id=<id> (required) (only for project admins)
+# duration, sample_rate, n_channels, size and mtime are null until the
+# files are indexed (flask index-audios)
+
+# get spectrogram tiles of an audio
+# /audios/<id>/spectrogram (parameters and number of zoom levels)
+# params:
+#   zoom=<level>, start=<seconds>, end=<seconds>: list the tiles covering [start, end]
+# /audios/<id>/spectrogram/<zoom>/<x>.png (tile image)
 
 # get annotations
 # /annotations (all if the user connected is project admin. Only those made by the user connected otherwise.)
@@ -57,11 +101,52 @@ from phaunos.shared import db, bp_api
 #- filter by audio: audio_id=<id>
 #- filter by user: user_id=<id>
 #- filter by tag: tag_id=<id>
+#- filter by time range: start=<seconds>, end=<seconds> (annotations overlapping [start, end])
+#- download (streamed): web=1, format=json|jsonl|csv
+
+# create annotations (bulk)
+# POST /annotations?project_id=<id> (project members only)
+# body: list of {"audio_id", "tag_id", "start_time", "end_time"}
+# params:
+#   partial=1: insert the valid annotations even if some are invalid
+
+# upload audio files (project admins), resumable
+# POST /uploads, body: {"filename", "size"}: create an upload
+# GET /uploads/<id>: state of an upload ("offset": number of bytes received)
+# PATCH /uploads/<id>, header Upload-Offset: <offset of the upload>, body:
+#   the next bytes of the file (all or part of them). If interrupted, get
+#   the offset and send the bytes from there. Complete files get a "path".
+#   409 if the offset is not the offset of the upload, or if another
+#   request is writing to it.
+# add uploaded audios to a project (project admins)
+# POST /projects/<id>/audios, body: {"uploads": [<upload id>, ...]}
 
 # get users
 #- by id: /users/<id>
 #- by project: /users?project_id=<id>
 
+# get jobs (admins, or project admins for the jobs of their projects)
+# /jobs
+# params:
+#   project_id=<id>
+# /jobs/<id>
+# retry a failed job: POST /jobs/<id>/retry
+
+# get metrics (Prometheus text format, admins only)
+# /metrics
+
+# projects and tagsets responses are cached (see response_cache.py) and
+# have an ETag: send it back in If-None-Match to get a 304 if unchanged
+
+# list endpoints are paginated with cursors (see pagination.py):
+#- page size: per_page=<n>
+#- next page: cursor=<value of the X-Next-Cursor header of the previous page>
+
+
+@bp_api.errorhandler(PaginationError)
+def pagination_error(error):
+    return jsonify({'msg':str(error)}), 422
+
 
 @bp_api.route('/')
 def home():
@@ -69,9 +154,9 @@ def home():
 
 
 @bp_api.route('/api/phaunos/users', methods=['GET'])
+@query_budget(4)
 @jwt_required
 def users():
-    page = request.args.get('page', 1, type=int)
     user = get_current_user()
     project_id = request.args.get('project_id', None, type=int)
     if project_id:
@@ -85,7 +170,10 @@ def users():
         return jsonify({'msg':'Not allowed.'}), 403
     else:
         query = User.query
-    return user_schema.dumps(query.paginate(page, 10, False).items, many=True)
+    items, next_cursor = paginate(query, User.id)
+    with serializing():
+        body = user_schema.dumps(items, many=True)
+    return paginated_response(body, next_cursor)
     
 
 
@@ -95,14 +183,16 @@ def users():
 
 
 @bp_api.route('/api/phaunos/projects', methods=['GET'])
+@query_budget(2)
+@cached_response(lambda: 'projects')
 #@jwt_required
 def projects():
-    page = request.args.get('page', 1, type=int)
-    projects = Project.query.order_by(Project.name).paginate(page, 10, False)
-    return project_schema.dumps(projects.items, many=True)
+    rows, next_cursor = paginate(project_encoder.query(Project.query), Project.name)
+    return paginated_response(project_encoder.dumps(rows), next_cursor)
 
 
 @bp_api.route('/api/phaunos/projects/<int:project_id>', methods=['GET'])
+@query_budget(3)
 @jwt_required
 def project_detail(project_id):
     user = get_current_user()
@@ -111,13 +201,44 @@ def project_detail(project_id):
         return jsonify({'msg':f'Project with id {project_id} not found'}), 404
     if not (user.is_admin or user.is_project_admin(project_id)):
         return jsonify({'msg':'Not allowed.'}), 403
-    return project_schema.dumps(project)
+    with serializing():
+        return project_schema.dumps(project)
+
+
+@bp_api.route('/api/phaunos/projects/<int:project_id>/statistics', methods=['GET'])
+@query_budget(6)
+@jwt_required
+def project_statistics(project_id):
+    user = get_current_user()
+    if not Project.query.get(project_id):
+        return jsonify({'msg':f'Project with id {project_id} not found'}), 404
+    if not (user.is_admin or user.is_project_admin(project_id)):
+        return jsonify({'msg':'Not allowed.'}), 403
+
+    def rows(model, key):
+        column = getattr(model, key)
+        return [{key: k, 'n_annotations': n, 'annotated_seconds': seconds}
+            for k, n, seconds in db.session.query(column, model.n_annotations, model.annotated_seconds)
+                .filter(model.project_id==project_id)
+                .order_by(column)]
+
+    totals = db.session.query(ProjectStatistics.n_annotations, ProjectStatistics.annotated_seconds) \
+        .filter(ProjectStatistics.project_id==project_id).first()
+    return jsonify({
+        'project_id': project_id,
+        'n_annotations': totals.n_annotations if totals else 0,
+        'annotated_seconds': totals.annotated_seconds if totals else 0,
+        'tags': rows(TagStatistics, 'tag_id'),
+        'annotators': rows(AnnotatorStatistics, 'created_by_id'),
+        'audios': rows(AudioStatistics, 'audio_id'),
+    })
 
 
 @bp_api.route('/api/phaunos/tagsets', methods=['GET'])
+@query_budget(4)
+@cached_response(lambda: project_cache_key(request.args.get('project_id', None, type=int)))
 #@jwt_required
 def tagsets():
-    page = request.args.get('page', 1, type=int)
     project_id = request.args.get('project_id', None, type=int)
 
     # Filter by project (required)
@@ -125,17 +246,21 @@ def tagsets():
         return jsonify({'msg':'Missing project_id parameter.'}), 422
     if not Project.query.get(project_id):
         return jsonify({'msg':f'Project with id {project_id} not found'}), 404
-    subquery = Tagset.query.filter(Tagset.projects.any(Project.id==project_id))
+    subquery = Tagset.query \
+        .join(tagset_project_rel) \
+        .filter(tagset_project_rel.c.project_id==project_id) \
+        .options(*tagset_load_options)
 
-    return tagset_schema.dumps(
-        subquery.paginate(page, 10, False).items,
-        many=True)
+    items, next_cursor = paginate(subquery, Tagset.id)
+    with serializing():
+        body = tagset_schema.dumps(items, many=True)
+    return paginated_response(body, next_cursor)
 
 
 @bp_api.route('/api/phaunos/audios', methods=['GET'])
+@query_budget(4)
 @jwt_required
 def audios():
-    page = request.args.get('page', 1, type=int)
     user = get_current_user()
     project_id = request.args.get('project_id', None, type=int)
 
@@ -144,26 +269,99 @@ def audios():
         return jsonify({'msg':'Missing project_id parameter.'}), 422
     if not Project.query.get(project_id):
         return jsonify({'msg':f'Project with id {project_id} not found'}), 404
-    subquery = Audio.query.filter(Audio.projects.any(Project.id==project_id))
+    subquery = Audio.query \
+        .join(audio_project_rel) \
+        .filter(audio_project_rel.c.project_id==project_id)
 
     # Check user is project admin
     if not (user.is_admin or user.is_project_admin(project_id)):
         return jsonify({'msg':'Not allowed.'}), 403
 
-    return audio_schema.dumps(
-        subquery.paginate(page, 10, False).items,
-        many=True)
+    rows, next_cursor = paginate(audio_encoder.query(subquery), Audio.id)
+    return paginated_response(audio_encoder.dumps(rows), next_cursor)
+
+
+def _spectrogram_cache_folder():
+    return os.path.join(
+        current_app.config['FILE_FOLDER'],
+        current_app.config['SPECTROGRAM_CACHE_FOLDER'])
+
+
+@bp_api.route('/api/phaunos/audios/<int:audio_id>/spectrogram', methods=['GET'])
+@jwt_required
+def audio_spectrogram(audio_id):
+    audio = Audio.query.get(audio_id)
+    if not audio:
+        return jsonify({'msg':f'Audio with id {audio_id} not found'}), 404
+    # imports NumPy
+    from phaunos.phaunos import spectrogram
+    params = spectrogram.params_from_config(current_app.config)
+    try:
+        with spectrogram.AudioReader(audio.file_path) as reader:
+            sample_rate, n_frames = reader.sample_rate, reader.n_frames
+    except FileNotFoundError:
+        return jsonify({'msg':f'File of audio with id {audio_id} not found'}), 404
+    except (wave.Error, EOFError):
+        return jsonify({'msg':'Spectrograms are only available for PCM WAV files.'}), 415
+
+    data = dict(params._asdict(),
+        sample_rate=sample_rate,
+        duration=n_frames / sample_rate,
+        max_zoom=spectrogram.max_zoom(n_frames, params))
+
+    zoom = request.args.get('zoom', None, type=int)
+    if zoom is not None:
+        if not 0 <= zoom <= data['max_zoom']:
+            return jsonify({'msg':'zoom must be between 0 and {}.'.format(data['max_zoom'])}), 422
+        start = request.args.get('start', 0, type=float)
+        end = request.args.get('end', data['duration'], type=float)
+        data['tiles'] = []
+        for x in spectrogram.tiles_in_range(sample_rate, n_frames, zoom, start, end, params):
+            tile_start, tile_end = spectrogram.tile_time_range(sample_rate, zoom, x, params)
+            data['tiles'].append({
+                'zoom': zoom,
+                'x': x,
+                'start_time': tile_start,
+                'end_time': tile_end,
+                'url': url_for('bp_api.audio_spectrogram_tile', audio_id=audio_id, zoom=zoom, x=x)})
+    return jsonify(data)
+
+
+@bp_api.route('/api/phaunos/audios/<int:audio_id>/spectrogram/<int:zoom>/<int:x>.png', methods=['GET'])
+@jwt_required
+def audio_spectrogram_tile(audio_id, zoom, x):
+    audio = Audio.query.get(audio_id)
+    if not audio:
+        return jsonify({'msg':f'Audio with id {audio_id} not found'}), 404
+    # imports NumPy
+    from phaunos.phaunos import spectrogram
+    params = spectrogram.params_from_config(current_app.config)
+    try:
+        data = spectrogram.get_tile(audio.file_path, zoom, x, params, _spectrogram_cache_folder())
+    except FileNotFoundError:
+        return jsonify({'msg':f'File of audio with id {audio_id} not found'}), 404
+    except ValueError as err:
+        return jsonify({'msg':str(err)}), 404
+    except (wave.Error, EOFError):
+        return jsonify({'msg':'Spectrograms are only available for PCM WAV files.'}), 415
+    resp = make_response(data)
+    resp.mimetype = 'image/png'
+    resp.cache_control.private = True
+    resp.cache_control.max_age = current_app.config['SPECTROGRAM_MAX_AGE']
+    return resp
 
 
 @bp_api.route('/api/phaunos/annotations', methods=['GET'])
+@query_budget(6)
 @jwt_required
 def annotations():
     web = request.args.get('web', 0, type=int)
-    page = request.args.get('page', 1, type=int)
     user = get_current_user()
     project_id = request.args.get('project_id', None, type=int)
     audio_id = request.args.get('audio_id', None, type=int)
     tag_id = request.args.get('tag_id', None, type=int)
+    start = request.args.get('start', None, type=float)
+    end = request.args.get('end', None, type=float)
 
     # Filter by project (required)
     if not project_id:
@@ -184,25 +382,323 @@ def annotations():
             return jsonify({'msg':f'Tag with id {tag_id} not found'}), 404
         subquery = subquery.filter(Annotation.tag_id==tag_id)
 
+    # Filter by time range (overlap)
+    if start is not None or end is not None:
+        if start is not None and end is not None and start > end:
+            return jsonify({'msg':'start must not be greater than end.'}), 422
+        subquery = subquery.filter(Annotation.overlaps(start, end))
+
     # If the user is not project admin, only get his annotations
     if not (user.is_admin or user.is_project_admin(project_id)):
         subquery = subquery.filter(Annotation.created_by_id==user.id)
 
 
     if web:
-        data = subquery.all()
+        export_format = request.args.get('format', 'json')
+        if not export_format in EXPORT_FORMATS:
+            return jsonify({'msg':'Format must be one of {}.'.format(', '.join(EXPORT_FORMATS))}), 422
         return Response(
-            data,
-            mimetype='application/json',
-            headers={'Content-Disposition':'attachment;filename=annotations.json'})
+            stream_with_context(export_annotations(
+                subquery,
+                export_format,
+                current_app.config['EXPORT_BATCH_SIZE'])),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition':f'attachment;filename=annotations.{export_format}'})
     else:
-        data = subquery.paginate(page, 10, False).items
-        return annotation_schema.dumps(data, many=True)
+        rows, next_cursor = paginate(annotation_encoder.query(subquery), Annotation.id)
+        return paginated_response(annotation_encoder.dumps(rows), next_cursor)
+
+
+@bp_api.route('/api/phaunos/annotations', methods=['POST'])
+@query_budget(16)
+@jwt_required
+def create_annotations():
+    user = get_current_user()
+    project_id = request.args.get('project_id', None, type=int)
+    partial = request.args.get('partial', 0, type=int)
+
+    if not project_id:
+        return jsonify({'msg':'Missing project_id parameter.'}), 422
+    project = Project.query.get(project_id)
+    if not project:
+        return jsonify({'msg':f'Project with id {project_id} not found'}), 404
+    if not (user.is_admin or project_id in project_roles(user.id)):
+        return jsonify({'msg':'Not allowed.'}), 403
+
+    data = request.get_json()
+    if not isinstance(data, list):
+        return jsonify({'msg':'Expected a list of annotations.'}), 400
+    if len(data) > current_app.config['MAX_BULK_ANNOTATIONS']:
+        return jsonify({'msg':'At most {} annotations per request.'.format(
+            current_app.config['MAX_BULK_ANNOTATIONS'])}), 413
+
+    # Validate items
+    items = {}
+    errors = {}
+    for i, item in enumerate(data):
+        try:
+            items[i] = annotation_input_schema.load(item)
+        except ValidationError as err:
+            errors[i] = err.messages
+
+    # Validate audios and tags against the project, as sets
+    audio_ids = {item['audio_id'] for item in items.values()}
+    # audio id -> duration (None if not indexed)
+    project_audios = dict(db.session.query(audio_project_rel.c.audio_id, Audio.duration)
+        .join(Audio, Audio.id==audio_project_rel.c.audio_id)
+        .filter(audio_project_rel.c.project_id==project_id)
+        .filter(audio_project_rel.c.audio_id.in_(audio_ids))) if audio_ids else {}
+    tag_ids = {item['tag_id'] for item in items.values()}
+    project_tag_ids = {tag_id for tag_id, in db.session.query(tag_tagset_rel.c.tag_id)
+        .join(tagset_project_rel, tagset_project_rel.c.tagset_id==tag_tagset_rel.c.tagset_id)
+        .filter(tagset_project_rel.c.project_id==project_id)
+        .filter(tag_tagset_rel.c.tag_id.in_(tag_ids))} if tag_ids else set()
+    for i, item in list(items.items()):
+        item_errors = {}
+        if not item['audio_id'] in project_audios:
+            item_errors['audio_id'] = [f'Audio with id {item["audio_id"]} not in project.']
+        else:
+            duration = project_audios[item['audio_id']]
+            for field in ('start_time', 'end_time'):
+                if duration is not None and (item.get(field) or 0) > duration:
+                    item_errors[field] = [f'Must not exceed the duration of the audio ({duration}s).']
+        if not item['tag_id'] in project_tag_ids:
+            item_errors['tag_id'] = [f'Tag with id {item["tag_id"]} not in project.']
+        if not project.allow_regions and item.get('start_time') is not None:
+            item_errors['start_time'] = ['Regions are not allowed in this project.']
+        if item_errors:
+            errors[i] = item_errors
+            del items[i]
+
+    if errors and not partial:
+        return jsonify({'errors':errors}), 422
+
+    # Insert in a single statement
+    indices = sorted(items)
+    rows = [{
+        'start_time': items[i].get('start_time'),
+        'end_time': items[i].get('end_time'),
+        'tag_id': items[i]['tag_id'],
+        'audio_id': items[i]['audio_id'],
+        'project_id': project_id,
+        'created_by_id': user.id} for i in indices]
+    ids = []
+    if rows:
+        ids = [annotation_id for annotation_id, in db.session.execute(
+            Annotation.__table__.insert().values(rows).returning(Annotation.id))]
+        apply_completion_deltas(db.session.connection(), collections.Counter(
+            (project_id, row['audio_id'], user.id) for row in rows))
+        apply_statistics_deltas(db.session.connection(),
+            [(1, row) for row in rows], durations=project_audios)
+        db.session.commit()
+
+    return jsonify({'ids':dict(zip(indices, ids)), 'errors':errors}), 201
+
+
+@bp_api.route('/api/phaunos/uploads', methods=['POST'])
+@jwt_required
+def upload_create():
+    user = get_current_user()
+    if not (user.is_admin or Role.PROJECTADMIN in project_roles(user.id).values()):
+        return jsonify({'msg':'Not allowed.'}), 403
+    data = request.get_json() or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    if not isinstance(filename, str) or not os.path.basename(filename):
+        return jsonify({'msg':'Missing filename.'}), 422
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'msg':'size must be a positive integer.'}), 422
+    if size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'msg':'Files must not exceed {} bytes.'.format(
+            current_app.config['MAX_UPLOAD_SIZE'])}), 413
+
+    upload = Upload(filename=os.path.basename(filename), size=size, created_by_id=user.id)
+    if upload.extension[1:] not in VALID_AUDIO_EXT:
+        return jsonify({'msg':'Only {} files are accepted.'.format(','.join(VALID_AUDIO_EXT))}), 422
+    create_upload(upload)
+    db.session.add(upload)
+    db.session.commit()
+    resp = jsonify(upload.to_dict())
+    resp.headers['Location'] = url_for('bp_api.upload_detail', upload_id=upload.id)
+    return resp, 201
+
+
+def _get_upload(upload_id):
+    """Return (upload, None), or (None, error response) if the upload does
+    not exist or was not created by the user."""
+    user = get_current_user()
+    upload = Upload.query.get(upload_id)
+    if not upload or not (user.is_admin or upload.created_by_id == user.id):
+        return None, (jsonify({'msg':f'Upload with id {upload_id} not found'}), 404)
+    return upload, None
+
+
+@bp_api.route('/api/phaunos/uploads/<upload_id>', methods=['GET'])
+@query_budget(2)
+@jwt_required
+def upload_detail(upload_id):
+    # where to resume: not from a replica, which may be behind
+    db.session().use_primary()
+    upload, error = _get_upload(upload_id)
+    if error:
+        return error
+    return jsonify(upload.to_dict())
+
+
+@bp_api.route('/api/phaunos/uploads/<upload_id>', methods=['PATCH'])
+@jwt_required
+def upload_chunk(upload_id):
+    upload, error = _get_upload(upload_id)
+    if error:
+        return error
+    offset = request.headers.get('Upload-Offset', None, type=int)
+    if offset is None:
+        return jsonify({'msg':'Missing Upload-Offset header.'}), 422
+    if request.content_length and offset + request.content_length > upload.size:
+        return jsonify({'msg':'More bytes than the size of the upload.'}), 413
+    # no transaction (nor pooled connection) is held while the body is
+    # streamed, the lock of the partial file serializes the requests
+    db.session.expunge(upload)
+    db.session.rollback()
+
+    try:
+        with open_partial(upload) as f:
+            # read again under the lock, after the previous request
+            upload.offset, upload.path = db.session.query(Upload.offset, Upload.path) \
+                .filter(Upload.id==upload_id).one()
+            db.session.rollback()
+            if upload.path:
+                raise UploadConflict('Upload already complete.')
+            if offset != upload.offset:
+                return jsonify({'msg':f'Upload-Offset must be the offset of the upload ({upload.offset}).'}), 409
+            # streamed, the request body is never loaded whole
+            write_chunk(upload, f, request.stream)
+            if upload.offset == upload.size:
+                finish_upload(upload, upload.extension)
+            n_updated = db.session.execute(Upload.__table__.update()
+                .where(Upload.id==upload_id)
+                .where(Upload.offset==offset)
+                .values(offset=upload.offset, sha256=upload.sha256,
+                    path=upload.path, completed_at=upload.completed_at)).rowcount
+            db.session.commit()
+    except UploadError as err:
+        return jsonify({'msg':str(err)}), 413
+    except UploadConflict as err:
+        return jsonify({'msg':str(err)}), 409
+    if not n_updated:
+        return jsonify({'msg':'Upload changed by another request.'}), 409
+    return jsonify(upload.to_dict())
+
+
+@bp_api.route('/api/phaunos/projects/<int:project_id>/audios', methods=['POST'])
+@jwt_required
+def project_add_audios(project_id):
+    user = get_current_user()
+    if not Project.query.get(project_id):
+        return jsonify({'msg':f'Project with id {project_id} not found'}), 404
+    if not (user.is_admin or user.is_project_admin(project_id)):
+        return jsonify({'msg':'Not allowed.'}), 403
+    upload_ids = (request.get_json() or {}).get('uploads')
+    if not isinstance(upload_ids, list) or not upload_ids \
+            or not all(isinstance(upload_id, str) for upload_id in upload_ids):
+        return jsonify({'msg':'Expected a list of upload ids.'}), 422
+    if len(upload_ids) > current_app.config['MAX_BULK_AUDIOS']:
+        return jsonify({'msg':'At most {} audios per request.'.format(
+            current_app.config['MAX_BULK_AUDIOS'])}), 413
+
+    query = db.session.query(Upload.id, Upload.path).filter(Upload.id.in_(set(upload_ids)))
+    if not user.is_admin:
+        query = query.filter(Upload.created_by_id==user.id)
+    paths = dict(query)
+    errors = {upload_id: 'Upload not found.' if upload_id not in paths else 'Upload not complete.'
+        for upload_id in upload_ids if paths.get(upload_id) is None}
+    if errors:
+        return jsonify({'errors':errors}), 422
+
+    # Audios are created and added to the project in bulk, shared with the
+    # other projects of the same files
+    connection = db.session.connection()
+    audio_ids, n_added = add_audios(connection, project_id, set(paths.values()))
+    if n_added:
+        project_completion = ProjectCompletion.__table__
+        connection.execute(project_completion.update()
+            .where(project_completion.c.project_id==project_id)
+            .values(n_audios=project_completion.c.n_audios + n_added))
+    enqueue(connection, 'index_audios', {'project_id': project_id},
+        key=f'index_audios:{project_id}',
+        project_id=project_id)
+    db.session.commit()
+    return jsonify({'audios':{upload_id: audio_ids[path] for upload_id, path in paths.items()}}), 201
+
+
+@bp_api.route('/api/phaunos/jobs', methods=['GET'])
+@query_budget(3)
+@jwt_required
+def jobs():
+    user = get_current_user()
+    project_id = request.args.get('project_id', None, type=int)
+    query = Job.query
+    if project_id:
+        if not Project.query.get(project_id):
+            return jsonify({'msg':f'Project with id {project_id} not found'}), 404
+        if not (user.is_admin or user.is_project_admin(project_id)):
+            return jsonify({'msg':'Not allowed.'}), 403
+        query = query.filter(Job.project_id==project_id)
+    elif not user.is_admin:
+        return jsonify({'msg':'Not allowed.'}), 403
+    rows, next_cursor = paginate(job_encoder.query(query), Job.id)
+    return paginated_response(job_encoder.dumps(rows), next_cursor)
+
+
+def _get_job(job_id):
+    """Return (job row, None), or (None, error response) if the job does
+    not exist or the user is not allowed to see it."""
+    user = get_current_user()
+    row = job_encoder.query(Job.query.filter(Job.id==job_id)).first()
+    if not row:
+        return None, (jsonify({'msg':f'Job with id {job_id} not found'}), 404)
+    if not (user.is_admin or (row.project_id and user.is_project_admin(row.project_id))):
+        return None, (jsonify({'msg':'Not allowed.'}), 403)
+    return row, None
+
+
+@bp_api.route('/api/phaunos/jobs/<int:job_id>', methods=['GET'])
+@query_budget(2)
+@jwt_required
+def job_detail(job_id):
+    row, error = _get_job(job_id)
+    if error:
+        return error
+    return make_response(job_encoder.encode(row))
+
+
+@bp_api.route('/api/phaunos/jobs/<int:job_id>/retry', methods=['POST'])
+@jwt_required
+def job_retry(job_id):
+    _, error = _get_job(job_id)
+    if error:
+        return error
+    if not retry_job(db.session.connection(), job_id):
+        db.session.rollback()
+        return jsonify({'msg':'Only failed jobs can be retried, once no identical job is queued.'}), 409
+    db.session.commit()
+    row, _ = _get_job(job_id)
+    return make_response(job_encoder.encode(row))
+
+
+@bp_api.route('/api/phaunos/metrics', methods=['GET'])
+@jwt_required
+def metrics():
+    if not get_current_user().is_admin:
+        return jsonify({'msg':'Not allowed.'}), 403
+    return Response(
+        current_app.extensions['metrics'].render(),
+        mimetype='text/plain; version=0.0.4')
 
 
 @bp_api.route('/files/<path:filename>')
 def uploaded(filename):
-    return send_from_directory(
+    return send_file_conditional(
         current_app.config['FILE_FOLDER'],
         filename
     )
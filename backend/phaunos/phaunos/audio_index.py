@@ -0,0 +1,215 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select, bindparam
+from phaunos.phaunos.models import Audio, audio_project_rel, refresh_statistics
+
+
+# Audio metadata indexing.
+#
+# Duration, sample rate and number of channels are read from the headers
+# of the files (RIFF chunks for WAV, the first frame and the Xing/VBRI
+# header for MP3), without reading the audio payload. Files are scanned in
+# a process pool and only when their size or mtime differ from the ones
+# stored on the Audio row, so that re-indexing is incremental. The
+# statistics of the projects of the updated audios, whose annotated seconds
+# depend on the durations, are then rebuilt.
+
+
+class AudioHeaderError(Exception):
+    pass
+
+
+def read_wav_header(f, size):
+    """Return (duration, sample_rate, n_channels) of a WAV file."""
+
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise AudioHeaderError('Not a WAV file.')
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise AudioHeaderError('No data chunk.')
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = f.read(16)
+            if len(fmt) < 16:
+                raise AudioHeaderError('Truncated fmt chunk.')
+            f.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise AudioHeaderError('No fmt chunk before the data chunk.')
+            _, n_channels, sample_rate, _, block_align, _ = struct.unpack('<HHIIHH', fmt)
+            if not (n_channels and sample_rate and block_align):
+                raise AudioHeaderError('Invalid fmt chunk.')
+            # the size of the data chunk may be wrong in files being written
+            data_size = min(chunk_size, size - f.tell())
+            return data_size // block_align / sample_rate, sample_rate, n_channels
+        else:
+            # chunks are word-aligned
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+_MP3_BITRATES = {
+    # (MPEG-1, layer): kbps for bitrate indices 1 to 14
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000), # MPEG-1
+    2: (22050, 24000, 16000), # MPEG-2
+    0: (11025, 12000, 8000), # MPEG-2.5
+}
+
+# bytes read to look for the first frame
+_MP3_SYNC_WINDOW = 65536
+
+
+def read_mp3_header(f, size):
+    """Return (duration, sample_rate, n_channels) of a MP3 file."""
+
+    offset = 0
+    head = f.read(10)
+    if head[:3] == b'ID3' and len(head) == 10:
+        # skip the ID3v2 tag (synchsafe size, optional footer)
+        offset = 10 + ((head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14
+            | (head[8] & 0x7f) << 7 | (head[9] & 0x7f))
+        if head[5] & 0x10:
+            offset += 10
+    f.seek(offset)
+    data = f.read(_MP3_SYNC_WINDOW)
+
+    for i in range(len(data) - 3):
+        if data[i] != 0xff or data[i + 1] & 0xe0 != 0xe0:
+            continue
+        version = (data[i + 1] >> 3) & 3
+        layer = 4 - ((data[i + 1] >> 1) & 3)
+        bitrate_index = data[i + 2] >> 4
+        sample_rate_index = (data[i + 2] >> 2) & 3
+        if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            continue
+        break
+    else:
+        raise AudioHeaderError('No MP3 frame found.')
+
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index - 1] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    n_channels = 1 if data[i + 3] >> 6 == 3 else 2
+    samples_per_frame = 384 if layer == 1 else 1152 if layer == 2 or mpeg1 else 576
+
+    # VBR files have a Xing (or Info) header after the side information of
+    # the first frame, or a VBRI header 32 bytes after the frame header
+    side_info = (32 if n_channels == 2 else 17) if mpeg1 else (17 if n_channels == 2 else 9)
+    xing = i + 4 + side_info
+    n_frames = None
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags, = struct.unpack('>I', data[xing + 4:xing + 8])
+        if flags & 1:
+            n_frames, = struct.unpack('>I', data[xing + 8:xing + 12])
+    elif data[i + 36:i + 40] == b'VBRI':
+        n_frames, = struct.unpack('>I', data[i + 50:i + 54])
+    if n_frames is not None:
+        return n_frames * samples_per_frame / sample_rate, sample_rate, n_channels
+
+    # CBR: duration from the size of the audio payload
+    end = size
+    if size >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+    return (end - offset - i) * 8 / bitrate, sample_rate, n_channels
+
+
+_HEADER_READERS = {
+    '.wav': read_wav_header,
+    '.mp3': read_mp3_header,
+}
+
+
+def read_header(path, size):
+    reader = _HEADER_READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise AudioHeaderError('Unsupported audio format.')
+    with open(path, 'rb') as f:
+        try:
+            return reader(f, size)
+        except struct.error:
+            raise AudioHeaderError('Truncated header.')
+
+
+def scan_audio(audio_id, path, size, mtime, force=False):
+    """Read the metadata of an audio file if its size or mtime changed.
+
+    Returns None if the file did not change, or (audio_id, metadata, error),
+    metadata being a dict of Audio column values.
+    """
+
+    try:
+        st = os.stat(path)
+    except OSError as err:
+        return audio_id, None, str(err)
+    if not force and st.st_size == size and st.st_mtime == mtime:
+        return None
+    metadata = {
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'duration': None,
+        'sample_rate': None,
+        'n_channels': None,
+    }
+    try:
+        metadata['duration'], metadata['sample_rate'], metadata['n_channels'] = \
+            read_header(path, st.st_size)
+    except (OSError, AudioHeaderError) as err:
+        return audio_id, metadata, str(err)
+    return audio_id, metadata, None
+
+
+def _scan_audio(args):
+    return scan_audio(*args)
+
+
+def index_audios(connection, file_folder, audio_ids=None, force=False,
+        workers=None, batch_size=1000):
+    """Scan the files of the audios (all of them if audio_ids is None) and
+    store their metadata. Yields (audio_id, error) for the files scanned."""
+
+    audio = Audio.__table__
+    query = select([audio.c.id, audio.c.path, audio.c.size, audio.c.mtime]).order_by(audio.c.id)
+    if audio_ids is not None:
+        query = query.where(audio.c.id.in_(audio_ids))
+    tasks = [(audio_id, os.path.join(file_folder, path), size, mtime, force)
+        for audio_id, path, size, mtime in connection.execute(query)]
+
+    # the other parameters (metadata) give the SET clause
+    update = audio.update().where(audio.c.id==bindparam('audio_id'))
+    rows = []
+    updated = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_scan_audio, tasks, chunksize=64):
+            if result is None:
+                continue
+            audio_id, metadata, error = result
+            if metadata is not None:
+                rows.append(dict(metadata, audio_id=audio_id))
+                updated.add(audio_id)
+                if len(rows) >= batch_size:
+                    connection.execute(update, rows)
+                    rows = []
+            yield audio_id, error
+    if rows:
+        connection.execute(update, rows)
+
+    if updated:
+        for project_id, in connection.execute(
+                select([audio_project_rel.c.project_id])
+                    .where(audio_project_rel.c.audio_id.in_(updated))
+                    .distinct()):
+            refresh_statistics(connection, project_id)
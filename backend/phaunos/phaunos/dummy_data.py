@@ -0,0 +1,285 @@
+import io
+import os
+import random
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import wavio
+from sqlalchemy import select, or_
+from werkzeug.security import generate_password_hash
+from phaunos.phaunos.models import (
+    Audio,
+    Tag,
+    Tagset,
+    Project,
+    UserProjectRel,
+    Role,
+    Annotation,
+    audio_project_rel,
+    tagset_project_rel,
+    tag_tagset_rel,
+    refresh_completion,
+    refresh_statistics,
+    bump_cache_versions,
+    project_cache_key,
+    create_annotation_partition,
+    remove_annotation_partition,
+)
+from phaunos.phaunos.ingest import ingest_project
+from phaunos.user.models import User, USERS_VERSION_KEY
+
+
+# Synthetic dataset generation.
+#
+# Rows are created with multi-row inserts in batches of batch_size, and
+# annotations, generated with NumPy, are loaded with COPY. WAV files are
+# written by a pool of processes. All random draws derive from the seed,
+# so that a run can be reproduced.
+#
+# Generated rows are named after the prefix ("dummy" by default) and files
+# are written under DUMMY_DATA_FOLDER in FILE_FOLDER, which is what
+# delete_dummy_data removes.
+
+
+DEFAULT_SIZES = dict(
+    n_users=100,
+    n_tags=80,
+    n_tagsets=20,
+    n_projects=20,
+    n_audios=100,
+    n_audios_per_project=20,
+    n_users_per_project=5,
+    n_tags_per_tagset=4,
+    n_tagsets_per_project=5,
+    n_annotations_per_annotator_per_audio=5,
+)
+
+AUDIO_DURATION = 5
+AUDIO_SAMPLE_RATE = 11025
+MIN_ANNOTATION_SIZE = 0.2
+
+ANNOTATION_COPY_COLUMNS = ('start_time', 'end_time', 'tag_id', 'project_id', 'audio_id', 'created_by_id')
+
+
+def _chunks(sequence, size):
+    for i in range(0, len(sequence), size):
+        yield sequence[i:i + size]
+
+
+def _insert(connection, table, rows, batch_size, *returning):
+    """Insert rows in batches and return the returning columns of each row."""
+    result = []
+    for chunk in _chunks(rows, batch_size):
+        result.extend(connection.execute(
+            table.insert().values(chunk).returning(*returning)).fetchall())
+    return result
+
+
+def write_random_wav(filename, seed, sr=AUDIO_SAMPLE_RATE, duration=AUDIO_DURATION):
+    x = np.random.RandomState(seed).rand(duration * sr) * 2 - 1
+    wavio.write(filename, x, sr, sampwidth=2)
+    return filename
+
+
+def _write_random_wav(args):
+    return write_random_wav(*args)
+
+
+def _copy_annotations(connection, columns, batch_size):
+    """Load annotation rows (a tuple of column arrays) with COPY."""
+    cursor = connection.connection.cursor()
+    n_rows = len(columns[0])
+    for start in range(0, n_rows, batch_size):
+        buffer = io.StringIO()
+        for row in zip(*[c[start:start + batch_size].tolist() for c in columns]):
+            buffer.write('{!r},{!r},{},{},{},{}\n'.format(*row))
+        buffer.seek(0)
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(
+            Annotation.__tablename__, ', '.join(ANNOTATION_COPY_COLUMNS)), buffer)
+
+
+def put_dummy_data(connection, file_folder, dummy_data_folder,
+        seed=0, workers=None, batch_size=10000, prefix='dummy', password='dummy',
+        echo=lambda msg: None, **sizes):
+    """Generate a synthetic dataset. sizes override DEFAULT_SIZES."""
+
+    sizes = dict(DEFAULT_SIZES, **sizes)
+    rng = random.Random(seed)
+    np_rng = np.random.RandomState(seed)
+
+    # users (sharing the same password, hashed once)
+    password_hash = generate_password_hash(password, method='sha256')
+    now = datetime.datetime.now()
+    user_ids = [user_id for user_id, in _insert(connection, User.__table__,
+        [{'username': f'{prefix}_user{i}',
+            'email': f'{prefix}_user{i}@example.com',
+            'password': password_hash,
+            'is_admin': False,
+            'confirmed_on': now} for i in range(sizes['n_users'])],
+        batch_size, User.id)]
+    echo(f'{len(user_ids)} users')
+
+    # tags
+    tag_ids = [tag_id for tag_id, in _insert(connection, Tag.__table__,
+        [{'name': f'{prefix}_tag{i}', 'created_by_id': rng.choice(user_ids)}
+            for i in range(sizes['n_tags'])],
+        batch_size, Tag.id)]
+    echo(f'{len(tag_ids)} tags')
+
+    # tagsets
+    tagset_names = [f'{prefix}_tagset{i}' for i in range(sizes['n_tagsets'])]
+    tagset_ids = [tagset_id for tagset_id, in _insert(connection, Tagset.__table__,
+        [{'name': name, 'created_by_id': rng.choice(user_ids)} for name in tagset_names],
+        batch_size, Tagset.id)]
+    tagset_tags = {tagset_id: rng.sample(tag_ids, sizes['n_tags_per_tagset'])
+        for tagset_id in tagset_ids}
+    for chunk in _chunks([{'tagset_id': tagset_id, 'tag_id': tag_id}
+            for tagset_id, tags in tagset_tags.items() for tag_id in tags], batch_size):
+        connection.execute(tag_tagset_rel.insert().values(chunk))
+    echo(f'{len(tagset_ids)} tagsets')
+
+    # audios (paths relative to FILE_FOLDER)
+    audio_prefix = _audio_prefix(dummy_data_folder, prefix)
+    os.makedirs(os.path.join(file_folder, os.path.dirname(audio_prefix)), exist_ok=True)
+    audio_paths = [f'{audio_prefix}{i}.wav'
+        for i in range(sizes['n_audios'])]
+    audio_ids = [audio_id for audio_id, in _insert(connection, Audio.__table__,
+        [{'path': path, 'created_by_id': rng.choice(user_ids)} for path in audio_paths],
+        batch_size, Audio.id)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(_write_random_wav,
+                [(os.path.join(file_folder, path), [seed, i])
+                    for i, path in enumerate(audio_paths)],
+                chunksize=64):
+            pass
+    echo(f'{len(audio_ids)} audios')
+
+    # audio list and tag list files, and projects
+    tagset_name_by_id = dict(zip(tagset_ids, tagset_names))
+    tag_name_by_id = {tag_id: f'{prefix}_tag{i}' for i, tag_id in enumerate(tag_ids)}
+    audio_path_by_id = dict(zip(audio_ids, audio_paths))
+    list_folder = os.path.join(dummy_data_folder, 'list_files')
+    os.makedirs(os.path.join(file_folder, list_folder), exist_ok=True)
+    projects = []
+    for i in range(sizes['n_projects']):
+        p_audio_ids = rng.sample(audio_ids, sizes['n_audios_per_project'])
+        p_tagset_ids = rng.sample(tagset_ids, sizes['n_tagsets_per_project'])
+        audiolist_filename = os.path.join(list_folder, f'{prefix}_audiolist{i}.csv')
+        with open(os.path.join(file_folder, audiolist_filename), 'w') as audiolist_file:
+            for audio_id in p_audio_ids:
+                audiolist_file.write(audio_path_by_id[audio_id] + '\n')
+        taglist_filename = os.path.join(list_folder, f'{prefix}_taglist{i}.csv')
+        with open(os.path.join(file_folder, taglist_filename), 'w') as taglist_file:
+            for tagset_id in p_tagset_ids:
+                for tag_id in tagset_tags[tagset_id]:
+                    taglist_file.write(tagset_name_by_id[tagset_id] + ',' + tag_name_by_id[tag_id] + '\n')
+        projects.append(({
+            'name': f'{prefix}_project{i}',
+            'allow_regions': rng.choice([True, False]),
+            'audiolist_filename': audiolist_filename,
+            'taglist_filename': taglist_filename,
+            'min_annotations_per_file': 1,
+            'members_only': False,
+        }, p_audio_ids, p_tagset_ids))
+    project_ids = [project_id for project_id, in _insert(connection, Project.__table__,
+        [row for row, _, _ in projects], batch_size, Project.id)]
+    bump_cache_versions(connection, {'projects'})
+    for project_id in project_ids:
+        create_annotation_partition(connection, project_id)
+        ingest_project(connection, project_id)
+    echo(f'{len(project_ids)} projects')
+
+    # project members, the first one being admin
+    project_users = {project_id: rng.sample(user_ids, sizes['n_users_per_project'])
+        for project_id in project_ids}
+    for chunk in _chunks([{
+            'project_id': project_id,
+            'user_id': user_id,
+            'user_role': Role.PROJECTMEMBER if i else Role.PROJECTADMIN}
+            for project_id, p_user_ids in project_users.items()
+            for i, user_id in enumerate(p_user_ids)], batch_size):
+        connection.execute(UserProjectRel.__table__.insert().values(chunk))
+
+    # annotations: for each audio, annotator and tagset of a project,
+    # n_annotations_per_annotator_per_audio annotations with random tags
+    n_annotations = 0
+    for project_id, (_, p_audio_ids, p_tagset_ids) in zip(project_ids, projects):
+        p_user_ids = project_users[project_id]
+        audio_index, user_index, _, tagset_index = np.indices((
+            len(p_audio_ids),
+            len(p_user_ids),
+            sizes['n_annotations_per_annotator_per_audio'],
+            len(p_tagset_ids))).reshape(4, -1)
+        n = len(audio_index)
+        if not n:
+            continue
+        tags = np.array([tagset_tags[tagset_id] for tagset_id in p_tagset_ids], dtype=np.int64)
+        start_time = np_rng.uniform(0, AUDIO_DURATION - MIN_ANNOTATION_SIZE, size=n)
+        end_time = start_time + MIN_ANNOTATION_SIZE + np_rng.uniform(size=n) \
+            * (AUDIO_DURATION - MIN_ANNOTATION_SIZE - start_time)
+        _copy_annotations(connection, (
+            start_time,
+            end_time,
+            tags[tagset_index, np_rng.randint(tags.shape[1], size=n)],
+            np.full(n, project_id, dtype=np.int64),
+            np.array(p_audio_ids, dtype=np.int64)[audio_index],
+            np.array(p_user_ids, dtype=np.int64)[user_index]), batch_size)
+        # COPY bypasses the session: rebuild the counters and statistics
+        refresh_completion(connection, project_id)
+        refresh_statistics(connection, project_id)
+        n_annotations += n
+    echo(f'{n_annotations} annotations')
+
+
+def _audio_prefix(dummy_data_folder, prefix):
+    return os.path.join(dummy_data_folder, 'audio_files', f'{prefix}_audio')
+
+
+def delete_dummy_data(connection, dummy_data_folder, prefix='dummy'):
+    """Delete the rows generated by put_dummy_data with set-based deletes."""
+
+    user_filter = User.username.startswith(f'{prefix}_user', autoescape=True)
+    project_filter = Project.name.startswith(f'{prefix}_project', autoescape=True)
+    tagset_filter = Tagset.name.startswith(f'{prefix}_tagset', autoescape=True)
+    tag_filter = Tag.name.startswith(f'{prefix}_tag', autoescape=True)
+    audio_filter = Audio.path.startswith(_audio_prefix(dummy_data_folder, prefix), autoescape=True)
+    users = select([User.id]).where(user_filter)
+    projects = select([Project.id]).where(project_filter)
+    tagsets = select([Tagset.id]).where(tagset_filter)
+    tags = select([Tag.id]).where(tag_filter)
+    audios = select([Audio.id]).where(audio_filter)
+
+    # cached responses of the deleted projects, and cached users
+    project_ids = [project_id for project_id, in connection.execute(projects)]
+    bump_cache_versions(connection, {'projects', USERS_VERSION_KEY} | {project_cache_key(project_id)
+        for project_id in project_ids})
+
+    # annotations of the dummy projects, then the others
+    for project_id in project_ids:
+        remove_annotation_partition(connection, project_id)
+    annotation = Annotation.__table__
+    connection.execute(annotation.delete().where(or_(
+        annotation.c.audio_id.in_(audios),
+        annotation.c.tag_id.in_(tags),
+        annotation.c.created_by_id.in_(users))))
+    user_project_rel = UserProjectRel.__table__
+    connection.execute(user_project_rel.delete().where(or_(
+        user_project_rel.c.project_id.in_(projects),
+        user_project_rel.c.user_id.in_(users))))
+    connection.execute(audio_project_rel.delete().where(or_(
+        audio_project_rel.c.project_id.in_(projects),
+        audio_project_rel.c.audio_id.in_(audios))))
+    connection.execute(tagset_project_rel.delete().where(or_(
+        tagset_project_rel.c.project_id.in_(projects),
+        tagset_project_rel.c.tagset_id.in_(tagsets))))
+    connection.execute(tag_tagset_rel.delete().where(or_(
+        tag_tagset_rel.c.tagset_id.in_(tagsets),
+        tag_tagset_rel.c.tag_id.in_(tags))))
+    # the completion counters of projects, audios and users are cascaded
+    for table, where in (
+            (Tag.__table__, tag_filter),
+            (Tagset.__table__, tagset_filter),
+            (Audio.__table__, audio_filter),
+            (Project.__table__, project_filter),
+            (User.__table__, user_filter)):
+        connection.execute(table.delete().where(where))
@@ -0,0 +1,84 @@
+import io
+import csv
+from phaunos.shared import db
+from phaunos.phaunos.models import Annotation
+from phaunos.phaunos.serializers import annotation_encoder
+
+
+# Streaming export of annotations.
+#
+# Rows are read through a server-side cursor in batches of EXPORT_BATCH_SIZE
+# and encoded as they arrive, so that memory use does not depend on the
+# number of exported annotations.
+
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def annotation_export_statement(query):
+    """Turn an Annotation query into a select of the exported columns."""
+    return annotation_encoder.query(query) \
+        .order_by(Annotation.id) \
+        .statement
+
+
+def stream_rows(statement, batch_size):
+    """Execute statement with a server-side cursor and yield batches of rows."""
+
+    # a replica in read-only requests (see routing.py)
+    connection = db.session.get_bind(clause=statement).connect()
+    try:
+        with connection.begin():
+            result = connection \
+                .execution_options(stream_results=True) \
+                .execute(statement)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        connection.close()
+
+
+def _encode_json(encoder, batches):
+    yield '['
+    separator = ''
+    for rows in batches:
+        yield separator + ', '.join(map(encoder.encode, rows))
+        separator = ', '
+    yield ']'
+
+
+def _encode_jsonl(encoder, batches):
+    for rows in batches:
+        yield ''.join(encoder.encode(row) + '\n' for row in rows)
+
+
+def _encode_csv(encoder, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(encoder.keys)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+_ENCODERS = {
+    'json': _encode_json,
+    'jsonl': _encode_jsonl,
+    'csv': _encode_csv,
+}
+
+
+def export_annotations(query, fmt, batch_size):
+    """Yield the annotations selected by query, encoded in fmt, chunk by chunk."""
+    statement = annotation_export_statement(query)
+    return _ENCODERS[fmt](annotation_encoder, stream_rows(statement, batch_size))
@@ -0,0 +1,63 @@
+import os
+import stat
+import mimetypes
+from urllib.parse import quote
+from flask import current_app, request, Response, abort
+from flask.helpers import safe_join
+from werkzeug.wsgi import wrap_file
+
+
+# File serving with Range, conditional requests and offloading.
+#
+# FILE_OFFLOAD selects who sends the bytes:
+#   None: the worker, through wsgi.file_wrapper (sendfile with most WSGI
+#     servers) for complete responses. Range (206), If-None-Match and
+#     If-Modified-Since (304) are handled here.
+#   'x-sendfile': the front server (Apache mod_xsendfile, lighttpd), given
+#     the absolute path in the X-Sendfile header.
+#   'x-accel-redirect': nginx, given FILE_OFFLOAD_PREFIX + filename in the
+#     X-Accel-Redirect header (FILE_OFFLOAD_PREFIX must be an internal
+#     location aliased to FILE_FOLDER).
+# In offload modes the front server handles ranges and validators itself.
+
+
+def file_etag(st):
+    """Strong ETag of a file, changing with its size and modification time."""
+    return '{:x}-{:x}'.format(st.st_size, st.st_mtime_ns)
+
+
+def send_file_conditional(directory, filename):
+    path = safe_join(directory, filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        abort(404)
+    if not stat.S_ISREG(st.st_mode):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    offload = current_app.config['FILE_OFFLOAD']
+    if offload == 'x-accel-redirect':
+        resp = Response(mimetype=mimetype)
+        resp.headers['X-Accel-Redirect'] = current_app.config['FILE_OFFLOAD_PREFIX'] + quote(filename)
+        return resp
+    if offload == 'x-sendfile':
+        resp = Response(mimetype=mimetype)
+        resp.headers['X-Sendfile'] = path
+        return resp
+
+    f = open(path, 'rb')
+    try:
+        resp = Response(
+            wrap_file(request.environ, f),
+            mimetype=mimetype,
+            direct_passthrough=True)
+        resp.content_length = st.st_size
+        resp.set_etag(file_etag(st))
+        resp.last_modified = int(st.st_mtime)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = current_app.get_send_file_max_age(filename)
+        return resp.make_conditional(request, accept_ranges=True, complete_length=st.st_size)
+    except Exception:
+        f.close()
+        raise
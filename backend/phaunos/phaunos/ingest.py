@@ -0,0 +1,163 @@
+import os
+import itertools
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from phaunos.phaunos.models import (
+    Audio,
+    Tag,
+    Tagset,
+    Project,
+    audio_project_rel,
+    tagset_project_rel,
+    tag_tagset_rel,
+    refresh_completion,
+    bump_project_versions,
+)
+
+
+# Bulk ingestion of the audio list and tag list files of a project.
+#
+# Files are read in chunks of INGEST_CHUNK_SIZE lines. For each chunk,
+# existing rows are resolved with one set-based lookup, missing rows are
+# created with one multi-row insert and association rows are inserted in
+# bulk, so that memory use is bounded by the chunk size.
+
+
+def _read_lines(filename):
+    with open(filename, 'r') as infile:
+        for line in infile:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _get_or_create(connection, table, column, values):
+    """Return a dict mapping values of a unique column to row ids,
+    inserting the missing rows."""
+
+    values = set(values)
+    ids = dict(connection.execute(
+        select([column, table.c.id]).where(column.in_(values))).fetchall())
+    missing = values - set(ids)
+    if missing:
+        ids.update(connection.execute(
+            pg_insert(table)
+                .values([{column.name: value} for value in missing])
+                .on_conflict_do_nothing(index_elements=[column])
+                .returning(column, table.c.id)).fetchall())
+        # rows inserted concurrently by another transaction
+        missing -= set(ids)
+        if missing:
+            ids.update(connection.execute(
+                select([column, table.c.id]).where(column.in_(missing))).fetchall())
+    return ids
+
+
+def _no_progress(fraction=None, message=None):
+    pass
+
+
+def add_audios(connection, project_id, paths):
+    """Add audios to a project, creating the missing ones. Returns a dict
+    mapping paths to audio ids, and the number of audios new to the project."""
+
+    audio = Audio.__table__
+    audio_ids = _get_or_create(connection, audio, audio.c.path, paths)
+    n_added = connection.execute(
+        pg_insert(audio_project_rel)
+            .values([{'project_id': project_id, 'audio_id': audio_id}
+                for audio_id in set(audio_ids.values())])
+            .on_conflict_do_nothing()).rowcount
+    return audio_ids, n_added
+
+
+def ingest_audiolist(connection, project_id, filename, chunk_size, progress=_no_progress):
+    """Add the audios listed in filename to a project, creating the
+    missing ones."""
+
+    n_lines = 0
+    for chunk in _chunks(_read_lines(filename), chunk_size):
+        add_audios(connection, project_id, chunk)
+        n_lines += len(chunk)
+        progress(message=f'{n_lines} audio list lines ingested')
+
+
+def ingest_taglist(connection, project_id, filename, chunk_size, progress=_no_progress):
+    """Add the tagsets listed in filename (one <tagsetname>,<tagname> per line)
+    to a project, creating the missing tagsets and tags. Returns the ids of
+    the tagsets to which tags were added."""
+
+    tagset = Tagset.__table__
+    tag = Tag.__table__
+    n_lines = 0
+    extended = set()
+    for chunk in _chunks(_read_lines(filename), chunk_size):
+        pairs = {tuple(line.split(',')) for line in chunk}
+        tagset_ids = _get_or_create(connection, tagset, tagset.c.name,
+            {tagset_name for tagset_name, _ in pairs})
+
+        # resolve existing tags by (tagset id, tag name)
+        tag_ids = {(tagset_id, name): tag_id for tagset_id, name, tag_id in connection.execute(
+            select([tag_tagset_rel.c.tagset_id, tag.c.name, tag.c.id])
+                .select_from(tag.join(tag_tagset_rel))
+                .where(tag_tagset_rel.c.tagset_id.in_(set(tagset_ids.values())))
+                .where(tag.c.name.in_({tag_name for _, tag_name in pairs})))}
+
+        # create missing tags, one multi-row insert per tagset
+        missing = {}
+        for tagset_name, tag_name in pairs:
+            tagset_id = tagset_ids[tagset_name]
+            if (tagset_id, tag_name) not in tag_ids:
+                missing.setdefault(tagset_id, set()).add(tag_name)
+        tag_tagset_rows = []
+        for tagset_id, tag_names in missing.items():
+            for tag_id, in connection.execute(
+                    tag.insert()
+                        .values([{'name': name} for name in tag_names])
+                        .returning(tag.c.id)):
+                tag_tagset_rows.append({'tagset_id': tagset_id, 'tag_id': tag_id})
+        if tag_tagset_rows:
+            connection.execute(tag_tagset_rel.insert().values(tag_tagset_rows))
+        extended.update(missing)
+
+        connection.execute(
+            pg_insert(tagset_project_rel)
+                .values([{'project_id': project_id, 'tagset_id': tagset_id}
+                    for tagset_id in set(tagset_ids.values())])
+                .on_conflict_do_nothing())
+        n_lines += len(chunk)
+        progress(message=f'{n_lines} tag list lines ingested')
+    return extended
+
+
+def ingest_project(connection, project_id, progress=_no_progress):
+    """Ingest the audio list and tag list files of a project.
+
+    progress(fraction=None, message=None) is called after each chunk.
+    """
+
+    audiolist_filename, taglist_filename = connection.execute(
+        select([Project.audiolist_filename, Project.taglist_filename])
+            .where(Project.id==project_id)).first()
+    file_folder = current_app.config['FILE_FOLDER']
+    chunk_size = current_app.config['INGEST_CHUNK_SIZE']
+
+    ingest_audiolist(connection, project_id,
+        os.path.join(file_folder, audiolist_filename), chunk_size, progress)
+    progress(0.5)
+    extended = ingest_taglist(connection, project_id,
+        os.path.join(file_folder, taglist_filename), chunk_size, progress)
+    # the tagsets of the project, and those of other projects that gained tags
+    bump_project_versions(connection, [project_id], extended)
+    progress(0.9)
+    refresh_completion(connection, project_id)
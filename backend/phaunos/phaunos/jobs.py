@@ -0,0 +1,353 @@
+import os
+import time
+import socket
+import datetime
+import threading
+from flask import current_app
+from sqlalchemy import select, exists, and_, or_, func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from phaunos.shared import db
+from phaunos.phaunos.models import (
+    Job,
+    JobState,
+    Annotation,
+    audio_project_rel,
+    refresh_completion,
+    refresh_statistics,
+    CASCADING_MODELS,
+    cascaded_annotations,
+    cascaded_projects,
+    bump_cascaded_versions,
+    bump_cache_versions,
+    enqueue_refreshes,
+)
+from phaunos.user.models import User, USERS_VERSION_KEY
+
+
+# Database-backed job queue.
+#
+# Jobs are rows of the job table. They are queued in the transaction of
+# the operation requesting them (so they are only visible once it
+# commits) and run by worker processes (flask worker), which claim them
+# with SELECT ... FOR UPDATE SKIP LOCKED, so that concurrent workers never
+# claim the same job.
+#
+# A job runs in a transaction of its own, which also marks it as
+# succeeded: the work of a job is committed exactly when the job is.
+# Progress and heartbeats are written in separate transactions, so that
+# they are visible while the job runs. Heartbeats are written by a thread
+# of the worker every JOB_HEARTBEAT_INTERVAL seconds, whatever the handler
+# does. A failed job is retried up to JOB_MAX_ATTEMPTS times, after a
+# delay doubled at each attempt, then can be retried by hand (retry_job),
+# which re-queues the same row. Running jobs without heartbeat for
+# JOB_HEARTBEAT_TIMEOUT seconds (crashed workers) are claimed again: the
+# attempt of the crashed worker, if it was only stalled, cannot mark the
+# job as succeeded or failed any more, and its transaction is rolled back.
+#
+# At most one job per key is pending or running, so queuing a job which is
+# already queued returns the existing one.
+
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register a function handler(connection, params, progress) running
+    the jobs of a kind."""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+_ACTIVE = text("state IN ('PENDING', 'RUNNING')")
+
+
+def enqueue(connection, kind, params, key=None, project_id=None, created_by_id=None):
+    """Queue a job and return its id, or the id of the pending or running
+    job with the same key."""
+
+    job = Job.__table__
+    key = key or kind
+    row = connection.execute(
+        pg_insert(job)
+            .values(
+                kind=kind,
+                params=params,
+                key=key,
+                state=JobState.PENDING,
+                progress=0,
+                attempts=0,
+                project_id=project_id,
+                created_by_id=created_by_id)
+            .on_conflict_do_nothing(index_elements=[job.c.key], index_where=_ACTIVE)
+            .returning(job.c.id)).first()
+    if row is None:
+        row = connection.execute(
+            select([job.c.id]).where(and_(job.c.key==key, _ACTIVE))).first()
+    return row[0]
+
+
+def enqueue_ingestion(connection, project_id, created_by_id=None):
+    return enqueue(connection, 'ingest_project', {'project_id': project_id},
+        key=f'ingest_project:{project_id}',
+        project_id=project_id,
+        created_by_id=created_by_id)
+
+
+def enqueue_purge(connection, model_name, object_id, created_by_id=None):
+    """Queue the deletion of a user, tag or audio (model_name is a key of
+    CASCADING_MODELS) with its annotations."""
+    return enqueue(connection, 'purge', {'model': model_name, 'id': object_id},
+        key=f'purge:{model_name}:{object_id}',
+        created_by_id=created_by_id)
+
+
+def retry_job(connection, job_id):
+    """Re-queue a failed job. Returns False if the job is not failed or if
+    a job with the same key is pending or running."""
+
+    job = Job.__table__
+    active = job.alias('active')
+    return connection.execute(job.update()
+        .where(job.c.id==job_id)
+        .where(job.c.state==JobState.FAILED)
+        .where(~exists()
+            .where(active.c.key==job.c.key)
+            .where(active.c.state.in_([JobState.PENDING, JobState.RUNNING])))
+        .values(
+            state=JobState.PENDING,
+            progress=0,
+            attempts=0,
+            message=None,
+            next_attempt_at=func.now(),
+            finished_at=None)).rowcount == 1
+
+
+def claim_job(connection, worker, heartbeat_timeout):
+    """Mark the oldest runnable job as running and return it (None if
+    there is none)."""
+
+    job = Job.__table__
+    stale = func.now() - datetime.timedelta(seconds=heartbeat_timeout)
+    candidate = select([job.c.id]) \
+        .where(or_(
+            and_(job.c.state==JobState.PENDING, job.c.next_attempt_at <= func.now()),
+            and_(job.c.state==JobState.RUNNING, job.c.heartbeat_at < stale))) \
+        .order_by(job.c.id) \
+        .limit(1) \
+        .with_for_update(skip_locked=True) \
+        .as_scalar()
+    return connection.execute(job.update()
+        .where(job.c.id==candidate)
+        .values(
+            state=JobState.RUNNING,
+            attempts=job.c.attempts + 1,
+            worker=worker,
+            started_at=func.now(),
+            heartbeat_at=func.now())
+        .returning(*job.c)).first()
+
+
+def _current_attempt(claimed):
+    """Criterion selecting a claimed job, unless it was claimed again since."""
+    job = Job.__table__
+    return and_(
+        job.c.id==claimed.id,
+        job.c.state==JobState.RUNNING,
+        job.c.worker==claimed.worker,
+        job.c.attempts==claimed.attempts)
+
+
+class _Heartbeat(threading.Thread):
+    """Thread writing the heartbeat of a claimed job every interval seconds."""
+
+    def __init__(self, engine, claimed, interval):
+        super(_Heartbeat, self).__init__(daemon=True)
+        self.engine = engine
+        self.claimed = claimed
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        job = Job.__table__
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(job.update()
+                        .where(_current_attempt(self.claimed))
+                        .values(heartbeat_at=func.now()))
+            except Exception:
+                # retried at the next interval
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _retry_delay(attempts):
+    config = current_app.config
+    return datetime.timedelta(seconds=min(
+        config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1),
+        config['JOB_MAX_RETRY_DELAY']))
+
+
+def _progress_reporter(job_id):
+    job = Job.__table__
+
+    def progress(fraction=None, message=None):
+        values = {'heartbeat_at': func.now()}
+        if fraction is not None:
+            values['progress'] = fraction
+        if message is not None:
+            values['message'] = message
+        with db.engine.begin() as connection:
+            connection.execute(job.update().where(job.c.id==job_id).values(**values))
+    return progress
+
+
+def run_next_job(worker=None):
+    """Claim and run a job. Returns the id of the job, None if there was
+    no job to run."""
+
+    config = current_app.config
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    job = Job.__table__
+    with db.engine.begin() as connection:
+        claimed = claim_job(connection, worker, config['JOB_HEARTBEAT_TIMEOUT'])
+    if claimed is None:
+        return None
+
+    heartbeat = _Heartbeat(db.engine, claimed, config['JOB_HEARTBEAT_INTERVAL'])
+    heartbeat.start()
+    try:
+        handler = JOB_HANDLERS[claimed.kind]
+        connection = db.session.connection()
+        handler(connection, claimed.params, _progress_reporter(claimed.id))
+        n_updated = connection.execute(job.update()
+            .where(_current_attempt(claimed))
+            .values(state=JobState.SUCCEEDED, progress=1, message=None, finished_at=func.now())).rowcount
+        if n_updated:
+            db.session.commit()
+        else:
+            db.session.rollback()
+            current_app.logger.error('Job %s (%s) was claimed again, its work is rolled back',
+                claimed.id, claimed.kind)
+    except Exception as err:
+        db.session.rollback()
+        current_app.logger.exception('Job %s (%s) failed', claimed.id, claimed.kind)
+        failed = claimed.attempts >= config['JOB_MAX_ATTEMPTS']
+        with db.engine.begin() as connection:
+            connection.execute(job.update()
+                .where(_current_attempt(claimed))
+                .values(
+                    state=JobState.FAILED if failed else JobState.PENDING,
+                    message=f'{type(err).__name__}: {err}',
+                    next_attempt_at=func.now() + _retry_delay(claimed.attempts),
+                    finished_at=func.now() if failed else None))
+    finally:
+        heartbeat.stop()
+        db.session.remove()
+    return claimed.id
+
+
+def work(poll_interval, once=False):
+    """Run jobs until interrupted (or until there is none left if once)."""
+    while True:
+        if run_next_job() is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+############
+# Handlers #
+############
+
+@job_handler('ingest_project')
+def _ingest_project(connection, params, progress):
+    from phaunos.phaunos.ingest import ingest_project
+    project_id = params['project_id']
+    ingest_project(connection, project_id, progress)
+    enqueue(connection, 'index_audios', {'project_id': project_id},
+        key=f'index_audios:{project_id}',
+        project_id=project_id)
+
+
+@job_handler('index_audios')
+def _index_audios(connection, params, progress):
+    from phaunos.phaunos.audio_index import index_audios
+    audio_ids = None
+    if params.get('project_id') is not None:
+        audio_ids = [audio_id for audio_id, in connection.execute(
+            select([audio_project_rel.c.audio_id])
+                .where(audio_project_rel.c.project_id==params['project_id']))]
+    n_errors = 0
+    for i, (_, error) in enumerate(index_audios(
+            connection,
+            current_app.config['FILE_FOLDER'],
+            audio_ids=audio_ids,
+            force=params.get('force', False),
+            workers=current_app.config['JOB_PROCESSES'],
+            batch_size=current_app.config['AUDIO_INDEX_BATCH_SIZE'])):
+        n_errors += bool(error)
+        if i % 100 == 0:
+            progress(message=f'{i + 1} files scanned, {n_errors} errors')
+
+
+@job_handler('refresh_completion')
+def _refresh_completion(connection, params, progress):
+    refresh_completion(connection, params['project_id'])
+
+
+@job_handler('refresh_statistics')
+def _refresh_statistics(connection, params, progress):
+    refresh_statistics(connection, params['project_id'])
+
+
+@job_handler('precompute_spectrograms')
+def _precompute_spectrograms(connection, params, progress):
+    from phaunos.phaunos.models import Audio
+    from phaunos.phaunos.spectrogram import params_from_config, precompute_tiles
+    config = current_app.config
+    paths = [os.path.join(config['FILE_FOLDER'], path) for path, in connection.execute(
+        select([Audio.path])
+            .select_from(Audio.__table__.join(audio_project_rel))
+            .where(audio_project_rel.c.project_id==params['project_id']))]
+    cache_folder = os.path.join(config['FILE_FOLDER'], config['SPECTROGRAM_CACHE_FOLDER'])
+    n_errors = 0
+    for i, (path, error) in enumerate(precompute_tiles(
+            paths, params_from_config(config), cache_folder, config['JOB_PROCESSES'])):
+        n_errors += bool(error)
+        progress((i + 1) / len(paths), f'{i + 1} files done, {n_errors} errors')
+
+
+@job_handler('purge')
+def _purge(connection, params, progress):
+    # The annotations are deleted in batches, each in a transaction of its
+    # own, then the object is deleted (with what is left) in the job
+    # transaction, which queues the rebuild of the counters of the projects.
+    # A retried job deletes the annotations left by the failed attempt.
+    model = CASCADING_MODELS[params['model']]
+    object_id = params['id']
+    project_ids = cascaded_projects(connection, model, object_id)
+    annotation = Annotation.__table__
+    batch = select([annotation.c.id, annotation.c.project_id]) \
+        .where(cascaded_annotations(model, object_id)) \
+        .limit(current_app.config['PURGE_BATCH_SIZE'])
+    n_deleted = 0
+    while True:
+        with db.engine.begin() as batch_connection:
+            n = batch_connection.execute(annotation.delete()
+                .where(tuple_(annotation.c.id, annotation.c.project_id).in_(batch))).rowcount
+        if not n:
+            break
+        n_deleted += n
+        progress(message=f'{n_deleted} annotations deleted')
+    bump_cascaded_versions(connection, model, object_id)
+    if model is User:
+        # users cached by the API processes
+        bump_cache_versions(connection, {USERS_VERSION_KEY})
+    connection.execute(model.__table__.delete().where(model.id==object_id))
+    enqueue_refreshes(connection, project_ids)
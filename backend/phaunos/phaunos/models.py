@@ -1,14 +1,20 @@
 import os
 import re
 import enum
+import itertools
+import collections
 from flask import current_app
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import UniqueConstraint, DDL
 from sqlalchemy.event import listens_for
-from sqlalchemy.dialects.postgresql import ENUM
+from sqlalchemy.dialects.postgresql import ENUM, JSONB, insert as pg_insert
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
+from sqlalchemy import select, func, distinct, and_, or_, cast, literal_column, tuple_
 from phaunos.shared import db, ma
 from phaunos.user.models import User
+from phaunos.cache import invalidate
 from sqlalchemy.ext.declarative import declarative_base
-from marshmallow import fields, validate, pre_load
+from marshmallow import fields, validate, pre_load, validates_schema, ValidationError
 from sqlalchemy import event
 
 from flask_jwt_extended import (
@@ -37,40 +43,52 @@ class Role(enum.Enum):
     PROJECTMEMBER = enum.auto()
 
 
+# Rows are deleted with their parents by the database (ON DELETE CASCADE
+# foreign keys, passive_deletes relationships), without loading them. See
+# Deletion below.
+
 audio_project_rel = db.Table(
     'audio_project_rel',
-    db.Column('project_id', db.Integer, db.ForeignKey('project.id'), primary_key=True),
-    db.Column('audio_id', db.Integer, db.ForeignKey('audio.id'), primary_key=True)
+    db.Column('project_id', db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('audio_id', db.Integer, db.ForeignKey('audio.id', ondelete='CASCADE'), primary_key=True)
 )
 
 tagset_project_rel = db.Table(
     'tagset_project_rel',
-    db.Column('project_id', db.Integer, db.ForeignKey('project.id'), primary_key=True),
-    db.Column('tagset_id', db.Integer, db.ForeignKey('tagset.id'), primary_key=True)
+    db.Column('project_id', db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tagset_id', db.Integer, db.ForeignKey('tagset.id', ondelete='CASCADE'), primary_key=True)
 )
 
 tag_tagset_rel = db.Table(
     'tag_tagset_rel',
-    db.Column('tagset_id', db.Integer, db.ForeignKey('tagset.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tagset_id', db.Integer, db.ForeignKey('tagset.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
 )
 
 
 class UserProjectRel(db.Model):
     __tablename__ = 'user_project_rel'
-    user_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id'), primary_key=True)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
     user_role = db.Column(ENUM(Role), nullable=False)
-    user = db.relationship('User', backref=db.backref('user_project_rel', cascade='all'))
-    project = db.relationship('Project', backref=db.backref('user_project_rel', cascade='all'))
+    user = db.relationship('User', backref=db.backref('user_project_rel', cascade='all', passive_deletes=True))
+    project = db.relationship('Project', backref=db.backref('user_project_rel', cascade='all', passive_deletes=True))
+
+
+def project_roles(user_id):
+    """Return a dict mapping project ids to the roles of a user (cached)."""
+    cache = current_app.extensions['role_cache']
+    roles = cache.get(user_id)
+    if roles is None:
+        roles = dict(db.session.query(UserProjectRel.project_id, UserProjectRel.user_role)
+            .filter(UserProjectRel.user_id==user_id))
+        cache.set(user_id, roles)
+    return roles
 
 
 # bound new method to User
 def is_project_admin(self, project_id):
-    return True if UserProjectRel.query.filter(
-        UserProjectRel.project_id==project_id,
-        UserProjectRel.user_id==self.id,
-        UserProjectRel.user_role==Role.PROJECTADMIN).first() else False
+    return project_roles(self.id).get(project_id) == Role.PROJECTADMIN
 User.is_project_admin = is_project_admin
 
 
@@ -78,12 +96,13 @@ class Tag(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id'))
-    created_by = db.relationship('User', backref=db.backref('tags', cascade='all'))
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'))
+    created_by = db.relationship('User', backref=db.backref('tags', cascade='all', passive_deletes=True))
     annotations = db.relationship('Annotation',
             backref='tag',
             lazy=True,
-            cascade='all')
+            cascade='all',
+            passive_deletes=True)
 
     def __repr__(self):
         return '<name {}>'.format(self.name)
@@ -92,13 +111,14 @@ class Tagset(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True, nullable=False)
-    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id'))
-    created_by = db.relationship(User, backref=db.backref('tagsets', cascade='all'))
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'))
+    created_by = db.relationship(User, backref=db.backref('tagsets', cascade='all', passive_deletes=True))
     tags = db.relationship(
         'Tag',
         secondary=tag_tagset_rel,
         lazy=True,
-        backref='tagsets'
+        passive_deletes=True,
+        backref=db.backref('tagsets', passive_deletes=True)
     )
 
     def __repr__(self):
@@ -112,32 +132,94 @@ class Audio(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     path = db.Column(db.String, unique=True, nullable=False)
-    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id'))
-    created_by = db.relationship(User, backref=db.backref('audios', cascade='all'))
+    # metadata read from the file header (see audio_index.py)
+    duration = db.Column(db.Float, nullable=True)
+    sample_rate = db.Column(db.Integer, nullable=True)
+    n_channels = db.Column(db.Integer, nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    mtime = db.Column(db.Float, nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'))
+    created_by = db.relationship(User, backref=db.backref('audios', cascade='all', passive_deletes=True))
     annotations = db.relationship(
         'Annotation',
         backref='audio',
         cascade='all',
+        passive_deletes=True,
         lazy=True
     )
 
+    @property
+    def file_path(self):
+        return os.path.join(current_app.config['FILE_FOLDER'], self.path)
+
     def __repr__(self):
         return '<id {}>'.format(self.path)
 
+def time_range(start_time, end_time):
+    """Closed numeric range [start_time, end_time], a null bound being unbounded."""
+    return func.numrange(
+        cast(start_time, db.Numeric),
+        cast(end_time, db.Numeric),
+        literal_column("'[]'"))
+
+
 class Annotation(db.Model):
 
-    id = db.Column(db.Integer, primary_key=True)
+    # partitioned by project (see Partitions below): the primary key of the
+    # table includes the partition key, ids are still unique
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     start_time = db.Column(db.Float, nullable=True)
     end_time = db.Column(db.Float, nullable=True)
-    tag_id = db.Column(db.Integer, db.ForeignKey(Tag.id), nullable=False)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
-    audio_id = db.Column(db.Integer, db.ForeignKey('audio.id'), nullable=False)
-    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id'))
-    created_by = db.relationship(User, backref=db.backref('annotations', cascade='all'))
+    tag_id = db.Column(db.Integer, db.ForeignKey(Tag.id, ondelete='CASCADE'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    audio_id = db.Column(db.Integer, db.ForeignKey('audio.id', ondelete='CASCADE'), nullable=False)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'))
+    created_by = db.relationship(User, backref=db.backref('annotations', cascade='all', passive_deletes=True))
+
+    # Indexes are created on each partition, where project_id is constant:
+    # the primary key serves the annotations of a project in keyset
+    # pagination order.
+    __table_args__ = (
+        db.CheckConstraint('start_time <= end_time', name='ck_annotation_time_order'),
+        # GiST index for overlap queries (see Annotation.overlaps), on the
+        # regions of each audio (btree_gist indexes the audio ids)
+        db.Index('ix_annotation_time_range',
+            audio_id,
+            time_range(start_time, end_time),
+            postgresql_using='gist'),
+        # Annotations of an audio (also completion counts, grouping the
+        # annotators of each audio of a project)
+        db.Index('ix_annotation_audio_id', audio_id, created_by_id),
+        # Annotations of a tag
+        db.Index('ix_annotation_tag_id', tag_id, id),
+        # Annotations of a user (the only ones listed to project members)
+        db.Index('ix_annotation_created_by_id', created_by_id, id),
+        {'postgresql_partition_by': 'LIST (project_id)'},
+    )
+
+    __mapper_args__ = {'primary_key': [id]}
+
+    @classmethod
+    def overlaps(cls, start, end):
+        """Criterion selecting the annotations overlapping [start, end]
+        (None meaning unbounded). Annotations without region span the
+        whole audio and overlap any interval."""
+        return time_range(cls.start_time, cls.end_time).op('&&')(time_range(start, end))
 
     def __repr__(self):
         return '<id {}>'.format(self.id)
 
+# Extensions used by the schema, created before the tables (flask
+# create-extensions, before flask db upgrade). btree_gist provides the
+# operator classes of scalar types for GiST indexes (a trusted extension
+# since Postgres 13, created by the owner of the database).
+EXTENSIONS = ('btree_gist',)
+
+
+def create_extensions(connection):
+    for extension in EXTENSIONS:
+        connection.execute(f'CREATE EXTENSION IF NOT EXISTS {extension}')
+
 
 
 class Project(db.Model):
@@ -155,35 +237,48 @@ class Project(db.Model):
     tagsets = db.relationship('Tagset',
             secondary=tagset_project_rel,
             lazy=True,
-            backref=db.backref('projects', lazy=True))
+            passive_deletes=True,
+            backref=db.backref('projects', lazy=True, passive_deletes=True))
     audios = db.relationship('Audio',
             secondary=audio_project_rel,
             lazy=True,
-            backref=db.backref('projects', lazy=True))
+            passive_deletes=True,
+            backref=db.backref('projects', lazy=True, passive_deletes=True))
+    # deleted with the partition of the project
     annotations = db.relationship(
         'Annotation',
         lazy=True,
         cascade='all',
+        passive_deletes=True,
         backref='project'
     )
 
     
     @property
     def n_annotations(self):
-        return len(self.annotations)
+        return db.session.query(ProjectStatistics.n_annotations) \
+            .filter(ProjectStatistics.project_id==self.id).scalar() or 0
 
     @property
-    def percentage_of_completion(self):
-
-        n_annotations = 0
-        
-        for audio_id in [audio.id for audio in self.audios]:
-            n_annotations += min(
-                len(db.session.query(Annotation.created_by_id).filter(Annotation.project_id==self.id).filter(Annotation.audio_id==audio_id).distinct().all()),
-                self.min_annotations_per_file
-            )
+    def annotated_seconds(self):
+        return db.session.query(ProjectStatistics.annotated_seconds) \
+            .filter(ProjectStatistics.project_id==self.id).scalar() or 0
 
-        return n_annotations // (self.min_annotations_per_file * len(self.audios)) * 100
+    @property
+    def percentage_of_completion(self):
+        return self.completion_percentage(ProjectCompletion.query.get(self.id))
+
+    def completion_percentage(self, completion):
+        """Percentage of completion from the ProjectCompletion of the
+        project, or from a grouped query if it has none."""
+        if completion:
+            n_audios, n_completed = completion.n_audios, completion.n_completed
+        else:
+            n_audios, n_completed = db.session.execute(
+                completion_query(self.id)).first()
+        if not n_audios:
+            return 0
+        return 100 * n_completed // (self.min_annotations_per_file * n_audios)
 
 #    @property
 #    def is_completed(self):
@@ -196,6 +291,638 @@ class Project(db.Model):
         return '<name {}>'.format(self.name)
 
 
+##############
+# Partitions #
+##############
+
+# The annotation table is partitioned by project (LIST on project_id). Each
+# project gets its partition, annotation_p<project id>, in the transaction
+# creating it. Annotations of projects without partition go to the default
+# partition: partition_annotations() moves them to partitions of their own.
+# Queries on one project only read its partition (statements must compare
+# Annotation.project_id with a constant). Deleting a project drops its
+# partition instead of deleting its annotations, or keeps it detached (see
+# KEEP_DELETED_PROJECT_ANNOTATIONS).
+#
+# Creating, detaching or dropping a partition locks the annotation table
+# until the end of the transaction.
+#
+# The migrations (flask db upgrade) create the annotation table without
+# partitions nor its primary key, and projects cannot be added until
+# flask partition-annotations replaces it (see convert_annotations).
+
+DEFAULT_PARTITION = 'annotation_default'
+
+event.listen(Annotation.__table__, 'after_create', DDL(
+    f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF annotation DEFAULT'))
+
+
+def partition_name(project_id):
+    return f'annotation_p{int(project_id)}'
+
+
+def create_annotation_partition(connection, project_id):
+    connection.execute('CREATE TABLE IF NOT EXISTS {} PARTITION OF annotation '
+        'FOR VALUES IN ({})'.format(partition_name(project_id), int(project_id)))
+
+
+def partition_annotations(connection):
+    """Create the missing partitions of the projects and move the
+    annotations of the default partition to them."""
+
+    # the partitions of projects with rows in the default partition can
+    # only be created while it is detached
+    connection.execute(f'ALTER TABLE annotation DETACH PARTITION {DEFAULT_PARTITION}')
+    for project_id, in connection.execute(select([Project.id])):
+        create_annotation_partition(connection, project_id)
+    n_moved = connection.execute(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} RETURNING *) '
+        'INSERT INTO annotation SELECT * FROM moved').rowcount
+    connection.execute(f'ALTER TABLE annotation ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return n_moved
+
+
+def is_partitioned(connection):
+    """Whether the annotation table is partitioned."""
+    return connection.execute(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('annotation')").scalar()
+
+
+def convert_annotations(connection):
+    """Replace an annotation table without partitions with the partitioned
+    table, with the partitions of the projects, and copy its rows. Returns
+    the number of copied rows."""
+
+    old = 'annotation_unpartitioned'
+    connection.execute(f'ALTER TABLE annotation RENAME TO {old}')
+    # the names of its sequence, primary key and indexes are those of the
+    # new table
+    sequence = connection.execute(db.text(
+        "SELECT pg_get_serial_sequence(:name, 'id')"), name=old).scalar()
+    if sequence:
+        connection.execute(f'ALTER SEQUENCE {sequence} RENAME TO {old}_id_seq')
+    for constraint, in connection.execute(db.text(
+            "SELECT conname FROM pg_constraint "
+            "WHERE conrelid = CAST(:name AS regclass) AND contype IN ('p', 'u')"),
+            name=old).fetchall():
+        connection.execute(f'ALTER TABLE {old} DROP CONSTRAINT "{constraint}"')
+    for index, in connection.execute(db.text(
+            "SELECT indexrelid::regclass::text FROM pg_index "
+            "WHERE indrelid = CAST(:name AS regclass)"),
+            name=old).fetchall():
+        connection.execute(f'DROP INDEX {index}')
+
+    # with its default partition (see the after_create listener)
+    Annotation.__table__.create(connection)
+    for project_id, in connection.execute(select([Project.id])):
+        create_annotation_partition(connection, project_id)
+    columns = ', '.join(column.name for column in Annotation.__table__.columns)
+    n_copied = connection.execute(
+        f'INSERT INTO annotation ({columns}) SELECT {columns} FROM {old}').rowcount
+    connection.execute("SELECT setval(pg_get_serial_sequence('annotation', 'id'), max(id)) "
+        "FROM annotation")
+    connection.execute(f'DROP TABLE {old}')
+    return n_copied
+
+
+def remove_annotation_partition(connection, project_id, keep=False):
+    """Drop the partition of a project or, if keep is set, detach it and
+    keep it as annotation_archive_p<project id>, without foreign keys. The
+    annotations of the project in the default partition are deleted."""
+
+    name = partition_name(project_id)
+    if connection.execute(select([func.to_regclass(name)])).scalar() is not None:
+        if keep:
+            archive = f'annotation_archive_p{int(project_id)}'
+            connection.execute(f'ALTER TABLE annotation DETACH PARTITION {name}')
+            connection.execute(f'ALTER TABLE {name} RENAME TO {archive}')
+            for constraint, in connection.execute(db.text(
+                    "SELECT conname FROM pg_constraint "
+                    "WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'"),
+                    name=archive).fetchall():
+                connection.execute(f'ALTER TABLE {archive} DROP CONSTRAINT "{constraint}"')
+        else:
+            connection.execute(f'DROP TABLE {name}')
+    connection.execute(Annotation.__table__.delete().where(Annotation.project_id==project_id))
+
+
+#######################
+# Completion counters #
+#######################
+
+class AnnotationCount(db.Model):
+    """Number of annotations made by a user on an audio of a project."""
+    __tablename__ = 'annotation_count'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    audio_id = db.Column(db.Integer, db.ForeignKey('audio.id', ondelete='CASCADE'), primary_key=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'), primary_key=True)
+    n_annotations = db.Column(db.Integer, nullable=False)
+
+
+class AudioCompletion(db.Model):
+    """Number of distinct annotators of an audio in a project."""
+    __tablename__ = 'audio_completion'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    audio_id = db.Column(db.Integer, db.ForeignKey('audio.id', ondelete='CASCADE'), primary_key=True)
+    n_annotators = db.Column(db.Integer, nullable=False)
+
+
+class ProjectCompletion(db.Model):
+    """Completion state of a project.
+
+    n_completed is the sum, over the audios of the project, of
+    min(number of annotators, project.min_annotations_per_file).
+    """
+    __tablename__ = 'project_completion'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    n_audios = db.Column(db.Integer, nullable=False)
+    n_completed = db.Column(db.Integer, nullable=False)
+
+
+def completion_query(project_id):
+    """Select (n_audios, n_completed) of a project in a single grouped query."""
+    annotators = select([
+            audio_project_rel.c.audio_id,
+            func.count(distinct(Annotation.created_by_id)).label('n_annotators')]) \
+        .select_from(audio_project_rel.outerjoin(
+            Annotation.__table__,
+            # compared with the constant for partition pruning
+            and_(Annotation.project_id==project_id,
+                Annotation.audio_id==audio_project_rel.c.audio_id))) \
+        .where(audio_project_rel.c.project_id==project_id) \
+        .group_by(audio_project_rel.c.audio_id) \
+        .alias('annotators')
+    min_annotations = select([Project.min_annotations_per_file]) \
+        .where(Project.id==project_id).as_scalar()
+    n_completed = func.coalesce(func.sum(func.least(annotators.c.n_annotators, min_annotations)), 0)
+    return select([func.count(), cast(n_completed, db.Integer)]).select_from(annotators)
+
+
+def refresh_completion(connection, project_id):
+    """Rebuild the completion counters of a project from its annotations."""
+
+    annotation_count = AnnotationCount.__table__
+    connection.execute(annotation_count.delete().where(
+        annotation_count.c.project_id==project_id))
+    connection.execute(annotation_count.insert().from_select(
+        ['project_id', 'audio_id', 'created_by_id', 'n_annotations'],
+        select([Annotation.project_id, Annotation.audio_id, Annotation.created_by_id, func.count()])
+            .where(Annotation.project_id==project_id)
+            .where(Annotation.created_by_id!=None)
+            .group_by(Annotation.project_id, Annotation.audio_id, Annotation.created_by_id)))
+
+    audio_completion = AudioCompletion.__table__
+    connection.execute(audio_completion.delete().where(
+        audio_completion.c.project_id==project_id))
+    connection.execute(audio_completion.insert().from_select(
+        ['project_id', 'audio_id', 'n_annotators'],
+        select([annotation_count.c.project_id, annotation_count.c.audio_id, func.count()])
+            .where(annotation_count.c.project_id==project_id)
+            .group_by(annotation_count.c.project_id, annotation_count.c.audio_id)))
+
+    n_audios, n_completed = connection.execute(completion_query(project_id)).first()
+    stmt = pg_insert(ProjectCompletion.__table__).values(
+        project_id=project_id,
+        n_audios=n_audios,
+        n_completed=n_completed)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[ProjectCompletion.__table__.c.project_id],
+        set_={'n_audios': stmt.excluded.n_audios,
+            'n_completed': stmt.excluded.n_completed}))
+
+
+def _update_counters(connection, table, value, deltas):
+    """Add deltas to the value column of a counter table.
+
+    deltas maps primary key tuples to increments. Missing rows are created
+    and rows dropping to zero are removed. Returns a dict mapping every
+    updated key to its (old, new) value.
+    """
+
+    keys = list(table.primary_key.columns)
+    counter = table.c[value]
+    changes = {}
+
+    # increments, in a single multi-row upsert
+    increments = [dict(zip([c.name for c in keys], key), **{value: n})
+        for key, n in deltas.items() if n > 0]
+    if increments:
+        stmt = pg_insert(table).values(increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={value: counter + stmt.excluded[value]})
+        for row in connection.execute(stmt.returning(*(keys + [counter]))):
+            key, new = tuple(row[:-1]), row[-1]
+            changes[key] = (new - deltas[key], new)
+
+    # decrements (rows may already be gone if their parent was deleted)
+    for key, n in deltas.items():
+        if n >= 0:
+            continue
+        where = and_(*[c==v for c, v in zip(keys, key)])
+        row = connection.execute(table.update().where(where)
+            .values({value: counter + n}).returning(counter)).first()
+        if row is None:
+            continue
+        new = row[0]
+        if new <= 0:
+            connection.execute(table.delete().where(where))
+        changes[key] = (new - n, max(new, 0))
+
+    return changes
+
+
+def apply_completion_deltas(connection, deltas):
+    """Update the completion counters with annotation count deltas.
+
+    deltas maps (project_id, audio_id, created_by_id) to the number of
+    annotations added (positive) or removed (negative).
+    """
+
+    changes = _update_counters(connection, AnnotationCount.__table__, 'n_annotations', deltas)
+    annotator_deltas = collections.Counter()
+    for (project_id, audio_id, _), (old, new) in changes.items():
+        annotator_deltas[(project_id, audio_id)] += (new > 0) - (old > 0)
+
+    changes = _update_counters(connection, AudioCompletion.__table__, 'n_annotators', annotator_deltas)
+    if not changes:
+        return
+    # only the audios of the projects count (as in completion_query), the
+    # others are counted when added (apply_audio_deltas)
+    project_audios = set(map(tuple, connection.execute(
+        select([audio_project_rel.c.project_id, audio_project_rel.c.audio_id])
+            .where(tuple_(audio_project_rel.c.project_id, audio_project_rel.c.audio_id)
+                .in_(list(changes))))))
+    min_annotations = dict(connection.execute(
+        select([Project.id, Project.min_annotations_per_file])
+            .where(Project.id.in_({project_id for project_id, _ in changes}))))
+    completed_deltas = collections.Counter()
+    for key, (old, new) in changes.items():
+        project_id = key[0]
+        m = min_annotations.get(project_id)
+        if m and key in project_audios:
+            completed_deltas[project_id] += min(new, m) - min(old, m)
+
+    project_completion = ProjectCompletion.__table__
+    for project_id, n in completed_deltas.items():
+        if n:
+            connection.execute(project_completion.update()
+                .where(project_completion.c.project_id==project_id)
+                .values(n_completed=project_completion.c.n_completed + n))
+
+
+def apply_audio_deltas(connection, added, removed):
+    """Update the completion counters of projects whose audios changed.
+
+    added and removed are sets of (project_id, audio_id) of the
+    audio_project_rel rows inserted and deleted.
+    """
+
+    pairs = added | removed
+    if not pairs:
+        return
+    n_annotators = {(project_id, audio_id): n for project_id, audio_id, n in connection.execute(
+        select([AudioCompletion.project_id, AudioCompletion.audio_id, AudioCompletion.n_annotators])
+            .where(tuple_(AudioCompletion.project_id, AudioCompletion.audio_id).in_(pairs)))}
+    min_annotations = dict(connection.execute(
+        select([Project.id, Project.min_annotations_per_file])
+            .where(Project.id.in_({project_id for project_id, _ in pairs}))))
+    audio_deltas, completed_deltas = collections.Counter(), collections.Counter()
+    for sign, changed in ((1, added), (-1, removed)):
+        for project_id, audio_id in changed:
+            audio_deltas[project_id] += sign
+            completed_deltas[project_id] += sign * min(
+                n_annotators.get((project_id, audio_id), 0),
+                min_annotations.get(project_id, 0))
+
+    project_completion = ProjectCompletion.__table__
+    for project_id, n in audio_deltas.items():
+        if n or completed_deltas[project_id]:
+            connection.execute(project_completion.update()
+                .where(project_completion.c.project_id==project_id)
+                .values(n_audios=project_completion.c.n_audios + n,
+                    n_completed=project_completion.c.n_completed + completed_deltas[project_id]))
+
+
+##############
+# Statistics #
+##############
+
+# Summary tables of the annotations of the projects: totals, and counts per
+# tag, annotator and audio. Each row holds a number of annotations and the
+# annotated seconds (length of the region, or duration of the audio for
+# annotations without region, 0 if the audio is not indexed). Rows without
+# annotations are removed. Like the completion counters, they are updated
+# with deltas on each flush (apply_statistics_deltas) and rebuilt by
+# refresh_statistics after bulk loads and audio indexing.
+
+class _StatisticsMixin(object):
+    n_annotations = db.Column(db.Integer, nullable=False)
+    annotated_seconds = db.Column(db.Float, nullable=False)
+
+
+class ProjectStatistics(_StatisticsMixin, db.Model):
+    __tablename__ = 'project_statistics'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+
+
+class TagStatistics(_StatisticsMixin, db.Model):
+    __tablename__ = 'tag_statistics'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
+
+
+class AnnotatorStatistics(_StatisticsMixin, db.Model):
+    __tablename__ = 'annotator_statistics'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'), primary_key=True)
+
+
+class AudioStatistics(_StatisticsMixin, db.Model):
+    __tablename__ = 'audio_statistics'
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    audio_id = db.Column(db.Integer, db.ForeignKey('audio.id', ondelete='CASCADE'), primary_key=True)
+
+
+# the primary key columns are named after the annotation columns
+STATISTICS_MODELS = (ProjectStatistics, TagStatistics, AnnotatorStatistics, AudioStatistics)
+
+STATISTICS_ATTRS = ('project_id', 'tag_id', 'audio_id', 'created_by_id', 'start_time', 'end_time')
+
+
+def annotated_seconds(start_time, end_time, duration):
+    if start_time is not None and end_time is not None:
+        return end_time - start_time
+    return duration or 0
+
+
+def refresh_statistics(connection, project_id):
+    """Rebuild the statistics of a project from its annotations."""
+
+    seconds = func.coalesce(Annotation.end_time - Annotation.start_time, Audio.duration, 0)
+    source = Annotation.__table__.join(Audio.__table__, Audio.id==Annotation.audio_id)
+    for model in STATISTICS_MODELS:
+        table = model.__table__
+        keys = [c.name for c in table.primary_key.columns]
+        connection.execute(table.delete().where(table.c.project_id==project_id))
+        columns = [Annotation.__table__.c[key] for key in keys]
+        query = select(columns + [func.count(), func.sum(seconds)]) \
+            .select_from(source) \
+            .where(Annotation.project_id==project_id) \
+            .group_by(*columns)
+        for column in columns:
+            query = query.where(column!=None)
+        connection.execute(table.insert().from_select(
+            keys + ['n_annotations', 'annotated_seconds'], query))
+
+
+def apply_statistics_deltas(connection, changes, durations=None):
+    """Update the statistics with annotation changes.
+
+    changes is a list of (sign, annotation) pairs, annotation being a dict
+    of the STATISTICS_ATTRS of an annotation added (sign 1) or removed
+    (sign -1). durations maps audio ids to durations, and is queried if
+    not given.
+    """
+
+    if durations is None:
+        audio_ids = {annotation['audio_id'] for _, annotation in changes
+            if annotation['start_time'] is None or annotation['end_time'] is None}
+        durations = dict(connection.execute(select([Audio.id, Audio.duration])
+            .where(Audio.id.in_(audio_ids)))) if audio_ids else {}
+
+    for model in STATISTICS_MODELS:
+        table = model.__table__
+        keys = [c.name for c in table.primary_key.columns]
+        deltas = collections.defaultdict(lambda: [0, 0.0])
+        for sign, annotation in changes:
+            key = tuple(annotation[k] for k in keys)
+            if None in key:
+                continue
+            delta = deltas[key]
+            delta[0] += sign
+            delta[1] += sign * annotated_seconds(
+                annotation['start_time'], annotation['end_time'], durations.get(annotation['audio_id']))
+        rows = [dict(zip(keys, key), n_annotations=n, annotated_seconds=seconds)
+            for key, (n, seconds) in deltas.items() if n or seconds]
+        if not rows:
+            continue
+        stmt = pg_insert(table).values(rows)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c[k] for k in keys],
+            set_={
+                'n_annotations': table.c.n_annotations + stmt.excluded.n_annotations,
+                'annotated_seconds': table.c.annotated_seconds + stmt.excluded.annotated_seconds}))
+        if any(n < 0 for n, _ in deltas.values()):
+            connection.execute(table.delete()
+                .where(table.c.n_annotations <= 0)
+                .where(tuple_(*[table.c[k] for k in keys]).in_(list(deltas))))
+
+
+###########################
+# Response cache versions #
+###########################
+
+# Versions of the cached API responses (see response_cache.py): the
+# projects list depends on the 'projects' key and the tagsets of a project
+# on its 'project:<id>' key. Versions are bumped in the transaction of the
+# changes, by a session listener, and by the bulk paths writing projects,
+# tagsets, tags or their associations.
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_version'
+    key = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+
+
+def project_cache_key(project_id):
+    return f'project:{project_id}'
+
+
+def bump_cache_versions(connection, keys):
+    if not keys:
+        return
+    table = CacheVersion.__table__
+    # sorted, so that concurrent transactions lock the rows in the same order
+    stmt = pg_insert(table).values([{'key': key, 'version': 1} for key in sorted(keys)])
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={'version': table.c.version + 1}))
+
+
+def bump_project_versions(connection, project_ids=(), tagset_ids=(), tag_ids=()):
+    """Bump the versions of projects and of the projects of tagsets and tags."""
+    project_ids = set(project_ids)
+    tagset_ids = set(tagset_ids)
+    if tag_ids:
+        tagset_ids.update(tagset_id for tagset_id, in connection.execute(
+            select([tag_tagset_rel.c.tagset_id]).where(tag_tagset_rel.c.tag_id.in_(set(tag_ids)))))
+    if tagset_ids:
+        project_ids.update(project_id for project_id, in connection.execute(
+            select([tagset_project_rel.c.project_id])
+                .where(tagset_project_rel.c.tagset_id.in_(tagset_ids))
+                .distinct()))
+    bump_cache_versions(connection, {project_cache_key(project_id) for project_id in project_ids})
+
+
+############
+# Deletion #
+############
+
+# Deleting a user, tag or audio deletes the annotations going with it in
+# the database, with set-based cascades: the annotations of a tag or audio,
+# and the annotations, tags, tagsets and audios of a user. The completion
+# counters and statistics of the projects of these annotations and audios
+# are then rebuilt by jobs queued in the deleting transaction.
+#
+# Objects with many annotations are better deleted by a purge job (see
+# jobs.py), which deletes their annotations in batches of PURGE_BATCH_SIZE,
+# each committed on its own so that no lock is held for long.
+
+CASCADING_MODELS = {
+    'user': User,
+    'tag': Tag,
+    'audio': Audio,
+}
+
+
+def cascaded_annotations(model, object_id):
+    """Criterion selecting the annotations deleted with an object."""
+    if model is Tag:
+        return Annotation.tag_id==object_id
+    if model is Audio:
+        return Annotation.audio_id==object_id
+    return or_(
+        Annotation.created_by_id==object_id,
+        Annotation.tag_id.in_(select([Tag.id]).where(Tag.created_by_id==object_id)),
+        Annotation.audio_id.in_(select([Audio.id]).where(Audio.created_by_id==object_id)))
+
+
+def cascaded_projects(connection, model, object_id):
+    """Ids of the projects of the annotations and audios deleted with an
+    object (annotations are read from the statistics, which have a row per
+    annotated tag, audio and annotator of each project)."""
+    if model is Tag:
+        queries = [select([TagStatistics.project_id]).where(TagStatistics.tag_id==object_id)]
+    elif model is Audio:
+        queries = [
+            select([AudioStatistics.project_id]).where(AudioStatistics.audio_id==object_id),
+            select([audio_project_rel.c.project_id]).where(audio_project_rel.c.audio_id==object_id),
+        ]
+    else:
+        queries = [
+            select([AnnotatorStatistics.project_id])
+                .where(AnnotatorStatistics.created_by_id==object_id),
+            select([TagStatistics.project_id])
+                .where(TagStatistics.tag_id.in_(select([Tag.id]).where(Tag.created_by_id==object_id))),
+            select([AudioStatistics.project_id])
+                .where(AudioStatistics.audio_id.in_(select([Audio.id]).where(Audio.created_by_id==object_id))),
+            select([audio_project_rel.c.project_id])
+                .where(audio_project_rel.c.audio_id.in_(select([Audio.id]).where(Audio.created_by_id==object_id))),
+        ]
+    return {project_id for query in queries for project_id, in connection.execute(query)}
+
+
+def bump_cascaded_versions(connection, model, object_id):
+    """Bump the versions of the cached responses listing an object, or the
+    tags and tagsets deleted with it (to be run before deleting it)."""
+    if model is Tag:
+        bump_project_versions(connection, tag_ids=[object_id])
+    elif model is User:
+        bump_project_versions(connection,
+            tagset_ids=[tagset_id for tagset_id, in connection.execute(
+                select([Tagset.id]).where(Tagset.created_by_id==object_id))],
+            tag_ids=[tag_id for tag_id, in connection.execute(
+                select([Tag.id]).where(Tag.created_by_id==object_id))])
+
+
+def enqueue_refreshes(connection, project_ids):
+    """Queue the rebuild of the completion counters and statistics of projects."""
+    from phaunos.phaunos.jobs import enqueue
+    for project_id in sorted(project_ids):
+        for kind in ('refresh_completion', 'refresh_statistics'):
+            enqueue(connection, kind, {'project_id': project_id},
+                key=f'{kind}:{project_id}',
+                project_id=project_id)
+
+
+########
+# Jobs #
+########
+
+@enum.unique
+class JobState(enum.Enum):
+    PENDING = enum.auto()
+    RUNNING = enum.auto()
+    SUCCEEDED = enum.auto()
+    FAILED = enum.auto()
+
+
+class Job(db.Model):
+    """Long-running operation, run by a worker process (see jobs.py)."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)
+    params = db.Column(JSONB, nullable=False)
+    # at most one pending or running job per key
+    key = db.Column(db.String, nullable=False)
+    state = db.Column(ENUM(JobState), default=JobState.PENDING, nullable=False)
+    progress = db.Column(db.Float, default=0, nullable=False)
+    message = db.Column(db.String, nullable=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    worker = db.Column(db.String, nullable=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    # pending jobs are not run before (retries are delayed)
+    next_attempt_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_active_key', key, unique=True,
+            postgresql_where=db.text("state IN ('PENDING', 'RUNNING')")),
+        db.Index('ix_job_state', state, id),
+        db.Index('ix_job_project_id', project_id),
+    )
+
+
+###########
+# Uploads #
+###########
+
+class Upload(db.Model):
+    """Resumable upload of an audio file (see uploads.py)."""
+
+    # random, not guessable
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # number of bytes received
+    offset = db.Column(db.BigInteger, default=0, nullable=False)
+    # set when complete: hash of the content, and path of the stored file,
+    # relative to FILE_FOLDER
+    sha256 = db.Column(db.String(64), nullable=True)
+    path = db.Column(db.String, nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('phaunos_user.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filename)[1].lower()
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            filename=self.filename,
+            size=self.size,
+            offset=self.offset,
+            sha256=self.sha256,
+            path=self.path)
+
+
 class EnumField(fields.Field):
 
     def __init__(self, enumtype, *args, **kwargs):
@@ -234,6 +961,11 @@ class TagsetSchema(ma.ModelSchema):
         exclude = ('projects',)
     tags = ma.Nested(TagSchema, many=True)
 tagset_schema = TagsetSchema()
+# loads exactly what tagset_schema dumps (related objects are dumped as ids)
+tagset_load_options = (
+    joinedload(Tagset.created_by).load_only('id'),
+    selectinload(Tagset.tags).joinedload(Tag.created_by).load_only('id'),
+)
 
 
 class AudioSchema(ma.ModelSchema):
@@ -251,6 +983,34 @@ class AnnotationSchema(ma.ModelSchema):
 annotation_schema = AnnotationSchema()
 
 
+class AnnotationInputSchema(ma.Schema):
+    audio_id = fields.Int(required=True)
+    tag_id = fields.Int(required=True)
+    start_time = fields.Float(allow_none=True, validate=validate.Range(min=0))
+    end_time = fields.Float(allow_none=True, validate=validate.Range(min=0))
+
+    @validates_schema
+    def validate_times(self, data):
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+        if (start_time is None) != (end_time is None):
+            raise ValidationError('start_time and end_time must be both set or both null.')
+        if start_time is not None and start_time > end_time:
+            raise ValidationError('start_time must not be greater than end_time.', 'end_time')
+
+annotation_input_schema = AnnotationInputSchema()
+
+
+class JobSchema(ma.ModelSchema):
+    state = EnumField(JobState)
+    class Meta:
+        model = Job
+        include_fk = True
+        exclude = ('worker',)
+
+job_schema = JobSchema()
+
+
 class UserSchema(ma.Schema):
     id = fields.Int(dump_only=True)
     username = fields.Str(
@@ -290,44 +1050,160 @@ user_schema = UserSchema()
 # Event listeners #
 ###################
 
-@event.listens_for(db.session, 'transient_to_pending')
-def get_audiolist_from_file(session, instance):
-    if isinstance(instance, Project):
-        with open(os.path.join(
-                current_app.config['FILE_FOLDER'],
-                instance.audiolist_filename), 'r') as audiolist_file:
-            for line in audiolist_file:
-                _path = line.strip()
-                audio = Audio.query.filter(Audio.path==_path).first()
-                if not audio:
-                    audio = Audio()
-                    audio.path = _path 
-                if not audio in instance.audios:
-                    instance.audios.append(audio) 
-
-
-@event.listens_for(db.session, 'transient_to_pending')
-def get_taglist_from_file(session, instance):    
-    if isinstance(instance, Project):
-        with open(os.path.join(
-                current_app.config['FILE_FOLDER'],
-                instance.taglist_filename), 'r') as taglist_file:
-            for line in taglist_file:
-                line = line.strip()
-                tagset_name, tag_name = line.split(',')
-                tagset = Tagset.query.filter(Tagset.name==tagset_name).first()
-                if not tagset:
-                    tagset = Tagset()
-                    tagset.name = tagset_name
-                    db.session.flush(tagset)
-                tag = Tag.query.filter(Tag.name==tag_name).filter(Tag.tagsets.any(Tagset.name==tagset_name)).first()
-                if not tag:
-                    tag = Tag()
-                    tag.name = tag_name
-                    tagset.tags.append(tag)
-                if not tagset in instance.tagsets:
-                    instance.tagsets.append(tagset)
-
+@event.listens_for(db.session, 'before_flush')
+def remove_project_partitions(session, flush_context, instances):
+    project_ids = {p.id for p in session.deleted if isinstance(p, Project)}
+    if not project_ids:
+        return
+    # loaded annotations go with the partition
+    for annotation in list(session.deleted):
+        if isinstance(annotation, Annotation) and annotation.project_id in project_ids:
+            session.expunge(annotation)
+    for project_id in project_ids:
+        remove_annotation_partition(session.connection(), project_id,
+            keep=current_app.config['KEEP_DELETED_PROJECT_ANNOTATIONS'])
+
+
+@event.listens_for(db.session, 'before_flush')
+def prepare_cascades(session, flush_context, instances):
+    deleted_projects = {p.id for p in session.deleted if isinstance(p, Project)}
+    project_ids = set()
+    for obj in session.deleted:
+        for model in CASCADING_MODELS.values():
+            if isinstance(obj, model) and obj.id is not None:
+                project_ids.update(cascaded_projects(session.connection(), model, obj.id))
+                bump_cascaded_versions(session.connection(), model, obj.id)
+    if project_ids - deleted_projects:
+        enqueue_refreshes(session.connection(), project_ids - deleted_projects)
+
+
+@listens_for(Project, 'after_insert')
+def create_project_partition(mapper, connection, target):
+    # before the annotations of the flush are inserted (rows of the project
+    # in the default partition would prevent the creation of its partition)
+    create_annotation_partition(connection, target.id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def ingest_new_projects(session, flush_context):
+    # queued in the transaction creating the project, run by a worker
+    from phaunos.phaunos.jobs import enqueue_ingestion
+    for project in session.new:
+        if isinstance(project, Project):
+            enqueue_ingestion(session.connection(), project.id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def invalidate_role_cache(session, flush_context):
+    user_ids = set()
+    for upr in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(upr, UserProjectRel):
+            user_ids.update(get_history(upr, 'user_id').sum())
+    if user_ids:
+        invalidate(session, current_app.extensions['role_cache'], user_ids)
+
+
+_COMPLETION_KEY = ('project_id', 'audio_id', 'created_by_id')
+
+@event.listens_for(db.session, 'after_flush')
+def track_completion(session, flush_context):
+    deleted_projects = {p.id for p in session.deleted if isinstance(p, Project)}
+    deltas = collections.Counter()
+
+    for annotation in session.new:
+        if isinstance(annotation, Annotation):
+            deltas[tuple(getattr(annotation, attr) for attr in _COMPLETION_KEY)] += 1
+    for annotation in session.deleted:
+        if isinstance(annotation, Annotation):
+            deltas[tuple(getattr(annotation, attr) for attr in _COMPLETION_KEY)] -= 1
+    for annotation in session.dirty:
+        if isinstance(annotation, Annotation):
+            old, new = [], []
+            for attr in _COMPLETION_KEY:
+                history = get_history(annotation, attr)
+                new.append(getattr(annotation, attr))
+                old.append(history.deleted[0] if history.deleted else new[-1])
+            if old != new:
+                deltas[tuple(old)] -= 1
+                deltas[tuple(new)] += 1
+
+    # audios added to or removed from projects, from either side of the
+    # relationship (audios deleted with their rows are refreshed by jobs,
+    # see prepare_cascades)
+    added, removed = set(), set()
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Project) and obj not in session.new:
+            history = get_history(obj, 'audios', PASSIVE_NO_INITIALIZE)
+            added.update((obj.id, audio.id) for audio in history.added)
+            removed.update((obj.id, audio.id) for audio in history.deleted)
+        elif isinstance(obj, Audio):
+            history = get_history(obj, 'projects', PASSIVE_NO_INITIALIZE)
+            added.update((project.id, obj.id) for project in history.added)
+            removed.update((project.id, obj.id) for project in history.deleted)
+    new_projects = {p.id for p in session.new if isinstance(p, Project)}
+    apply_audio_deltas(session.connection(),
+        {pair for pair in added - removed if pair[0] not in new_projects},
+        {pair for pair in removed - added if pair[0] not in deleted_projects})
+
+    # after the audios, which count with their annotators before this flush
+    deltas = {key: n for key, n in deltas.items()
+        if n and key[2] is not None and key[0] not in deleted_projects}
+    if deltas:
+        apply_completion_deltas(session.connection(), deltas)
+
+    # new projects and projects whose completion criterion changed
+    for project in session.new | session.dirty:
+        if isinstance(project, Project) and (project in session.new or
+                get_history(project, 'min_annotations_per_file').has_changes()):
+            refresh_completion(session.connection(), project.id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def track_statistics(session, flush_context):
+    deleted_projects = {p.id for p in session.deleted if isinstance(p, Project)}
+    changes = []
+
+    for annotation in session.new:
+        if isinstance(annotation, Annotation):
+            changes.append((1, {attr: getattr(annotation, attr) for attr in STATISTICS_ATTRS}))
+    for annotation in session.deleted:
+        if isinstance(annotation, Annotation):
+            changes.append((-1, {attr: getattr(annotation, attr) for attr in STATISTICS_ATTRS}))
+    for annotation in session.dirty:
+        if isinstance(annotation, Annotation):
+            old, new = {}, {}
+            for attr in STATISTICS_ATTRS:
+                history = get_history(annotation, attr)
+                new[attr] = getattr(annotation, attr)
+                old[attr] = history.deleted[0] if history.deleted else new[attr]
+            if old != new:
+                changes.append((-1, old))
+                changes.append((1, new))
+
+    changes = [(sign, annotation) for sign, annotation in changes
+        if annotation['project_id'] not in deleted_projects]
+    if changes:
+        apply_statistics_deltas(session.connection(), changes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def bump_response_versions(session, flush_context):
+    project_ids, tagset_ids, tag_ids = set(), set(), set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        # associations removed in this flush are only left in the loaded
+        # collections (and their history)
+        if isinstance(obj, Project):
+            project_ids.add(obj.id)
+        elif isinstance(obj, Tagset):
+            tagset_ids.add(obj.id)
+            project_ids.update(p.id for p in get_history(obj, 'projects', PASSIVE_NO_INITIALIZE).sum())
+        elif isinstance(obj, Tag):
+            tag_ids.add(obj.id)
+            tagset_ids.update(t.id for t in get_history(obj, 'tagsets', PASSIVE_NO_INITIALIZE).sum())
+    if project_ids:
+        bump_cache_versions(session.connection(), {'projects'})
+    if project_ids or tagset_ids or tag_ids:
+        bump_project_versions(session.connection(), project_ids, tagset_ids, tag_ids)
 
 
 #@listens_for(Project, 'after_delete')
@@ -0,0 +1,90 @@
+import json
+import base64
+import binascii
+from flask import current_app, request, make_response
+from sqlalchemy import tuple_
+from sqlalchemy.exc import DataError
+
+
+# Keyset pagination.
+#
+# Pages are ordered by indexed columns and a page starts right after the
+# key of the last item of the previous page, which the client sends back
+# as an opaque cursor (returned in the X-Next-Cursor header). Unlike OFFSET,
+# the cost of a page does not depend on its position.
+#
+# Request parameters:
+#   cursor=<cursor>: start after this cursor (first page if missing)
+#   per_page=<n>: page size (DEFAULT_PAGE_SIZE by default, at most MAX_PAGE_SIZE)
+#   page=<n>: legacy offset pagination, used when no cursor is given
+
+
+class PaginationError(Exception):
+    pass
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise PaginationError('Invalid cursor.')
+    if not isinstance(values, list):
+        raise PaginationError('Invalid cursor.')
+    return values
+
+
+def check_cursor(values, columns):
+    """Raise PaginationError unless values are of the types of columns."""
+    if len(values) != len(columns):
+        raise PaginationError('Invalid cursor.')
+    for value, column in zip(values, columns):
+        python_type = column.type.python_type
+        # bool is an int
+        if not isinstance(value, python_type) or isinstance(value, bool):
+            raise PaginationError('Invalid cursor.')
+
+
+def paginate(query, *columns):
+    """Return the items of the requested page of query, ordered by columns,
+    and the cursor of the next page (None on the last page)."""
+
+    per_page = min(
+        request.args.get('per_page', current_app.config['DEFAULT_PAGE_SIZE'], type=int),
+        current_app.config['MAX_PAGE_SIZE'])
+    if per_page < 1:
+        raise PaginationError('per_page must be positive.')
+    cursor = request.args.get('cursor', None)
+    page = request.args.get('page', None, type=int)
+
+    query = query.order_by(*columns)
+    if cursor:
+        values = decode_cursor(cursor)
+        check_cursor(values, columns)
+        query = query.filter(tuple_(*columns) > tuple_(*values))
+    elif page and page > 1:
+        query = query.offset((page - 1) * per_page)
+
+    try:
+        items = query.limit(per_page + 1).all()
+    except DataError:
+        # values of the right type out of the range of their column
+        if not cursor:
+            raise
+        query.session.rollback()
+        raise PaginationError('Invalid cursor.')
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor([getattr(items[-1], c.key) for c in columns])
+    return items, next_cursor
+
+
+def paginated_response(body, next_cursor):
+    resp = make_response(body)
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    return resp
@@ -0,0 +1,72 @@
+import hashlib
+import functools
+from flask import current_app, request
+from phaunos.shared import db
+from phaunos.cache import SizedTTLCache
+from phaunos.phaunos.models import CacheVersion
+
+
+# Versioned response cache.
+#
+# The responses of cached views are kept by URL and by version of the data
+# they depend on (see CacheVersion in models.py), which costs a primary key
+# lookup per request. The version is read before the view runs, so that a
+# cached body is never older than its version.
+#
+# Responses carry a strong ETag derived from the URL and the version, so
+# that clients sending it back in If-None-Match get a 304 response, before
+# the view runs. Bodies are cached in process, in an LRU bounded by
+# RESPONSE_CACHE_SIZE entries and RESPONSE_CACHE_MAX_BYTES bytes.
+
+
+# headers of the view responses kept in the cache
+_CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor')
+
+
+def init_response_cache(app):
+    app.extensions['response_cache'] = SizedTTLCache(
+        app.config['RESPONSE_CACHE_SIZE'],
+        app.config['RESPONSE_CACHE_TTL'],
+        app.config['RESPONSE_CACHE_MAX_BYTES'],
+        sizeof=lambda entry: len(entry[0]))
+
+
+def get_version(key):
+    return db.session.query(CacheVersion.version) \
+        .filter(CacheVersion.key==key).scalar() or 0
+
+
+def cached_response(version_key):
+    """Cache the 200 responses of a view.
+
+    version_key(**view_args) returns the CacheVersion key of the data the
+    response depends on (request arguments are part of the cache key).
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            key = version_key(**kwargs)
+            version = get_version(key)
+            etag = hashlib.sha1(f'{request.full_path}\n{key}\n{version}'.encode()).hexdigest()
+
+            response_class = current_app.response_class
+            if request.if_none_match.contains(etag):
+                resp = response_class(status=304)
+            else:
+                cache = current_app.extensions['response_cache']
+                entry = cache.get((request.full_path, key, version))
+                if entry is None:
+                    resp = current_app.make_response(f(*args, **kwargs))
+                    if resp.status_code != 200 or resp.is_streamed:
+                        return resp
+                    entry = (resp.get_data(), [(name, resp.headers[name])
+                        for name in _CACHED_HEADERS if name in resp.headers])
+                    cache.set((request.full_path, key, version), entry)
+                body, headers = entry
+                resp = response_class(body, headers=headers)
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        return wrapper
+    return decorator
@@ -0,0 +1,90 @@
+import json
+from marshmallow import fields, utils
+from marshmallow_sqlalchemy.fields import Related
+from sqlalchemy import inspect
+from phaunos.metrics import serializing
+from phaunos.phaunos.models import (
+    EnumField,
+    annotation_schema,
+    audio_schema,
+    project_schema,
+    job_schema,
+)
+
+
+# Row-tuple JSON encoders.
+#
+# A RowEncoder is compiled from a ModelSchema: it selects only the columns
+# the schema dumps (the foreign key column for related objects) and encodes
+# the resulting row tuples straight to JSON, with one precompiled converter
+# per field. The output is byte-for-byte the output of schema.dumps(...),
+# without hydrating ORM instances nor dispatching on fields per value.
+
+
+def _nullable(encode):
+    return lambda value: 'null' if value is None else encode(value)
+
+
+# the converters of json.dumps (with its default arguments)
+_encode_string = json.encoder.encode_basestring_ascii
+
+
+def _encode_float(value):
+    value = float(value)
+    if value != value or value in (float('inf'), float('-inf')):
+        return json.dumps(value)
+    return float.__repr__(value)
+
+
+_FIELD_ENCODERS = {
+    fields.Integer: _nullable(lambda value: int.__repr__(int(value))),
+    fields.Float: _nullable(_encode_float),
+    fields.String: _nullable(lambda value: _encode_string(str(value))),
+    fields.Boolean: _nullable(lambda value: 'true' if value else 'false'),
+    fields.DateTime: _nullable(lambda value: _encode_string(utils.isoformat(value))),
+    EnumField: _nullable(lambda value: _encode_string(value.name)),
+    Related: _nullable(json.dumps),
+    fields.Raw: json.dumps,
+}
+
+
+class RowEncoder(object):
+
+    def __init__(self, schema):
+        model = schema.opts.model
+        mapper = inspect(model)
+        self.keys = []
+        self.columns = []
+        self._encoders = []
+        for name, field in schema.fields.items():
+            if field.load_only:
+                continue
+            if isinstance(field, Related):
+                # many-to-one: dump the foreign key
+                local_column, = mapper.relationships[name].local_columns
+                column = mapper.get_property_by_column(local_column).class_attribute
+            else:
+                column = getattr(model, field.attribute or name)
+            self.keys.append(field.data_key or name)
+            self.columns.append(column)
+            self._encoders.append(_FIELD_ENCODERS[type(field)])
+        self._template = '{' + ', '.join(
+            json.dumps(key).replace('%', '%%') + ': %s' for key in self.keys) + '}'
+
+    def query(self, query):
+        """Restrict an ORM query to the columns of the encoder."""
+        return query.with_entities(*self.columns)
+
+    def encode(self, row):
+        return self._template % tuple(
+            encode(value) for encode, value in zip(self._encoders, row))
+
+    def dumps(self, rows):
+        with serializing():
+            return '[' + ', '.join(map(self.encode, rows)) + ']'
+
+
+annotation_encoder = RowEncoder(annotation_schema)
+audio_encoder = RowEncoder(audio_schema)
+project_encoder = RowEncoder(project_schema)
+job_encoder = RowEncoder(job_schema)
@@ -0,0 +1,208 @@
+import os
+import math
+import wave
+import zlib
+import struct
+import hashlib
+import collections
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+
+# Multi-resolution spectrogram tiles.
+#
+# At zoom level z, consecutive STFT frames are hop * 2**z samples apart and
+# a tile is made of tile_width frames, so tile x of zoom z starts at sample
+# x * tile_width * hop * 2**z. Zoom 0 has the finest time resolution and
+# the coarsest zoom (max_zoom) fits the whole audio in one tile. Only the
+# samples under the frames of a tile are read, so the cost of a tile does
+# not depend on the zoom level or on the length of the recording.
+#
+# Tiles are 8-bit grayscale PNG images (low frequencies at the bottom),
+# with magnitudes in dB relative to full scale, clipped to [-db_range, 0].
+# They are cached on disk under <cache folder>/<key>/<zoom>/<x>.png, where
+# key depends on the audio file (path, size, mtime) and on the parameters.
+
+
+SpectrogramParams = collections.namedtuple(
+    'SpectrogramParams',
+    ['n_fft', 'hop', 'tile_width', 'db_range'])
+
+
+def params_from_config(config):
+    return SpectrogramParams(
+        n_fft=config['SPECTROGRAM_N_FFT'],
+        hop=config['SPECTROGRAM_HOP'],
+        tile_width=config['SPECTROGRAM_TILE_WIDTH'],
+        db_range=config['SPECTROGRAM_DB_RANGE'])
+
+
+class AudioReader(object):
+    """Random access to the samples of a PCM WAV file, mixed down to mono."""
+
+    def __init__(self, path):
+        self._wav = wave.open(path, 'rb')
+        self.sample_rate = self._wav.getframerate()
+        self.n_frames = self._wav.getnframes()
+        self.n_channels = self._wav.getnchannels()
+        self.sampwidth = self._wav.getsampwidth()
+
+    def close(self):
+        self._wav.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, start, n):
+        """Return n samples from start as float32 in [-1, 1], zero-padded
+        outside of the file."""
+
+        out = np.zeros(n, dtype=np.float32)
+        begin = max(start, 0)
+        end = min(start + n, self.n_frames)
+        if begin >= end:
+            return out
+        self._wav.setpos(begin)
+        data = self._wav.readframes(end - begin)
+
+        width = self.sampwidth
+        if width == 1:
+            x = np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128
+        elif width == 3:
+            b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            x = (b[:, 0].astype(np.int32) | (b[:, 1].astype(np.int32) << 8)
+                | (b[:, 2].astype(np.int8).astype(np.int32) << 16)).astype(np.float32)
+        else:
+            x = np.frombuffer(data, dtype='<i{}'.format(width)).astype(np.float32)
+        x /= 2 ** (8 * width - 1)
+
+        out[begin - start:end - start] = x.reshape(-1, self.n_channels).mean(axis=1)
+        return out
+
+
+def max_zoom(n_frames, params):
+    """Coarsest zoom level, whose single tile covers the whole audio."""
+    span = params.tile_width * params.hop
+    return max(0, int(math.ceil(math.log2(max(n_frames, 1) / span))))
+
+
+def n_tiles(n_frames, zoom, params):
+    return max(1, int(math.ceil(n_frames / (params.tile_width * params.hop * 2 ** zoom))))
+
+
+def tile_time_range(sample_rate, zoom, x, params):
+    """Time range (in seconds) covered by a tile."""
+    span = params.tile_width * params.hop * 2 ** zoom / sample_rate
+    return x * span, (x + 1) * span
+
+
+def tiles_in_range(sample_rate, n_frames, zoom, start, end, params):
+    """Indices of the tiles of a zoom level overlapping [start, end] (seconds)."""
+    span = params.tile_width * params.hop * 2 ** zoom / sample_rate
+    first = max(0, int(start // span))
+    last = min(n_tiles(n_frames, zoom, params) - 1, int(end // span))
+    return range(first, last + 1)
+
+
+def _frames(reader, zoom, x, params):
+    """Return the (tile_width, n_fft) matrix of samples under the frames of a tile."""
+
+    hop = params.hop * 2 ** zoom
+    first = x * params.tile_width * hop
+    if hop <= params.n_fft:
+        # overlapping frames: one contiguous read and a strided view
+        samples = reader.read(first, (params.tile_width - 1) * hop + params.n_fft)
+        return np.lib.stride_tricks.as_strided(
+            samples,
+            shape=(params.tile_width, params.n_fft),
+            strides=(hop * samples.strides[0], samples.strides[0]))
+    # sparse frames: read only the samples under each frame
+    return np.stack([reader.read(first + i * hop, params.n_fft)
+        for i in range(params.tile_width)])
+
+
+def compute_tile(reader, zoom, x, params):
+    """Return a tile as a (n_fft // 2 + 1, tile_width) uint8 array."""
+
+    window = np.hanning(params.n_fft).astype(np.float32)
+    spectrum = np.abs(np.fft.rfft(_frames(reader, zoom, x, params) * window, axis=1))
+    # a full scale sine has a magnitude of sum(window) / 2
+    db = 20 * np.log10(np.maximum(spectrum / (window.sum() / 2), 1e-10))
+    db = np.clip(db, -params.db_range, 0)
+    pixels = np.round((db + params.db_range) * 255 / params.db_range).astype(np.uint8)
+    return pixels.T[::-1]
+
+
+def encode_png(pixels):
+    """Encode a 2D uint8 array as a grayscale PNG image."""
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    height, width = pixels.shape
+    # filter type 0 (none) at the start of each scanline
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), pixels]).tobytes()
+    return (b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw, 6))
+        + chunk(b'IEND', b''))
+
+
+def cache_key(path, params):
+    stat = os.stat(path)
+    return hashlib.sha1('{}:{}:{}:{}'.format(
+        os.path.abspath(path),
+        stat.st_size,
+        stat.st_mtime_ns,
+        ':'.join(str(p) for p in params)).encode()).hexdigest()
+
+
+def _write_atomic(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp_filename, 'wb') as outfile:
+        outfile.write(data)
+    os.replace(tmp_filename, filename)
+
+
+def get_tile(path, zoom, x, params, cache_folder, reader=None):
+    """Return a tile as PNG bytes, computing and caching it if needed."""
+
+    filename = os.path.join(cache_folder, cache_key(path, params),
+        str(zoom), '{}.png'.format(x))
+    try:
+        with open(filename, 'rb') as infile:
+            return infile.read()
+    except FileNotFoundError:
+        pass
+    if reader is None:
+        with AudioReader(path) as reader:
+            return get_tile(path, zoom, x, params, cache_folder, reader)
+    if not (0 <= zoom <= max_zoom(reader.n_frames, params)
+            and 0 <= x < n_tiles(reader.n_frames, zoom, params)):
+        raise ValueError('No tile {} at zoom level {}.'.format(x, zoom))
+    data = encode_png(compute_tile(reader, zoom, x, params))
+    _write_atomic(filename, data)
+    return data
+
+
+def _precompute_audio(path, params, cache_folder):
+    with AudioReader(path) as reader:
+        for zoom in range(max_zoom(reader.n_frames, params) + 1):
+            for x in range(n_tiles(reader.n_frames, zoom, params)):
+                get_tile(path, zoom, x, params, cache_folder, reader)
+    return path
+
+
+def precompute_tiles(paths, params, cache_folder, workers=None):
+    """Compute and cache all the tiles of a list of audio files in a process
+    pool. Yields (path, exception or None) as files are done."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_precompute_audio, path, params, cache_folder): path
+            for path in paths}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
@@ -0,0 +1,156 @@
+import os
+import uuid
+import fcntl
+import hashlib
+import datetime
+import contextlib
+from flask import current_app
+from werkzeug.exceptions import ClientDisconnected
+from phaunos.cache import TTLCache
+
+
+# Resumable, content-addressed audio uploads.
+#
+# An upload is created with the name and size of a file (create_upload),
+# then its bytes are sent in order, in one or more requests each starting
+# at the offset of the upload, which is also where to resume after an
+# interruption (write_chunk). Request bodies are streamed to a partial file
+# in blocks of UPLOAD_BLOCK_SIZE bytes and hashed (SHA-256) as they arrive.
+# The offset only advances once the bytes are on disk, and the bytes
+# received before a disconnection are kept.
+#
+# The requests of an upload are serialized by a lock on its partial file
+# (open_partial), not by a row lock: no transaction is open while a body is
+# streamed, which can take as long as the network. The offset is then
+# advanced with a conditional UPDATE (see upload_chunk in api.py).
+#
+# Hash states are kept in process between the requests of an upload. A
+# worker without the state of an upload (other process, restart) rebuilds
+# it from the partial file.
+#
+# Complete files are moved to AUDIO_STORE_FOLDER/ab/cd/abcd...<ext>, after
+# their hash (finish_upload), so that identical files are stored once.
+# Audio paths being unique, they also get the same Audio row, whatever the
+# projects they are added to.
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadConflict(Exception):
+    """The upload is complete, or being written by another request."""
+
+
+def init_uploads(app):
+    app.extensions['upload_hashes'] = TTLCache(
+        app.config['UPLOAD_HASH_CACHE_SIZE'],
+        app.config['UPLOAD_HASH_CACHE_TTL'])
+
+
+def _partial_path(upload):
+    config = current_app.config
+    return os.path.join(config['FILE_FOLDER'], config['UPLOAD_FOLDER'], 'partial', upload.id)
+
+
+def content_path(sha256, ext):
+    """Path of a stored file, relative to FILE_FOLDER."""
+    return os.path.join(current_app.config['AUDIO_STORE_FOLDER'],
+        sha256[:2], sha256[2:4], sha256 + ext)
+
+
+def create_upload(upload):
+    """Give an Upload an id and create its (empty) partial file."""
+    upload.id = uuid.uuid4().hex
+    upload.offset = 0
+    path = _partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+@contextlib.contextmanager
+def open_partial(upload):
+    """Open the partial file of an upload for writing, locked for the
+    other requests, which get UploadConflict instead of waiting."""
+    try:
+        f = open(_partial_path(upload), 'r+b')
+    except FileNotFoundError:
+        # moved by finish_upload
+        raise UploadConflict('Upload already complete.')
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict('Upload being written by another request.')
+        # released when the file is closed
+        yield f
+
+
+def _hasher(upload):
+    hashes = current_app.extensions['upload_hashes']
+    entry = hashes.get(upload.id)
+    hashes.pop(upload.id)
+    if entry is not None and entry[0] == upload.offset:
+        return entry[1]
+    hasher = hashlib.sha256()
+    block_size = current_app.config['UPLOAD_BLOCK_SIZE']
+    remaining = upload.offset
+    with open(_partial_path(upload), 'rb') as f:
+        while remaining:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                raise RuntimeError(f'Partial file of upload {upload.id} shorter than its offset.')
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def write_chunk(upload, f, stream):
+    """Write the bytes read from stream to an upload, from its offset, to
+    its partial file f (see open_partial), and advance the offset. Returns
+    the number of bytes written, which is less than sent if the client
+    disconnected. Raises UploadError, writing nothing, if the bytes would
+    go past the size of the upload."""
+
+    block_size = current_app.config['UPLOAD_BLOCK_SIZE']
+    hasher = _hasher(upload)
+    n_written = 0
+    # drop the bytes of an interrupted request past the offset
+    f.seek(upload.offset)
+    f.truncate()
+    try:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            if upload.offset + n_written + len(block) > upload.size:
+                f.truncate(upload.offset)
+                raise UploadError('More bytes than the size of the upload.')
+            f.write(block)
+            hasher.update(block)
+            n_written += len(block)
+    except ClientDisconnected:
+        pass
+    f.flush()
+    os.fsync(f.fileno())
+    upload.offset += n_written
+    current_app.extensions['upload_hashes'].set(upload.id, (upload.offset, hasher))
+    return n_written
+
+
+def finish_upload(upload, ext):
+    """Move the file of a complete upload to its content-addressed path,
+    unless a file with the same content is already stored there."""
+
+    sha256 = _hasher(upload).hexdigest()
+    path = content_path(sha256, ext)
+    full_path = os.path.join(current_app.config['FILE_FOLDER'], path)
+    if os.path.exists(full_path):
+        os.remove(_partial_path(upload))
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # atomic: concurrent uploads of the same content write the same bytes
+        os.replace(_partial_path(upload), full_path)
+    upload.sha256 = sha256
+    upload.path = path
+    upload.completed_at = datetime.datetime.now()
@@ -0,0 +1,68 @@
+import threading
+import functools
+import contextlib
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# SQL statement counting.
+#
+# count_queries() records the statements executed by the current thread
+# while it is active. query_budget(n) wraps a view to count the statements
+# of each request: exceeding the budget logs a warning, or raises
+# QueryBudgetExceeded if QUERY_BUDGET_STRICT is set (as in tests), so that
+# N+1 query regressions are caught.
+
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter(object):
+
+    def __init__(self):
+        # (statement, parameters)
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.statements.append((statement, parameters))
+
+
+@contextlib.contextmanager
+def count_queries():
+    counter = QueryCounter()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(max_queries):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with count_queries() as counter:
+                resp = f(*args, **kwargs)
+            if counter.count > max_queries:
+                msg = '{} executed {} SQL statements (budget: {})'.format(
+                    request.endpoint, counter.count, max_queries)
+                if current_app.config['QUERY_BUDGET_STRICT']:
+                    raise QueryBudgetExceeded(msg)
+                current_app.logger.warning(msg)
+            return resp
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
@@ -0,0 +1,106 @@
+import random
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import SelectBase
+
+
+# Read/write session routing.
+#
+# The primary is the engine of SQLALCHEMY_DATABASE_URI and the replicas
+# are the engines of SQLALCHEMY_REPLICA_URIS. In requests with a safe
+# method (GET, HEAD, OPTIONS), the SELECT statements of a session go to
+# one of the replicas, picked at random when the session starts.
+# Everything else goes to the primary: statements outside of requests
+# (CLI, workers), flushes, DML statements, SELECT ... FOR UPDATE and
+# statements of requests with other methods.
+#
+# A session is pinned to the primary after its first write (or after
+# use_primary()), so that it reads its own writes. Sessions last one
+# request, so the writes of a request can still be missing from the
+# replicas (replication lag) in the next ones.
+#
+# Connections of each engine run with a statement timeout
+# (SQLALCHEMY_STATEMENT_TIMEOUT and SQLALCHEMY_REPLICA_STATEMENT_TIMEOUT,
+# in milliseconds, 0 for none), and replica transactions are read only.
+
+
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _connect_options(statement_timeout, read_only=False):
+    options = [f'-c statement_timeout={statement_timeout}']
+    if read_only:
+        options.append('-c default_transaction_read_only=on')
+    return ' '.join(options)
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        super(RoutingSession, self).__init__(db, **options)
+        self._db = db
+        self._replica = None
+        self._pinned = False
+        event.listen(self, 'before_flush', self._pin)
+
+    def _pin(self, *args):
+        self._pinned = True
+
+    def use_primary(self):
+        """Send the statements of the session to the primary from now on."""
+        self._pinned = True
+
+    def _reads_from_replica(self, clause):
+        if self._pinned or self._flushing or not has_request_context() \
+                or request.method not in _SAFE_METHODS:
+            return False
+        if clause is None:
+            return True
+        return isinstance(clause, SelectBase) and getattr(clause, '_for_update_arg', None) is None
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self._pinned = True
+        elif self._reads_from_replica(clause):
+            if self._replica is None:
+                replicas = self._db.get_replica_engines(self.app)
+                if replicas:
+                    self._replica = random.choice(replicas)
+            if self._replica is not None:
+                return self._replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', ())
+        app.config.setdefault('SQLALCHEMY_REPLICA_POOL_SIZE', None)
+        app.config.setdefault('SQLALCHEMY_REPLICA_MAX_OVERFLOW', None)
+        app.config.setdefault('SQLALCHEMY_STATEMENT_TIMEOUT', 0)
+        app.config.setdefault('SQLALCHEMY_REPLICA_STATEMENT_TIMEOUT', 0)
+        super(RoutingSQLAlchemy, self).init_app(app)
+
+        options = {'connect_args': {'options': _connect_options(
+            app.config['SQLALCHEMY_REPLICA_STATEMENT_TIMEOUT'], read_only=True)}}
+        if app.config['SQLALCHEMY_REPLICA_POOL_SIZE'] is not None:
+            options['pool_size'] = app.config['SQLALCHEMY_REPLICA_POOL_SIZE']
+        if app.config['SQLALCHEMY_REPLICA_MAX_OVERFLOW'] is not None:
+            options['max_overflow'] = app.config['SQLALCHEMY_REPLICA_MAX_OVERFLOW']
+        # engines connect lazily
+        app.extensions['sqlalchemy'].replica_engines = [create_engine(uri, **options)
+            for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+
+    def get_replica_engines(self, app=None):
+        return get_state(self.get_app(app)).replica_engines
+
+    def apply_driver_hacks(self, app, info, options):
+        super(RoutingSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('postgresql'):
+            options.setdefault('connect_args', {})['options'] = _connect_options(
+                app.config['SQLALCHEMY_STATEMENT_TIMEOUT'])
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
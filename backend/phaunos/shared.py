@@ -1,11 +1,11 @@
 from flask import Blueprint
-from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_jwt_extended import JWTManager
+from phaunos.routing import RoutingSQLAlchemy
 
 
 ma = Marshmallow()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 jwt = JWTManager()
 
 bp_api = Blueprint('bp_api', __name__)
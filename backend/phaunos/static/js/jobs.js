@@ -0,0 +1,43 @@
+// Poll the state of the jobs displayed as <span class="job-status" data-url="...">
+$(document).ready(function() {
+
+    function getCookie(name) {
+        var match = document.cookie.match(new RegExp('(^| )' + name + '=([^;]+)'));
+        return match ? match[2] : null;
+    }
+
+    function show(span, job) {
+        span.empty();
+        if (job.state === 'SUCCEEDED') {
+            span.text('Ingestion done.');
+            return;
+        }
+        if (job.state === 'FAILED') {
+            span.text('Ingestion failed: ' + job.message + ' ');
+            $('<a style="cursor: pointer;">Retry</a>').click(function (e) {
+                $.ajax({
+                    type: "POST",
+                    url: span.data('url') + '/retry',
+                    headers: {'X-CSRF-TOKEN': getCookie('csrf_access_token')},
+                    success: function () { poll(span); },
+                });
+                e.preventDefault();
+            }).appendTo(span);
+            return;
+        }
+        span.text('Ingestion ' + job.state.toLowerCase() + ' (' + Math.round(job.progress * 100) + '%)'
+            + (job.message ? ': ' + job.message : ''));
+        setTimeout(function () { poll(span); }, 2000);
+    }
+
+    function poll(span) {
+        $.ajax({
+            type: "GET",
+            dataType: "json",
+            url: span.data('url'),
+            success: function (data) { show(span, data); },
+        });
+    }
+
+    $('.job-status').each(function () { poll($(this)); });
+});
@@ -47,11 +47,12 @@ def create_user():
             email=data['email'],
             password=data['password'],
         )
-        user.save()
+        db.session.add(user)
 
-        # Send confirmation email
+        # Queue confirmation email, committed with the user
         token = generate_confirmation_token(user.email)
         send_confirmation_email(user.email, token)
+        db.session.commit()
 
         return jsonify({'msg': f'A confirmation email has been sent to {user.email}.'}), 201
 
@@ -77,6 +78,7 @@ def request_confirmation_email():
 
     token = generate_confirmation_token(user.email)
     send_confirmation_email(user.email, token)
+    db.session.commit()
     return jsonify({'msg': f'A confirmation email has been sent to {user.email}'}), 200
 
 
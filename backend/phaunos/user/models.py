@@ -1,5 +1,10 @@
+import time
+import itertools
 from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
 from phaunos.shared import db, jwt
+from phaunos.cache import TTLCache, invalidate
 from werkzeug.security import generate_password_hash
 
 
@@ -31,9 +36,94 @@ class User(db.Model):
         return self.username
 
 
+class OutboxMessage(db.Model):
+    """Outbound email, delivered by the mail workers (see email_utils.py)."""
+
+    __tablename__ = 'outbox_message'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(120), nullable=False)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    last_error = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    # set when the message is given up (permanent error or too many attempts)
+    failed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_message_pending', next_attempt_at, id,
+            postgresql_where=db.text('sent_at IS NULL AND failed_at IS NULL')),
+    )
+
+
+# Users are cached in process. Users changed or deleted by a flush are
+# invalidated in the process of the flush. The other processes clear their
+# cache when the version of the USERS_VERSION_KEY CacheVersion (see
+# models.py of phaunos.phaunos) changed, which they read from the primary
+# at most every AUTH_CACHE_CHECK_INTERVAL seconds. The version is bumped in
+# the transactions deleting users or changing their AUTH_COLUMNS, and by
+# the bulk paths deleting users (purge jobs, delete_dummy_data).
+
+USERS_VERSION_KEY = 'users'
+AUTH_COLUMNS = ('username', 'is_admin')
+
+
+def init_auth_cache(app):
+    # username -> detached User
+    app.extensions['user_cache'] = TTLCache(
+        app.config['AUTH_CACHE_SIZE'], app.config['AUTH_CACHE_TTL'])
+    # [time of the last check, users version] of the process
+    app.extensions['users_version'] = [float('-inf'), None]
+    # user id -> {project id: Role}
+    app.extensions['role_cache'] = TTLCache(
+        app.config['AUTH_CACHE_SIZE'], app.config['AUTH_CACHE_TTL'])
+
+
+def _check_users_version():
+    state = current_app.extensions['users_version']
+    now = time.monotonic()
+    if now - state[0] < current_app.config['AUTH_CACHE_CHECK_INTERVAL']:
+        return
+    from phaunos.phaunos.models import CacheVersion
+    # on the primary (GET requests read from the replicas)
+    with db.engine.connect() as connection:
+        version = connection.execute(db.select([CacheVersion.version])
+            .where(CacheVersion.key==USERS_VERSION_KEY)).scalar()
+    if version != state[1]:
+        current_app.extensions['user_cache'].clear()
+    state[:] = [now, version]
+
+
 @jwt.user_loader_callback_loader
 def user_loader_callback(identity):
-    user = User.query.filter(User.username==identity).first()
-    if not user:
-        return None
-    return user
+    _check_users_version()
+    cache = current_app.extensions['user_cache']
+    user = cache.get(identity)
+    if user is None:
+        user = User.query.filter_by(username=identity).first()
+        if not user:
+            return None
+        db.session.expunge(user)
+        cache.set(identity, user)
+    # attach a copy of the cached user to the session, without querying
+    return db.session.merge(user, load=False)
+
+
+@event.listens_for(db.session, 'after_flush')
+def invalidate_user_cache(session, flush_context):
+    from phaunos.phaunos.models import bump_cache_versions
+    usernames = set()
+    changed = False
+    for user in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(user, User):
+            usernames.update(get_history(user, 'username').sum())
+            changed = changed or user in session.deleted or (user not in session.new
+                and any(get_history(user, column).has_changes() for column in AUTH_COLUMNS))
+    if usernames:
+        invalidate(session, current_app.extensions['user_cache'], usernames)
+    if changed:
+        bump_cache_versions(session.connection(), {USERS_VERSION_KEY})
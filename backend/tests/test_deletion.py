@@ -0,0 +1,148 @@
+import pytest
+from phaunos.shared import db
+from phaunos.query_budget import count_queries
+from phaunos.phaunos.jobs import run_next_job, enqueue_purge
+from phaunos.phaunos.models import (
+    ProjectCompletion,
+    ProjectStatistics,
+    Annotation,
+    Audio,
+    Tag,
+)
+from phaunos.user.models import User, USERS_VERSION_KEY, user_loader_callback
+from phaunos.phaunos.response_cache import get_version
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    # the user cache checks the users version on each request
+    return {'PURGE_BATCH_SIZE': 2, 'AUTH_CACHE_CHECK_INTERVAL': 0}
+
+
+@pytest.fixture
+def project(empty_db, new_project):
+    p = new_project()
+    db.session.commit()
+    # no ingestion (there are no list files)
+    db.session.execute('DELETE FROM job')
+    db.session.commit()
+    return p
+
+
+def _annotate(project, n, user, tag):
+    audio = Audio(path=f'{tag.name}-{user.username}.wav')
+    for _ in range(n):
+        db.session.add(Annotation(project=project, audio=audio, tag=tag, created_by=user))
+    db.session.commit()
+
+
+def _n_annotations(project_id):
+    return db.session.query(ProjectStatistics.n_annotations) \
+        .filter(ProjectStatistics.project_id==project_id).scalar() or 0
+
+
+def test_delete_user(project):
+    user = User('user', 'user@phaunos.org', 'password')
+    other = User('other', 'other@phaunos.org', 'password')
+    tag = Tag(name='tag', created_by=other)
+    _annotate(project, 5, user, tag)
+    _annotate(project, 3, other, tag)
+    project_id = project.id
+    db.session.expire_all()
+
+    # the annotations are not loaded
+    with count_queries() as counter:
+        db.session.delete(User.query.filter_by(username='user').one())
+        db.session.commit()
+    assert not any('FROM annotation' in statement for statement, _ in counter.statements)
+    assert Annotation.query.count() == 3
+
+    # the statistics are rebuilt by jobs
+    while run_next_job():
+        pass
+    assert _n_annotations(project_id) == 3
+
+
+def test_purge(project):
+    user = User('user', 'user@phaunos.org', 'password')
+    other = User('other', 'other@phaunos.org', 'password')
+    # the tag of the user goes with it, with the annotations of other users
+    tag = Tag(name='tag', created_by=user)
+    _annotate(project, 5, user, tag)
+    _annotate(project, 3, other, Tag(name='other tag', created_by=other))
+    _annotate(project, 1, other, tag)
+    project_id, user_id = project.id, user.id
+
+    # cached by the API
+    assert user_loader_callback('user') is not None
+
+    enqueue_purge(db.session.connection(), 'user', user_id)
+    db.session.commit()
+    while run_next_job():
+        pass
+    assert User.query.get(user_id) is None
+    assert user_loader_callback('user') is None
+    assert Annotation.query.count() == 3
+    assert _n_annotations(project_id) == 3
+
+
+def test_users_version(project):
+    user = User('user', 'user@phaunos.org', 'password')
+    db.session.add(user)
+    db.session.commit()
+    version = get_version(USERS_VERSION_KEY)
+
+    # not bumped by changes the authentication does not depend on
+    user.email = 'new@phaunos.org'
+    _annotate(project, 1, user, Tag(name='tag', created_by=user))
+    assert get_version(USERS_VERSION_KEY) == version
+
+    user.is_admin = True
+    db.session.commit()
+    assert get_version(USERS_VERSION_KEY) == version + 1
+    assert user_loader_callback('user').is_admin
+
+
+def test_project_audios(project):
+    project_id = project.id
+    audios = [Audio(path=f'audio{i}.wav') for i in range(3)]
+    project.audios.extend(audios[:2])
+    audios[2].projects.append(project)
+    db.session.commit()
+    assert ProjectCompletion.query.get(project_id).n_audios == 3
+
+    project.audios.remove(audios[0])
+    db.session.commit()
+    assert ProjectCompletion.query.get(project_id).n_audios == 2
+
+    # not annotated, deleted with its row of audio_project_rel
+    db.session.delete(audios[1])
+    db.session.commit()
+    while run_next_job():
+        pass
+    db.session.expire_all()
+    assert ProjectCompletion.query.get(project_id).n_audios == 1
+
+
+def test_completion_of_project_audios(project):
+    project_id = project.id
+    user = User('user', 'user@phaunos.org', 'password')
+    tag = Tag(name='tag', created_by=user)
+    # annotated before being added to the project
+    _annotate(project, 1, user, tag)
+    assert ProjectCompletion.query.get(project_id).n_completed == 0
+
+    audio = Audio.query.one()
+    project.audios.append(audio)
+    db.session.commit()
+    completion = ProjectCompletion.query.get(project_id)
+    assert (completion.n_audios, completion.n_completed) == (1, 1)
+
+    # added and annotated in the same flush
+    other = Audio(path='other.wav')
+    project.audios.append(other)
+    db.session.add(Annotation(project=project, audio=other, tag=tag, created_by=user))
+    db.session.commit()
+    db.session.expire_all()
+    completion = ProjectCompletion.query.get(project_id)
+    assert (completion.n_audios, completion.n_completed) == (2, 2)
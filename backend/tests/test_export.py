@@ -0,0 +1,74 @@
+import io
+import csv
+import json
+import pytest
+from phaunos.shared import db
+from phaunos.phaunos.models import (
+    Annotation,
+    audio_project_rel,
+    tagset_project_rel,
+    tag_tagset_rel,
+)
+from phaunos.phaunos.serializers import annotation_encoder
+
+
+N_ANNOTATIONS = 7
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    # the export is just over two batches
+    return {'EXPORT_BATCH_SIZE': 3}
+
+
+@pytest.fixture(scope='module')
+def rows(project):
+    audio_ids = [audio_id for audio_id, in db.session.query(audio_project_rel.c.audio_id)
+        .filter(audio_project_rel.c.project_id==project.id).limit(2)]
+    tag_id, = db.session.query(tag_tagset_rel.c.tag_id) \
+        .join(tagset_project_rel, tagset_project_rel.c.tagset_id==tag_tagset_rel.c.tagset_id) \
+        .filter(tagset_project_rel.c.project_id==project.id).first()
+    for i in range(N_ANNOTATIONS):
+        # with and without regions
+        start_time, end_time = (i / 3, i + 0.5) if i % 2 else (None, None)
+        db.session.add(Annotation(project_id=project.id, audio_id=audio_ids[i % 2],
+            tag_id=tag_id, start_time=start_time, end_time=end_time))
+    db.session.commit()
+    return annotation_encoder.query(Annotation.query
+        .filter(Annotation.project_id==project.id)
+        .order_by(Annotation.id)).all()
+
+
+def _export(test_app, project, headers, fmt):
+    url = f'/api/phaunos/annotations?project_id={project.id}&web=1&format={fmt}'
+    return test_app.test_client().get(url, headers=headers)
+
+
+def test_json(test_app, project, headers, rows):
+    resp = _export(test_app, project, headers, 'json')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/json'
+    assert json.loads(resp.get_data()) == json.loads(annotation_encoder.dumps(rows))
+    assert len(rows) == N_ANNOTATIONS
+
+
+def test_jsonl(test_app, project, headers, rows):
+    resp = _export(test_app, project, headers, 'jsonl')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    lines = resp.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == json.loads(annotation_encoder.dumps(rows))
+
+
+def test_csv(test_app, project, headers, rows):
+    resp = _export(test_app, project, headers, 'csv')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/csv'
+    header, *records = csv.reader(io.StringIO(resp.get_data(as_text=True)))
+    assert header == annotation_encoder.keys
+    assert records == [['' if value is None else str(value) for value in row] for row in rows]
+
+
+def test_unknown_format(test_app, project, headers):
+    resp = _export(test_app, project, headers, 'xml')
+    assert resp.status_code == 422
@@ -0,0 +1,65 @@
+import os
+import pytest
+
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture(scope='module')
+def filename(test_app):
+    folder = test_app.config['FILE_FOLDER']
+    with open(os.path.join(folder, 'audio 1.wav'), 'wb') as f:
+        f.write(DATA)
+    os.mkdir(os.path.join(folder, 'dir'))
+    # outside of the file folder
+    with open(os.path.join(folder, '..', 'secret.txt'), 'w') as f:
+        f.write('secret')
+    return 'audio 1.wav'
+
+
+def _get(test_app, path, **kwargs):
+    return test_app.test_client().get(f'/files/{path}', **kwargs)
+
+
+def test_complete(test_app, filename):
+    resp = _get(test_app, filename)
+    assert resp.status_code == 200
+    assert resp.get_data() == DATA
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers['ETag'] and resp.headers['Last-Modified']
+
+
+def test_range(test_app, filename):
+    resp = _get(test_app, filename, headers={'Range': 'bytes=10-19'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 10-19/{len(DATA)}'
+    assert resp.get_data() == DATA[10:20]
+
+
+def test_not_modified(test_app, filename):
+    resp = _get(test_app, filename)
+    etag, last_modified = resp.headers['ETag'], resp.headers['Last-Modified']
+    assert _get(test_app, filename, headers={'If-None-Match': etag}).status_code == 304
+    assert _get(test_app, filename, headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert _get(test_app, filename, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize('path', ['..%2Fsecret.txt', 'missing.wav', 'dir'])
+def test_not_found(test_app, filename, path):
+    assert _get(test_app, path).status_code == 404
+
+
+def test_x_accel_redirect(test_app, filename, monkeypatch):
+    monkeypatch.setitem(test_app.config, 'FILE_OFFLOAD', 'x-accel-redirect')
+    resp = _get(test_app, filename)
+    assert resp.status_code == 200
+    assert resp.headers['X-Accel-Redirect'] == test_app.config['FILE_OFFLOAD_PREFIX'] + 'audio%201.wav'
+    assert resp.get_data() == b''
+
+
+def test_x_sendfile(test_app, filename, monkeypatch):
+    monkeypatch.setitem(test_app.config, 'FILE_OFFLOAD', 'x-sendfile')
+    resp = _get(test_app, filename)
+    assert resp.status_code == 200
+    assert resp.headers['X-Sendfile'] == os.path.join(test_app.config['FILE_FOLDER'], filename)
+    assert resp.get_data() == b''
@@ -0,0 +1,39 @@
+from phaunos.shared import db
+from phaunos.phaunos.jobs import job_handler, enqueue, claim_job, run_next_job
+from phaunos.phaunos.models import Job, JobState
+
+
+@job_handler('test_fail')
+def _fail(connection, params, progress):
+    raise RuntimeError('failed')
+
+
+@job_handler('test_reclaimed')
+def _reclaimed(connection, params, progress):
+    # another worker claims the job, as if this one was stalled
+    with db.engine.begin() as other:
+        claim_job(other, 'other worker', heartbeat_timeout=-1)
+
+
+def _queue(kind):
+    job_id = enqueue(db.session.connection(), kind, {})
+    db.session.commit()
+    return job_id
+
+
+def test_retry_delay(empty_db):
+    job_id = _queue('test_fail')
+    assert run_next_job() == job_id
+    job = Job.query.get(job_id)
+    assert job.state == JobState.PENDING
+    assert job.next_attempt_at > job.started_at
+    # not retried before its next attempt
+    assert run_next_job() is None
+
+
+def test_reclaimed(empty_db):
+    job_id = _queue('test_reclaimed')
+    assert run_next_job('worker') == job_id
+    job = Job.query.get(job_id)
+    # not marked as succeeded by the first worker
+    assert (job.state, job.worker) == (JobState.RUNNING, 'other worker')
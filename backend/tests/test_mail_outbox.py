@@ -0,0 +1,105 @@
+import smtpd
+import asyncore
+import threading
+import pytest
+from phaunos.shared import db
+from phaunos.email_utils import send_email, deliver_outbox
+from phaunos.user.models import OutboxMessage
+
+
+class SMTPStandIn(smtpd.SMTPServer):
+    """Local SMTP server recording the messages it receives. Messages to
+    the addresses of refused (address -> SMTP reply) are refused."""
+
+    def __init__(self):
+        super(SMTPStandIn, self).__init__(('127.0.0.1', 0), None, decode_data=True)
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self.refused = {}
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        for rcpt in rcpttos:
+            if rcpt in self.refused:
+                return self.refused[rcpt]
+        self.received.append((rcpttos, data))
+
+
+@pytest.fixture(scope='module')
+def smtp_server():
+    server = SMTPStandIn()
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.close()
+    thread.join()
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    return {'MAIL_OUTBOX_RETRY_DELAY': 0, 'MAIL_OUTBOX_MAX_ATTEMPTS': 2}
+
+
+@pytest.fixture(scope='module')
+def test_app(test_app, smtp_server):
+    # the mail extension reads its configuration on initialization
+    state = test_app.extensions['mail']
+    state.suppress = False
+    state.server = '127.0.0.1'
+    state.port = smtp_server.port
+    state.use_tls = state.use_ssl = False
+    state.username = state.password = None
+    return test_app
+
+
+def test_delivery(smtp_server, empty_db):
+    for i in range(3):
+        send_email(f'user{i}@phaunos.org', 'subject', '<p>body</p>')
+    # nothing is queued before the transaction commits
+    assert deliver_outbox() == 0
+    db.session.commit()
+
+    del smtp_server.received[:]
+    assert deliver_outbox() == 3
+    assert deliver_outbox() == 0
+    assert sorted(rcpttos[0] for rcpttos, _ in smtp_server.received) == \
+        ['user0@phaunos.org', 'user1@phaunos.org', 'user2@phaunos.org']
+    assert OutboxMessage.query.filter(OutboxMessage.sent_at==None).count() == 0
+
+
+def test_retry(smtp_server, empty_db):
+    smtp_server.refused = {
+        'later@phaunos.org': '451 Try again later',
+        'never@phaunos.org': '550 No such user',
+    }
+    send_email('later@phaunos.org', 'subject', '<p>body</p>')
+    send_email('never@phaunos.org', 'subject', '<p>body</p>')
+    db.session.commit()
+
+    assert deliver_outbox() == 2
+    later = OutboxMessage.query.filter_by(recipient='later@phaunos.org').one()
+    never = OutboxMessage.query.filter_by(recipient='never@phaunos.org').one()
+    # transient error: retried, permanent error: given up
+    assert later.attempts == 1 and later.sent_at is None and later.failed_at is None
+    assert never.attempts == 1 and never.failed_at is not None
+    db.session.rollback()
+
+    smtp_server.refused = {}
+    assert deliver_outbox() == 1
+    later = OutboxMessage.query.filter_by(recipient='later@phaunos.org').one()
+    assert later.attempts == 2 and later.sent_at is not None
+
+
+def test_connection_error(smtp_server, test_app, empty_db):
+    send_email('user@phaunos.org', 'subject', '<p>body</p>')
+    db.session.commit()
+
+    state = test_app.extensions['mail']
+    port, state.port = state.port, 1
+    try:
+        assert deliver_outbox() == 1
+        assert deliver_outbox() == 1
+    finally:
+        state.port = port
+    message = OutboxMessage.query.one()
+    # MAIL_OUTBOX_MAX_ATTEMPTS reached
+    assert message.attempts == 2 and message.failed_at is not None
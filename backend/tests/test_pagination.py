@@ -0,0 +1,32 @@
+import json
+import base64
+import pytest
+from phaunos.phaunos.pagination import encode_cursor
+
+
+def test_pages(test_app, project, headers):
+    client = test_app.test_client()
+    url = f'/api/phaunos/audios?project_id={project.id}&per_page=7'
+    ids = []
+    resp = client.get(url, headers=headers)
+    while True:
+        assert resp.status_code == 200
+        ids.extend(audio['id'] for audio in json.loads(resp.get_data()))
+        if 'X-Next-Cursor' not in resp.headers:
+            break
+        resp = client.get(url + '&cursor=' + resp.headers['X-Next-Cursor'], headers=headers)
+    assert len(ids) == len(set(ids)) == 30
+
+
+@pytest.mark.parametrize('cursor', [
+    base64.urlsafe_b64encode(b'not json').decode(),
+    encode_cursor({'id': 1}),
+    encode_cursor([1, 2]),
+    encode_cursor(['abc']),
+    encode_cursor([True]),
+    encode_cursor([2**40]),
+])
+def test_invalid_cursor(test_app, project, headers, cursor):
+    url = f'/api/phaunos/audios?project_id={project.id}&cursor={cursor}'
+    resp = test_app.test_client().get(url, headers=headers)
+    assert resp.status_code == 422
@@ -0,0 +1,99 @@
+import pytest
+from sqlalchemy import select, func
+from phaunos.shared import db
+from phaunos.phaunos.models import (
+    Annotation,
+    Audio,
+    Tag,
+    DEFAULT_PARTITION,
+    partition_name,
+    partition_annotations,
+    is_partitioned,
+    convert_annotations,
+)
+
+
+def _annotate(project):
+    annotation = Annotation(project=project, audio=Audio(path=f'{project.name}.wav'), tag=Tag(name='tag'))
+    db.session.add(annotation)
+    return annotation
+
+
+def _partition_of(annotation_id):
+    return db.session.execute(
+        'SELECT tableoid::regclass::text FROM annotation WHERE id = :id',
+        {'id': annotation_id}).scalar()
+
+
+def _exists(name):
+    return db.session.execute(select([func.to_regclass(name)])).scalar() is not None
+
+
+def test_project_partition(empty_db, new_project):
+    project = new_project()
+    annotation = _annotate(project)
+    db.session.commit()
+    assert _partition_of(annotation.id) == partition_name(project.id)
+
+    # other partitions are pruned
+    plan = db.session.execute('EXPLAIN ' + str(Annotation.query
+        .filter(Annotation.project_id==project.id)
+        .statement.compile(db.engine, compile_kwargs={'literal_binds': True}))).fetchall()
+    assert partition_name(project.id) in str(plan)
+    assert DEFAULT_PARTITION not in str(plan)
+
+    project_id = project.id
+    db.session.delete(project)
+    db.session.commit()
+    assert not _exists(partition_name(project_id))
+    assert Annotation.query.count() == 0
+
+
+def test_partition_annotations(empty_db, new_project):
+    project = new_project()
+    db.session.flush()
+    # as if the project was created before partitioning
+    db.session.execute(f'DROP TABLE {partition_name(project.id)}')
+    annotation = _annotate(project)
+    db.session.commit()
+    assert _partition_of(annotation.id) == DEFAULT_PARTITION
+
+    assert partition_annotations(db.session.connection()) == 1
+    db.session.commit()
+    assert _partition_of(annotation.id) == partition_name(project.id)
+
+
+def test_convert_annotations(empty_db, new_project):
+    projects = [new_project(f'project{i}') for i in range(2)]
+    annotations = [_annotate(project) for project in projects]
+    db.session.commit()
+    ids = [(a.id, a.project_id) for a in annotations]
+
+    # as created by the migrations
+    db.session.execute('CREATE TEMPORARY TABLE annotation_rows AS SELECT * FROM annotation')
+    db.session.execute('DROP TABLE annotation')
+    db.session.execute('CREATE TABLE annotation ('
+        'id SERIAL PRIMARY KEY, start_time FLOAT, end_time FLOAT, '
+        'tag_id INTEGER NOT NULL REFERENCES tag (id) ON DELETE CASCADE, '
+        'project_id INTEGER NOT NULL REFERENCES project (id) ON DELETE CASCADE, '
+        'audio_id INTEGER NOT NULL REFERENCES audio (id) ON DELETE CASCADE, '
+        'created_by_id INTEGER REFERENCES phaunos_user (id) ON DELETE CASCADE)')
+    db.session.execute('CREATE INDEX ix_annotation_tag_id ON annotation (tag_id, id)')
+    db.session.execute('INSERT INTO annotation SELECT * FROM annotation_rows')
+    db.session.execute("SELECT setval('annotation_id_seq', max(id)) FROM annotation")
+    connection = db.session.connection()
+    assert not is_partitioned(connection)
+
+    assert convert_annotations(connection) == 2
+    assert partition_annotations(connection) == 0
+    db.session.commit()
+    assert is_partitioned(db.session.connection())
+    assert not _exists('annotation_unpartitioned')
+    for annotation_id, project_id in ids:
+        assert _partition_of(annotation_id) == partition_name(project_id)
+
+    # ids follow the copied ones, new projects get their partition
+    annotation = _annotate(new_project('new project'))
+    db.session.commit()
+    assert annotation.id > max(annotation_id for annotation_id, _ in ids)
+    assert _partition_of(annotation.id) == partition_name(annotation.project_id)
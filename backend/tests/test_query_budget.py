@@ -0,0 +1,21 @@
+import pytest
+from phaunos.query_budget import count_queries
+
+
+@pytest.mark.parametrize('per_page', [1, 10, 30])
+def test_tagsets_query_count(test_app, project, per_page):
+    url = f'/api/phaunos/tagsets?project_id={project.id}&per_page={per_page}'
+    with count_queries() as counter:
+        resp = test_app.test_client().get(url)
+    assert resp.status_code == 200
+    # cache version, project, tagsets with creators, tags with creators
+    assert counter.count <= 4
+
+
+@pytest.mark.parametrize('per_page', [1, 10, 30])
+def test_audios_query_count(test_app, project, headers, per_page):
+    url = f'/api/phaunos/audios?project_id={project.id}&per_page={per_page}'
+    with count_queries() as counter:
+        resp = test_app.test_client().get(url, headers=headers)
+    assert resp.status_code == 200
+    assert counter.count <= 4
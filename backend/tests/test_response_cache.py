@@ -0,0 +1,28 @@
+from phaunos.shared import db
+from phaunos.query_budget import count_queries
+from phaunos.phaunos.models import Tagset, tagset_project_rel
+
+
+def test_tagsets_etag(test_app, project):
+    url = f'/api/phaunos/tagsets?project_id={project.id}&per_page=5'
+    client = test_app.test_client()
+    resp = client.get(url)
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+
+    # cached body, and 304 on If-None-Match, after the version lookup only
+    with count_queries() as counter:
+        cached = client.get(url)
+        not_modified = client.get(url, headers={'If-None-Match': etag})
+    assert counter.count == 2
+    assert cached.get_data() == resp.get_data()
+    assert not_modified.status_code == 304
+
+    # renaming a tag of the project changes the version
+    tagset = Tagset.query.join(tagset_project_rel) \
+        .filter(tagset_project_rel.c.project_id==project.id).first()
+    tagset.tags[0].name = 'renamed'
+    db.session.commit()
+    resp = client.get(url, headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
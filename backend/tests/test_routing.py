@@ -0,0 +1,86 @@
+import os
+import pytest
+from sqlalchemy import create_engine, select
+from phaunos.shared import db
+from phaunos.user.models import User
+from phaunos.phaunos.models import create_extensions
+
+
+# Needs a second Postgres instance standing for the replica, with the
+# database, user and password of the first one, e.g.
+# POSTGRES_REPLICA_SERVERS=localhost:5433. There is no replication between
+# them, so rows written to one only are visible from the other one.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('POSTGRES_REPLICA_SERVERS'),
+    reason='POSTGRES_REPLICA_SERVERS not set')
+
+
+@pytest.fixture(scope='module')
+def replica(test_app):
+    # replica engines are read only
+    engine = create_engine(test_app.config['SQLALCHEMY_REPLICA_URIS'][0])
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def test_db(test_app, replica):
+    for bind in (db.engine, replica):
+        with bind.begin() as connection:
+            create_extensions(connection)
+        db.metadata.drop_all(bind=bind)
+        db.metadata.create_all(bind=bind)
+    yield db
+    db.session.remove()
+    for bind in (db.engine, replica):
+        db.metadata.drop_all(bind=bind)
+
+
+def _user(username):
+    return User(username, f'{username}@phaunos.org', 'password')
+
+
+def _add_to_replica(replica, username):
+    user = _user(username)
+    replica.execute(User.__table__.insert().values(
+        username=user.username, email=user.email, password=user.password, is_admin=False))
+
+
+def test_routing(test_app, replica, test_db):
+    _add_to_replica(replica, 'replica_user')
+
+    with test_app.test_request_context(method='GET'):
+        assert db.session.get_bind(clause=select([1])) in db.get_replica_engines()
+        assert User.query.filter_by(username='replica_user').first() is not None
+        db.session.remove()
+
+    with test_app.test_request_context(method='POST'):
+        assert User.query.filter_by(username='replica_user').first() is None
+        db.session.remove()
+
+    assert db.session.get_bind(clause=select([1])) is db.engine
+    assert User.query.filter_by(username='replica_user').first() is None
+    db.session.remove()
+
+
+def test_read_your_writes(test_app, replica, test_db):
+    _add_to_replica(replica, 'replica_user')
+
+    with test_app.test_request_context(method='GET'):
+        assert User.query.filter_by(username='replica_user').first() is not None
+        db.session.add(_user('primary_user'))
+        db.session.flush()
+        # pinned to the primary
+        assert User.query.filter_by(username='primary_user').first() is not None
+        assert User.query.filter_by(username='replica_user').first() is None
+        db.session.commit()
+        assert db.session.get_bind(clause=select([1])) is db.engine
+        db.session.remove()
+
+
+def test_replica_connections(test_app):
+    with db.get_replica_engines()[0].connect() as connection:
+        assert connection.execute('SHOW default_transaction_read_only').scalar() == 'on'
+        timeout = connection.execute(
+            "SELECT setting FROM pg_settings WHERE name = 'statement_timeout'").scalar()
+    assert int(timeout) == test_app.config['SQLALCHEMY_REPLICA_STATEMENT_TIMEOUT']
@@ -0,0 +1,97 @@
+import datetime
+import pytest
+from phaunos.phaunos.models import (
+    Annotation,
+    Audio,
+    Tag,
+    Project,
+    Job,
+    JobState,
+    VisualizationType,
+    annotation_schema,
+    audio_schema,
+    project_schema,
+    job_schema,
+)
+from phaunos.phaunos.serializers import (
+    annotation_encoder,
+    audio_encoder,
+    project_encoder,
+    job_encoder,
+)
+from phaunos.user.models import User
+
+
+# Instances are built in memory, with their foreign keys set as if loaded
+# from the database, and rows are the values of the columns of the encoder.
+
+
+def _user():
+    user = User('user', 'user@phaunos.org', 'password')
+    user.id = 1
+    return user
+
+
+def _annotations():
+    project, audio, tag, user = Project(id=1), Audio(id=2), Tag(id=3), _user()
+    annotations = []
+    for i, (start_time, end_time, created_by) in enumerate([
+            (0.1, 2.5, user),
+            (None, None, user),
+            (1e-07, 12345678.9, None),
+            (0, 3, user)]):
+        a = Annotation(id=i + 1, start_time=start_time, end_time=end_time,
+            project_id=project.id, audio_id=audio.id, tag_id=tag.id,
+            created_by_id=created_by and created_by.id)
+        a.project, a.audio, a.tag, a.created_by = project, audio, tag, created_by
+        annotations.append(a)
+    return annotations
+
+
+def _audios():
+    user = _user()
+    audios = [
+        Audio(id=1, path='audio0.wav', duration=12.5, sample_rate=44100,
+            n_channels=2, size=2**40, mtime=1546300800.123456, created_by_id=user.id),
+        Audio(id=2, path='dir/"quoted" é.wav'),
+    ]
+    audios[0].created_by = user
+    return audios
+
+
+def _projects():
+    return [
+        Project(id=1, name='project', visualization_type=VisualizationType.SPECTROGRAM,
+            allow_regions=True, audiolist_filename='audiolist.csv',
+            taglist_filename='taglist.csv', min_annotations_per_file=2, members_only=False),
+        Project(id=2, name='other', visualization_type=VisualizationType.WAVEFORM,
+            allow_regions=False, audiolist_filename='audios.csv',
+            taglist_filename='tags.csv', min_annotations_per_file=1, members_only=True),
+    ]
+
+
+def _jobs():
+    created_at = datetime.datetime(2019, 1, 2, 3, 4, 5, 678901)
+    return [
+        Job(id=1, kind='ingest', params={'project_id': 1, 'paths': ['a', 'b']},
+            key='ingest:1', state=JobState.SUCCEEDED, progress=1.0, message=None,
+            attempts=1, project_id=1, created_by_id=None, created_at=created_at,
+            started_at=created_at, heartbeat_at=created_at + datetime.timedelta(seconds=1),
+            next_attempt_at=created_at, finished_at=datetime.datetime(2019, 1, 2, 3, 5)),
+        Job(id=2, kind='purge', params={}, key='purge:user:1', state=JobState.PENDING,
+            progress=0.25, message='failed: "error"', attempts=0, project_id=None,
+            created_by_id=1, created_at=created_at, started_at=None, heartbeat_at=None,
+            next_attempt_at=created_at, finished_at=None),
+    ]
+
+
+@pytest.mark.parametrize('encoder, schema, instances', [
+    (annotation_encoder, annotation_schema, _annotations),
+    (audio_encoder, audio_schema, _audios),
+    (project_encoder, project_schema, _projects),
+    (job_encoder, job_schema, _jobs),
+])
+def test_encoder_output(test_app, encoder, schema, instances):
+    objs = instances()
+    rows = [tuple(getattr(obj, column.key) for column in encoder.columns) for obj in objs]
+    assert encoder.dumps(rows) == schema.dumps(objs, many=True)
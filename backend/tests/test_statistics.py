@@ -0,0 +1,39 @@
+from phaunos.shared import db
+from phaunos.query_budget import count_queries
+from phaunos.phaunos.models import (
+    Project,
+    Annotation,
+    audio_project_rel,
+    tagset_project_rel,
+    tag_tagset_rel,
+)
+
+
+def test_statistics(test_app, project, headers):
+    audio_id, = db.session.query(audio_project_rel.c.audio_id) \
+        .filter(audio_project_rel.c.project_id==project.id).first()
+    tag_id, = db.session.query(tag_tagset_rel.c.tag_id) \
+        .join(tagset_project_rel, tagset_project_rel.c.tagset_id==tag_tagset_rel.c.tagset_id) \
+        .filter(tagset_project_rel.c.project_id==project.id).first()
+    client = test_app.test_client()
+    resp = client.post(f'/api/phaunos/annotations?project_id={project.id}', headers=headers, json=[
+        {'audio_id': audio_id, 'tag_id': tag_id, 'start_time': 1, 'end_time': 3},
+        {'audio_id': audio_id, 'tag_id': tag_id, 'start_time': 2, 'end_time': 2.5}])
+    assert resp.status_code == 201
+
+    url = f'/api/phaunos/projects/{project.id}/statistics'
+    with count_queries() as counter:
+        resp = client.get(url, headers=headers)
+    assert resp.status_code == 200
+    assert counter.count <= 6
+    stats = resp.get_json()
+    assert (stats['n_annotations'], stats['annotated_seconds']) == (2, 2.5)
+    assert stats['tags'] == [{'tag_id': tag_id, 'n_annotations': 2, 'annotated_seconds': 2.5}]
+    assert stats['audios'] == [{'audio_id': audio_id, 'n_annotations': 2, 'annotated_seconds': 2.5}]
+
+    # updated on flush
+    db.session.delete(Annotation.query.filter(Annotation.start_time==1).one())
+    db.session.commit()
+    stats = client.get(url, headers=headers).get_json()
+    assert (stats['n_annotations'], stats['annotated_seconds']) == (1, 0.5)
+    assert Project.query.get(project.id).n_annotations == 1
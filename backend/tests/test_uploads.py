@@ -0,0 +1,88 @@
+import os
+import hashlib
+import pytest
+from phaunos.shared import db
+from phaunos.phaunos.models import Upload, audio_project_rel
+from phaunos.phaunos.uploads import open_partial
+
+
+CONTENT = os.urandom(3000)
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    return {'UPLOAD_BLOCK_SIZE': 512}
+
+
+def _n_audios(project_id):
+    return db.session.query(audio_project_rel).filter_by(project_id=project_id).count()
+
+
+def _upload(client, headers, chunks):
+    resp = client.post('/api/phaunos/uploads', headers=headers,
+        json={'filename': 'recording.wav', 'size': len(CONTENT)})
+    assert resp.status_code == 201
+    url = resp.headers['Location']
+    offset = 0
+    for chunk in chunks:
+        resp = client.patch(url, data=chunk, headers=dict(headers, **{'Upload-Offset': str(offset)}))
+        assert resp.status_code == 200
+        offset += len(chunk)
+        assert resp.get_json()['offset'] == offset
+    return resp.get_json()
+
+
+def test_upload(test_app, project, headers):
+    client = test_app.test_client()
+    first = _upload(client, headers, [CONTENT[:1000], CONTENT[1000:]])
+    assert first['offset'] == len(CONTENT)
+    assert first['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    with open(os.path.join(test_app.config['FILE_FOLDER'], first['path']), 'rb') as f:
+        assert f.read() == CONTENT
+
+    # resumed after the offset was lost by the client
+    resp = client.post('/api/phaunos/uploads', headers=headers,
+        json={'filename': 'copy.wav', 'size': len(CONTENT)})
+    url = resp.headers['Location']
+    client.patch(url, data=CONTENT[:700], headers=dict(headers, **{'Upload-Offset': '0'}))
+    resp = client.patch(url, data=CONTENT, headers=dict(headers, **{'Upload-Offset': '0'}))
+    assert resp.status_code == 409
+    offset = client.get(url, headers=headers).get_json()['offset']
+    assert offset == 700
+    resp = client.patch(url, data=CONTENT[offset:], headers=dict(headers, **{'Upload-Offset': str(offset)}))
+    second = resp.get_json()
+    # stored once
+    assert second['path'] == first['path']
+
+    n_audios = _n_audios(project.id)
+    resp = client.post(f'/api/phaunos/projects/{project.id}/audios', headers=headers,
+        json={'uploads': [first['id'], second['id']]})
+    assert resp.status_code == 201
+    audio_ids = resp.get_json()['audios']
+    assert audio_ids[first['id']] == audio_ids[second['id']]
+    assert _n_audios(project.id) == n_audios + 1
+
+
+def test_upload_too_large(test_app, project, headers):
+    client = test_app.test_client()
+    resp = client.post('/api/phaunos/uploads', headers=headers,
+        json={'filename': 'recording.wav', 'size': 10})
+    url = resp.headers['Location']
+    resp = client.patch(url, data=CONTENT[:20], headers=dict(headers, **{'Upload-Offset': '0'}))
+    assert resp.status_code == 413
+    assert client.get(url, headers=headers).get_json()['offset'] == 0
+
+
+def test_upload_locked(test_app, project, headers):
+    client = test_app.test_client()
+    resp = client.post('/api/phaunos/uploads', headers=headers,
+        json={'filename': 'recording.wav', 'size': len(CONTENT)})
+    url = resp.headers['Location']
+    upload = Upload.query.get(resp.get_json()['id'])
+    # as if another request was writing
+    with open_partial(upload):
+        resp = client.patch(url, data=CONTENT, headers=dict(headers, **{'Upload-Offset': '0'}))
+        assert resp.status_code == 409
+    resp = client.patch(url, data=CONTENT, headers=dict(headers, **{'Upload-Offset': '0'}))
+    assert resp.status_code == 200
+    assert resp.get_json()['offset'] == len(CONTENT)